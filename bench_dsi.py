@@ -0,0 +1,308 @@
+# =========================================================
+# BENCHMARK OFFLINE
+# Agendas sintéticas (tamanho, eventos de vários dias e
+# recorrências configuráveis) servidas pelos serviços locais.
+# Cada etapa do pipeline é cronometrada em todas as repetições,
+# e o resultado vai para um JSON comparável entre versões:
+#   python bench_dsi.py --saida atual.json --comparar anterior.json
+# --texto isola a limpeza e a classificação de texto, com e
+# sem memo, sobre os textos das mesmas agendas.
+#
+# Fica fora do app: importa dsi_app (sem abrir a interface) e
+# dsi_offline, e roda também com DSI_MODO_GOOGLE="real", sem
+# tocar na rede. Os testes usam daqui as agendas sintéticas.
+# =========================================================
+
+import argparse
+import datetime
+import json
+import platform
+import random
+import statistics
+import time
+
+import pandas as pd
+
+import dsi_offline
+from dsi_app import (
+    IDS, MODO_BUSCA_CALENDAR, MOTOR_EVENTOS, TAXAS_API,
+    ArmazemEventos, Evento, _limpar_texto, agendas_da_tabela, bullets_periodo,
+    buscar_atividades_futuras, buscar_atividades_futuras_pandas, buscar_fase, buscar_feriados,
+    buscar_operacoes, buscar_si_duplo, construir_tabela_semana, construir_tabela_semana_pandas,
+    contar, controle_taxa, criar_google_doc, criar_google_doc_docx, data_hoje, desduplicar_por_prioridade,
+    exportar_excel, extrair_fase_texto, extrair_si_texto, fases_documento_dsi, fmt_periodo_titulo,
+    gerar_docx_dsi, montar_textos_dsi, planejar_janelas_dsi, render_tabela_html, semanas_dsi,
+)
+
+def servicos_locais(agendas: dict):
+    """(GoogleLocal, credencial) novos sobre `agendas`, sem gravações nem disco."""
+    google = dsi_offline.GoogleLocal(agendas, contar=contar)
+    return google, dsi_offline.CredenciaisLocais(google)
+
+TITULOS_SINTETICOS = (
+    "Instrução de tiro", "Formatura geral", "Marcha 12 km", "SI 05 - Semana de instrução",
+    "Fase Básica", "Op Ágata (ADST)", "Curso CIOU Smn 2/6", "Reunião de coordenação",
+    "TFM", "Manutenção de armamento", "Exercício no terreno", "Dia do Exército",
+)
+LOCAIS_SINTETICOS     = ("Quartel", "Stand de tiro", "Campo de instrução", "Auditório", "")
+DESCRICOES_SINTETICAS = ("", "", "Sgt Silva, Cb Souza", "SI - 3", "Uniforme 9º B1\nLevar cantil")
+FUSO_SINTETICO        = datetime.timezone(datetime.timedelta(hours=-3))
+
+def _horario(inicio: datetime.datetime, duracao: datetime.timedelta) -> dict:
+    return {"start": {"dateTime": inicio.isoformat()}, "end": {"dateTime": (inicio + duracao).isoformat()}}
+
+def agendas_sinteticas(calendar_ids, eventos_por_agenda: int, frac_varios_dias: float = 0.15,
+                       frac_recorrentes: float = 0.1, ref_date: datetime.date = None, semente: int = 1) -> dict:
+    """{calendar_id: items} no formato de events().list, de 60 dias antes a 100 dias depois
+    de ref_date. Uma recorrência vem como o evento-mestre (com "recurrence") mais as
+    ocorrências semanais já expandidas; só as ocorrências contam em eventos_por_agenda."""
+    rnd      = random.Random(semente)
+    ref_date = ref_date or data_hoje()
+    agendas  = {}
+    for n_agenda, cal_id in enumerate(calendar_ids):
+        items, gerados, k = [], 0, 0
+        while gerados < eventos_por_agenda:
+            k   += 1
+            eid  = f"sint{n_agenda}x{k}"
+            dia  = ref_date + datetime.timedelta(days=rnd.randint(-60, 100))
+            base = {"status": "confirmed", "updated": "2026-01-01T00:00:00Z", "summary": rnd.choice(TITULOS_SINTETICOS),
+                    "location": rnd.choice(LOCAIS_SINTETICOS), "description": rnd.choice(DESCRICOES_SINTETICAS)}
+            sorteio = rnd.random()
+            if sorteio < frac_recorrentes:
+                vezes   = min(rnd.randint(2, 8), eventos_por_agenda - gerados)
+                inicio  = datetime.datetime.combine(dia, datetime.time(rnd.choice((7, 8, 14))), FUSO_SINTETICO)
+                duracao = datetime.timedelta(hours=2)
+                items.append(dict(base, id=eid, recurrence=[f"RRULE:FREQ=WEEKLY;COUNT={vezes}"], **_horario(inicio, duracao)))
+                for semana in range(vezes):
+                    inicio_i = inicio + datetime.timedelta(weeks=semana)
+                    items.append(dict(base, id=f"{eid}_{inicio_i:%Y%m%dT%H%M%S}", recurringEventId=eid,
+                                      **_horario(inicio_i, duracao)))
+                gerados += vezes
+            elif sorteio < frac_recorrentes + frac_varios_dias:
+                fim = dia + datetime.timedelta(days=rnd.randint(2, 10))
+                items.append(dict(base, id=eid, start={"date": dia.isoformat()}, end={"date": fim.isoformat()}))
+                gerados += 1
+            else:
+                inicio = datetime.datetime.combine(dia, datetime.time(rnd.randint(6, 20), rnd.choice((0, 30))), FUSO_SINTETICO)
+                items.append(dict(base, id=eid, **_horario(inicio, datetime.timedelta(hours=rnd.choice((1, 2, 4, 30))))))
+                gerados += 1
+        agendas[cal_id] = items
+    return agendas
+
+def sem_limite_de_taxa(creds):
+    """Os serviços locais não têm cota: o benchmark mede o código, não o ritmo do controlador."""
+    for api in TAXAS_API:
+        controlador = controle_taxa(creds, api)
+        controlador.taxa = controlador.taxa_maxima = controlador.rajada = 1e9
+        controlador.cota_minuto = 0
+
+def rodada_benchmark(agendas: dict, ref_date: datetime.date, motor: str, modo_busca: str):
+    """Uma passada pelo pipeline inteiro, sobre serviços locais novos: (tempos, contagens)."""
+    google, creds = servicos_locais(agendas)
+    sem_limite_de_taxa(creds)
+    tempos = {}
+    ini_sm1, fim_sm1, ini_s, fim_s, ini_s1, fim_s1 = semanas_dsi(ref_date)
+    semanas = ((ini_sm1, fim_sm1, "sm1"), (ini_s, fim_s, "s"), (ini_s1, fim_s1, "s1"))
+    if motor == "pandas":
+        tabela, futuras = construir_tabela_semana_pandas, buscar_atividades_futuras_pandas
+    else:
+        tabela, futuras = construir_tabela_semana, buscar_atividades_futuras
+
+    def etapa(nome, funcao, *args, **kwargs):
+        inicio = time.perf_counter()
+        resultado = funcao(*args, **kwargs)
+        tempos[nome] = tempos.get(nome, 0.0) + time.perf_counter() - inicio
+        return resultado
+
+    # busca e normalização são medidas dentro do armazém
+    armazem = ArmazemEventos(creds, modo_busca=modo_busca)
+    planejar_janelas_dsi(armazem, ini_sm1, ini_s, fim_s, ini_s1, fim_s1, True, True)
+    armazem.carregar()
+    tempos.update(armazem.tempos)
+
+    def extrair():
+        return (buscar_feriados(armazem, ini_sm1, fim_s1),
+                buscar_si_duplo(armazem, ini_s, fim_s, ini_s1, fim_s1),
+                buscar_fase(armazem, ini_s, fim_s1) or "Mdd Adm",
+                buscar_operacoes(armazem, ini_s, fim_s1),
+                bullets_periodo(armazem, IDS["cursos"], ini_s, fim_s1, incluir_responsavel=True),
+                bullets_periodo(armazem, IDS["datas"],  ini_s, fim_s1))
+    feriados, si, fase, operacoes, cursos, datas = etapa("extracao", extrair)
+
+    # seleção da janela + desduplicação por prioridade, isoladas do resto da tabela
+    ids_tabela = [IDS[c] for c in agendas_da_tabela(True, True)]
+    for d_ini, d_fim, _ in semanas:
+        etapa("deduplicacao", lambda: desduplicar_por_prioridade(armazem.eventos_varios(ids_tabela, d_ini, d_fim)))
+    rows   = [etapa("tabelas", tabela, armazem, d_ini, d_fim, True, True, feriados, semana_tipo=tipo)
+              for d_ini, d_fim, tipo in semanas]
+    linhas_futuras = etapa("futuras", futuras, armazem, fim_s1)
+    html   = [etapa("preview_html", render_tabela_html, r, [x.get('_especial', False) for x in r], f"tabela_{tipo}", tipo)
+              for r, (_, _, tipo) in zip(rows, semanas)]
+    excel  = etapa("excel", exportar_excel, *rows, "001", si, fase, operacoes, linhas_futuras)
+
+    hoje   = data_hoje()
+    fg     = {"finalidade": "", "dia": "", "dobrado": "", "cancao": "", "gs": "", "armado": ""}
+    textos = (hoje, ini_sm1, fim_sm1, ini_s, fim_s, ini_s1, fim_s1, si, fase, operacoes, cursos, datas)
+    fases  = etapa("requests_docs", lambda: fases_documento_dsi(
+        *montar_textos_dsi("001", *textos, linhas_futuras, fg, "", ""), *rows, cursos, linhas_futuras))
+    docx   = etapa("docx", gerar_docx_dsi, "001", *textos, *rows, linhas_futuras, fg)
+
+    titulo = f"DIRETRIZ SEMANAL DE INSTRUÇÃO 001 ({fmt_periodo_titulo(ini_s1, fim_s1)})"
+    chamadas_leitura = google.chamadas()
+    argumentos = (creds, titulo, "001", ref_date, ini_sm1, fim_sm1, ini_s, fim_s, ini_s1, fim_s1,
+                  si, fase, operacoes, cursos, datas, *rows, linhas_futuras)
+    doc_id = etapa("envio_docs", criar_google_doc, *argumentos, fg=fg)
+    etapa("envio_docx", criar_google_doc_docx, *argumentos, fg=fg)
+
+    contagens = {
+        "eventos_gravados":  sum(len(items) for items in agendas.values()),
+        "eventos_carregados": sum(len(evs) for _, _, evs in armazem._eventos.values()),
+        "linhas_tabelas":    [len(r) for r in rows],
+        "linhas_futuras":    len(linhas_futuras),
+        "requests_docs":     {nome: len(reqs) for nome, reqs in fases},
+        "requests_aplicados": google.documento(doc_id).aplicados,
+        "chamadas_leitura":  chamadas_leitura,
+        "chamadas_total":    google.chamadas(),
+        "bytes":             {"preview_html": sum(len(h) for h in html), "excel": len(excel), "docx": len(docx)},
+    }
+    return tempos, contagens
+
+def executar_benchmark(eventos_por_agenda: int = 200, n_agendas: int = None, frac_varios_dias: float = 0.15,
+                       frac_recorrentes: float = 0.1, repeticoes: int = 3, semente: int = 1,
+                       ref_date: datetime.date = datetime.date(2026, 3, 4), motor: str = MOTOR_EVENTOS,
+                       modo_busca: str = MODO_BUSCA_CALENDAR) -> dict:
+    """n_agendas limita quantas agendas recebem eventos; as demais existem, vazias."""
+    todas   = list(dict.fromkeys(IDS.values()))
+    agendas = agendas_sinteticas(todas[:n_agendas] if n_agendas else todas, eventos_por_agenda,
+                                 frac_varios_dias, frac_recorrentes, ref_date, semente)
+    agendas.update({cal_id: [] for cal_id in todas if cal_id not in agendas})
+
+    rodadas = [rodada_benchmark(agendas, ref_date, motor, modo_busca) for _ in range(max(1, repeticoes))]
+    etapas  = {}
+    for nome in rodadas[0][0]:
+        amostras = [tempos.get(nome, 0.0) for tempos, _ in rodadas]
+        etapas[nome] = {"min": min(amostras), "mediana": statistics.median(amostras),
+                        "amostras": [round(a, 6) for a in amostras]}
+    return {
+        "criado_em":  datetime.datetime.now().isoformat(timespec="seconds"),
+        "ambiente":   {"python": platform.python_version(), "pandas": pd.__version__, "plataforma": platform.platform()},
+        "parametros": {"eventos_por_agenda": eventos_por_agenda, "agendas_com_eventos": n_agendas or len(todas),
+                       "agendas": len(todas), "frac_varios_dias": frac_varios_dias, "frac_recorrentes": frac_recorrentes,
+                       "repeticoes": len(rodadas), "semente": semente, "ref_date": ref_date.isoformat(),
+                       "motor": motor, "modo_busca": modo_busca},
+        "etapas":     etapas,
+        "contagens":  rodadas[-1][1],
+    }
+
+def relatorio_benchmark(atual: dict, anterior: dict = None) -> list:
+    """Uma linha por etapa (mediana em ms) e, com `anterior`, a razão agora/antes."""
+    linhas = []
+    if anterior and anterior.get("parametros") != atual["parametros"]:
+        linhas.append("⚠️ parâmetros diferentes dos do benchmark anterior: a comparação é só indicativa")
+    for nome, medida in atual["etapas"].items():
+        agora = medida["mediana"] * 1000
+        antes = (anterior or {}).get("etapas", {}).get(nome)
+        if antes is None:
+            linhas.append(f"{nome:<16}{agora:10.1f} ms")
+        else:
+            razao = medida["mediana"] / antes["mediana"] if antes["mediana"] else float("inf")
+            linhas.append(f"{nome:<16}{antes['mediana'] * 1000:10.1f} → {agora:10.1f} ms  ×{razao:.2f}")
+    linhas.append(f"chamadas: {atual['contagens']['chamadas_total']}")
+    return linhas
+
+# =========================================================
+# LIMPEZA E CLASSIFICAÇÃO DE TEXTO
+# =========================================================
+
+def textos_sinteticos(agendas: dict) -> dict:
+    """Entradas de cada função de texto como o pipeline as passa: os campos crus
+    para _limpar_texto e o texto completo do evento para SI e FASE."""
+    campos, completos = [], []
+    for items in agendas.values():
+        for ev in items:
+            campos += [ev.get("summary", ""), ev.get("location", ""), ev.get("description", "")]
+            completos.append(Evento(ev, "").texto_completo)
+    return {"_limpar_texto": campos, "extrair_si_texto": completos, "extrair_fase_texto": completos}
+
+def benchmark_texto(eventos_por_agenda: int = 200, repeticoes: int = 5, semente: int = 1,
+                    ref_date: datetime.date = datetime.date(2026, 3, 4)) -> dict:
+    """Por função: ms por passada sobre as entradas sem memo (__wrapped__), com o cache
+    vazio e com o cache já preenchido (reruns), menor tempo entre as repetições."""
+    agendas  = agendas_sinteticas(list(dict.fromkeys(IDS.values())), eventos_por_agenda, ref_date=ref_date, semente=semente)
+    entradas = textos_sinteticos(agendas)
+    funcoes  = {"_limpar_texto": _limpar_texto, "extrair_si_texto": extrair_si_texto, "extrair_fase_texto": extrair_fase_texto}
+    medidas  = {}
+    for nome, funcao in funcoes.items():
+        textos = entradas[nome]
+
+        def passada(f):
+            inicio = time.perf_counter()
+            for texto in textos:
+                f(texto)
+            return (time.perf_counter() - inicio) * 1000
+
+        sem_memo, frio, quente = [], [], []
+        for _ in range(max(1, repeticoes)):
+            sem_memo.append(passada(funcao.__wrapped__))
+            funcao.cache_clear()
+            frio.append(passada(funcao))
+            quente.append(passada(funcao))
+        medidas[nome] = {
+            "entradas": len(textos), "distintas": len(set(textos)),
+            "sem_memo_ms": min(sem_memo), "frio_ms": min(frio), "quente_ms": min(quente),
+            "iguais": all(funcao(t) == funcao.__wrapped__(t) for t in set(textos)),
+        }
+    return {
+        "criado_em":  datetime.datetime.now().isoformat(timespec="seconds"),
+        "ambiente":   {"python": platform.python_version(), "plataforma": platform.platform()},
+        "parametros": {"eventos_por_agenda": eventos_por_agenda, "repeticoes": max(1, repeticoes),
+                       "semente": semente, "ref_date": ref_date.isoformat()},
+        "funcoes":    medidas,
+    }
+
+def relatorio_benchmark_texto(resultado: dict) -> list:
+    linhas = []
+    for nome, m in resultado["funcoes"].items():
+        ganho = m["sem_memo_ms"] / m["quente_ms"] if m["quente_ms"] else float("inf")
+        linhas.append(f"{nome:<20}{m['entradas']:7d} entradas ({m['distintas']} distintas)  "
+                      f"sem memo {m['sem_memo_ms']:8.2f} ms  frio {m['frio_ms']:8.2f} ms  "
+                      f"quente {m['quente_ms']:8.2f} ms  ×{ganho:.1f}"
+                      + ("" if m["iguais"] else "  ⚠️ resultados diferentes sem memo"))
+    return linhas
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark offline da DSI sobre agendas sintéticas.")
+    parser.add_argument("--eventos", type=int, default=200, help="eventos por agenda")
+    parser.add_argument("--agendas", type=int, help="agendas com eventos (padrão: todas)")
+    parser.add_argument("--varios-dias", type=float, default=0.15, help="fração de eventos de vários dias")
+    parser.add_argument("--recorrentes", type=float, default=0.1, help="fração de séries recorrentes")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--semente", type=int, default=1)
+    parser.add_argument("--data", type=datetime.date.fromisoformat, default=datetime.date(2026, 3, 4),
+                        help="data de referência AAAA-MM-DD")
+    parser.add_argument("--motor", default=MOTOR_EVENTOS, choices=("python", "pandas"))
+    parser.add_argument("--modo-busca", default=MODO_BUSCA_CALENDAR, choices=("paralelo", "lote"))
+    parser.add_argument("--saida", help="JSON com os tempos e contagens")
+    parser.add_argument("--comparar", help="JSON de um benchmark anterior")
+    parser.add_argument("--texto", action="store_true",
+                        help="cronometra _limpar_texto, extrair_si_texto e extrair_fase_texto com e sem memo")
+    args = parser.parse_args(argv)
+
+    if args.texto:
+        resultado = benchmark_texto(args.eventos, args.repeticoes, args.semente, args.data)
+        print("\n".join(relatorio_benchmark_texto(resultado)))
+    else:
+        resultado = executar_benchmark(args.eventos, args.agendas, args.varios_dias, args.recorrentes,
+                                       args.repeticoes, args.semente, args.data, args.motor, args.modo_busca)
+        anterior = None
+        if args.comparar:
+            with open(args.comparar, encoding="utf-8") as f:
+                anterior = json.load(f)
+        print("\n".join(relatorio_benchmark(resultado, anterior)))
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=1)
+    return 0 if all(m["iguais"] for m in resultado.get("funcoes", {}).values()) else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
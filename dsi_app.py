@@ -1,19 +1,40 @@
+import argparse
+import collections
+import contextlib
+import cProfile
+import contextvars
 import datetime
+import email.utils
+import functools
+import hashlib
 import re
 import io
+import os
 import json
+import pstats
+import sqlite3
 import time
 import random
+import sys
+import threading
+import uuid
+import zipfile
 from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape
 
 import streamlit as st
 import pandas as pd
+import numpy as np
+import httplib2
 
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
 from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload
 
 # =========================================================
 # CONFIGURAÇÕES
@@ -93,48 +114,618 @@ RESP_MAP = {
 
 MEU_EMAIL = IDS["s3"]
 
+def config_dsi(chave: str, padrao):
+    """Lê configuração de variável de ambiente ou de st.secrets, no tipo do valor padrão."""
+    valor = os.environ.get(chave)
+    if valor is None:
+        try:
+            valor = st.secrets.get(chave)
+        except Exception:
+            valor = None
+    if valor is None:
+        return padrao
+    if isinstance(padrao, bool):
+        return str(valor).strip().lower() in ("1", "true", "sim", "yes", "on")
+    return type(padrao)(valor)
+
+DIR_BASE_DSI       = os.path.join(os.path.expanduser("~"), ".cache", "dsi_24bis")
+# APIs Google: "real", "gravar" (reais, gravando as respostas em DIR_GRAVACOES) ou "offline" (serviços locais)
+MODO_GOOGLE        = config_dsi("DSI_MODO_GOOGLE", "real")
+DIR_GRAVACOES      = config_dsi("DSI_DIR_GRAVACOES", os.path.join(DIR_BASE_DSI, "gravacoes"))
+# Data de hoje fixa (AAAA-MM-DD), para execuções reprodutíveis
+HOJE_FIXO          = config_dsi("DSI_HOJE", "")
+# Cache local de eventos (SQLite); offline tem diretório próprio, sem misturar checkpoints de documentos locais
+CACHE_DIR          = config_dsi("DSI_CACHE_DIR", os.path.join(DIR_BASE_DSI, "offline") if MODO_GOOGLE == "offline" else DIR_BASE_DSI)
+CACHE_TTL_SEGUNDOS = config_dsi("DSI_CACHE_TTL", 900)
+CACHE_MAX_MB       = config_dsi("DSI_CACHE_MAX_MB", 50.0)
+# Sincronização incremental (syncToken): espelho local completo de cada agenda
+SYNC_INCREMENTAL   = config_dsi("DSI_SYNC_INCREMENTAL", False)
+# Exportação: "docx" (documento montado localmente, um único upload) ou "docs_api" (batchUpdate)
+MODO_EXPORTACAO    = config_dsi("DSI_MODO_EXPORTACAO", "docx")
+# Tabelas e atividades futuras: "python" (registro a registro) ou "pandas" (motor colunar)
+MOTOR_EVENTOS      = config_dsi("DSI_MOTOR_EVENTOS", "python")
+
+# Gravação e serviços locais só carregam fora do modo real
+if MODO_GOOGLE != "real":
+    import dsi_offline
+
+# Janelas de busca (em dias) usadas pelos consumidores do armazém de eventos
+MARGEM_SI_FASE_DIAS    = 3
+MARGEM_FUSO_DIAS       = 1
+HORIZONTE_FUTURAS_DIAS = 45
+
 # =========================================================
-# RETRY COM BACKOFF EXPONENCIAL — resolve HTTP 429
+# MÁSCARAS DE CAMPOS (partial response)
+# Cada leitura declara, junto ao código que consome a resposta,
+# os campos de que precisa; a chamada envia `fields=` com ela.
 # =========================================================
 
-def batch_update_com_retry(docs_service, doc_id, requests_list, max_tentativas=6, tamanho_lote=50):
-    if not requests_list:
+MASCARAS_CAMPOS = {}
+
+def mascara_campos(nome: str, campos: str) -> str:
+    MASCARAS_CAMPOS[nome] = "".join(campos.split())
+    return MASCARAS_CAMPOS[nome]
+
+# =========================================================
+# INSTRUMENTAÇÃO POR ETAPA
+# Cada carga da página e cada exportação abre uma Medicao. As
+# etapas (with etapa("...")) guardam o tempo de parede e tudo o
+# que foi contado enquanto estavam abertas: requisições e bytes
+# por API, repetições por 429/5xx, tempo dormindo no controle de
+# taxa e acertos de cache. A medição em curso segue o contexto
+# (contextvars), inclusive nos workers da busca paralela, e ao
+# terminar vira uma linha JSON em ARQUIVO_METRICAS.
+# =========================================================
+
+ARQUIVO_METRICAS = config_dsi("DSI_ARQUIVO_METRICAS", os.path.join(CACHE_DIR, "metricas.jsonl"))
+METRICAS_MAX_MB  = 5.0
+_MEDICAO         = contextvars.ContextVar("medicao_dsi", default=None)
+_LOCK_METRICAS   = threading.Lock()
+
+class Medicao:
+    def __init__(self, operacao: str, **rotulos):
+        self.operacao  = operacao
+        self.rotulos   = rotulos
+        self.criada_em = time.time()
+        self.segundos  = None
+        self.totais    = {}   # contador -> valor
+        self.etapas    = []   # {"nome", "inicio", "segundos", "contadores"}, na ordem de abertura
+        self._abertas  = []
+        self._t0       = time.perf_counter()
+        self._lock     = threading.Lock()
+
+    @contextlib.contextmanager
+    def etapa(self, nome: str):
+        with self._lock:
+            if self._abertas:
+                nome = f"{self._abertas[-1]['nome']}/{nome}"
+            registro = {"nome": nome, "inicio": time.perf_counter() - self._t0, "segundos": None, "contadores": {}}
+            self.etapas.append(registro)
+            self._abertas.append(registro)
+        try:
+            yield registro
+        finally:
+            with self._lock:
+                registro["segundos"] = time.perf_counter() - self._t0 - registro["inicio"]
+                self._abertas.remove(registro)
+
+    def contar(self, contador: str, valor: float = 1):
+        with self._lock:
+            self.totais[contador] = self.totais.get(contador, 0) + valor
+            for registro in self._abertas:
+                registro["contadores"][contador] = registro["contadores"].get(contador, 0) + valor
+
+    def decorrido(self, registro: dict = None) -> float:
+        """Segundos da etapa (ou da medição); se ainda aberta, até agora."""
+        if registro is None:
+            return self.segundos if self.segundos is not None else time.perf_counter() - self._t0
+        if registro["segundos"] is not None:
+            return registro["segundos"]
+        return time.perf_counter() - self._t0 - registro["inicio"]
+
+    def finalizar(self) -> "Medicao":
+        if self.segundos is None:
+            self.segundos = time.perf_counter() - self._t0
+        return self
+
+    def como_dict(self) -> dict:
+        with self._lock:
+            return {
+                "operacao": self.operacao,
+                "rotulos":  self.rotulos,
+                "inicio":   datetime.datetime.fromtimestamp(self.criada_em).isoformat(timespec="milliseconds"),
+                "segundos": round(self.decorrido(), 4),
+                "totais":   {k: round(v, 4) for k, v in self.totais.items()},
+                "etapas":   [{"nome": e["nome"], "inicio": round(e["inicio"], 4), "segundos": round(self.decorrido(e), 4),
+                              "contadores": {k: round(v, 4) for k, v in e["contadores"].items()}} for e in self.etapas],
+            }
+
+def contar(contador: str, valor: float = 1):
+    medicao = _MEDICAO.get()
+    if medicao is not None:
+        medicao.contar(contador, valor)
+
+@contextlib.contextmanager
+def etapa(nome: str):
+    medicao = _MEDICAO.get()
+    if medicao is None:
+        yield None
         return
+    with medicao.etapa(nome) as registro:
+        yield registro
+
+@contextlib.contextmanager
+def medir(operacao: str, **rotulos):
+    """Mede o bloco como uma operação e, ao sair, grava a medição em ARQUIVO_METRICAS."""
+    medicao = Medicao(operacao, **rotulos)
+    token   = _MEDICAO.set(medicao)
+    try:
+        yield medicao
+    finally:
+        _MEDICAO.reset(token)
+        gravar_metricas(medicao.finalizar())
 
-    DELAY_ENTRE_LOTES = 1.2
+def no_contexto(funcao):
+    """funcao presa a uma cópia do contexto atual (com a medição), para rodar num executor."""
+    return functools.partial(contextvars.copy_context().run, funcao)
 
-    for i in range(0, len(requests_list), tamanho_lote):
-        lote = requests_list[i:i + tamanho_lote]
-        for tentativa in range(max_tentativas):
-            try:
-                docs_service.documents().batchUpdate(
-                    documentId=doc_id, body={"requests": lote}
-                ).execute()
-                time.sleep(DELAY_ENTRE_LOTES)
+def gravar_metricas(medicao: Medicao):
+    linha = json.dumps(medicao.como_dict(), ensure_ascii=False, default=str)
+    try:
+        with _LOCK_METRICAS:
+            os.makedirs(os.path.dirname(ARQUIVO_METRICAS) or ".", exist_ok=True)
+            if os.path.exists(ARQUIVO_METRICAS) and os.path.getsize(ARQUIVO_METRICAS) > METRICAS_MAX_MB * 1024 * 1024:
+                os.replace(ARQUIVO_METRICAS, ARQUIVO_METRICAS + ".1")
+            with open(ARQUIVO_METRICAS, "a", encoding="utf-8") as f:
+                f.write(linha + "\n")
+    except OSError as e:
+        registrar_log("METRICAS_NAO_GRAVADAS", str(e))
+
+# Colunas do painel: rótulo -> sufixo do contador (somado entre APIs) ou contador exato
+COLUNAS_MEDICAO = (
+    ("Calendar",      "calendar.requisicoes"),
+    ("Docs",          "docs.requisicoes"),
+    ("requests Docs", "docs.requests"),
+    ("Drive",         "drive.requisicoes"),
+    ("KB recebidos",  ".bytes"),
+    ("429",           ".repeticoes_429"),
+    ("5xx",           ".repeticoes_5xx"),
+    ("espera (s)",    ".espera_s"),
+    ("cache ✓",       "cache.acertos"),
+    ("cache ✗",       "cache.falhas"),
+)
+
+def _valor_coluna(contadores: dict, chave: str) -> float:
+    if chave.startswith("."):
+        return sum(v for k, v in contadores.items() if k.endswith(chave))
+    return contadores.get(chave, 0)
+
+def tabela_medicao(medicao: Medicao) -> pd.DataFrame:
+    """Uma linha por etapa (recuada pela profundidade) e o total; etapas abertas mostram o tempo até agora."""
+    dados  = medicao.como_dict()
+    linhas = []
+    for registro in dados["etapas"] + [{"nome": "TOTAL", "segundos": dados["segundos"], "contadores": dados["totais"]}]:
+        nome, contadores = registro["nome"], registro["contadores"]
+        nivel = nome.count("/")
+        linha = {"etapa": "  " * nivel + ("↳ " if nivel else "") + nome.rsplit("/", 1)[-1], "s": round(registro["segundos"], 3)}
+        for rotulo, chave in COLUNAS_MEDICAO:
+            valor = _valor_coluna(contadores, chave)
+            linha[rotulo] = round(valor / 1024, 1) if rotulo == "KB recebidos" else round(valor, 2)
+        linhas.append(linha)
+    tabela = pd.DataFrame(linhas)
+    vazias = [rotulo for rotulo, _ in COLUNAS_MEDICAO if not tabela[rotulo].any()]
+    return tabela.drop(columns=vazias)
+
+def exibir_medicao(medicao: Medicao, titulo: str):
+    st.markdown(f"**{titulo}** — {medicao.decorrido():.2f}s")
+    st.dataframe(tabela_medicao(medicao), hide_index=True, use_container_width=True)
+
+# =========================================================
+# PERFIL SOB DEMANDA
+# Liga com ?perfil=pagina ou ?perfil=exportacao na URL (vale para
+# um rerun ou para a próxima exportação da sessão) ou, para todas
+# as execuções, com DSI_PERFIL = pagina | exportacao | tudo (env ou
+# secrets). O trecho roda sob cProfile (determinístico) e, ao mesmo
+# tempo, um amostrador lê as pilhas da thread e das threads criadas
+# durante o trecho (workers da busca paralela). Cada perfil gera
+# <nome>.pstats e <nome>.folded (pilhas colapsadas, "a;b;c N", para
+# flamegraph.pl / speedscope) em DIR_PERFIS.
+# =========================================================
+
+PERFIL_DSI            = config_dsi("DSI_PERFIL", "")
+DIR_PERFIS            = config_dsi("DSI_DIR_PERFIS", os.path.join(CACHE_DIR, "perfis"))
+PERFIL_INTERVALO_MS   = config_dsi("DSI_PERFIL_INTERVALO_MS", 5.0)
+MAX_PERFIS_GUARDADOS  = 20
+
+def perfil_pedido(alvo: str, pedido: str = "") -> bool:
+    """alvo: "pagina" ou "exportacao"; pedido vem da URL e soma-se a DSI_PERFIL."""
+    return any(str(p or "").strip().lower() in (alvo, "tudo") for p in (pedido, PERFIL_DSI))
+
+def _quadro_pilha(frame) -> str:
+    codigo = frame.f_code
+    return f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})"
+
+class AmostradorPilhas:
+    """Lê sys._current_frames() a cada intervalo e conta as pilhas, da raiz para a folha."""
+
+    def __init__(self, thread_id: int, intervalo: float):
+        self.thread_id  = thread_id
+        self.intervalo  = intervalo
+        self.contagens  = {}
+        self.amostras   = 0
+        self._antigas   = set(sys._current_frames()) - {thread_id}   # threads que já existiam ficam de fora
+        self._parar     = threading.Event()
+        self._thread    = threading.Thread(target=self._amostrar, name="perfil-dsi", daemon=True)
+
+    def iniciar(self):
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        self._thread.join()
+
+    def _amostrar(self):
+        proprio = threading.get_ident()
+        nomes   = {}
+        while not self._parar.wait(self.intervalo):
+            for ident, frame in sys._current_frames().items():
+                if ident == proprio or ident in self._antigas:
+                    continue
+                if ident not in nomes:
+                    thread = next((t for t in threading.enumerate() if t.ident == ident), None)
+                    nomes[ident] = thread.name if thread else str(ident)
+                pilha = []
+                while frame is not None:
+                    pilha.append(_quadro_pilha(frame))
+                    frame = frame.f_back
+                chave = ";".join([f"thread {nomes[ident]}"] + pilha[::-1])
+                self.contagens[chave] = self.contagens.get(chave, 0) + 1
+            self.amostras += 1
+
+    def colapsadas(self) -> str:
+        return "".join(f"{pilha} {n}\n" for pilha, n in sorted(self.contagens.items()))
+
+class PerfilExecucao:
+    """cProfile + amostrador sobre um trecho; use como `with` ou com iniciar()/parar()."""
+
+    def __init__(self, nome: str, diretorio: str = None):
+        instante       = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")[:-3]
+        self.nome      = f"{instante}_{re.sub(r'[^0-9A-Za-z_-]+', '-', nome)}"
+        self.diretorio = diretorio or DIR_PERFIS
+        self.arquivos  = []
+        self._perfil   = None
+        self._amostrador = None
+        self._inicio   = None
+
+    def iniciar(self) -> "PerfilExecucao":
+        self._perfil = cProfile.Profile()
+        try:
+            self._perfil.enable()
+        except ValueError:
+            # Python >= 3.12: um só cProfile por processo; segue só com as amostras
+            self._perfil = None
+            registrar_log("PERFIL_SEM_CPROFILE", f"{self.nome}: outro perfil em andamento")
+        self._amostrador = AmostradorPilhas(threading.get_ident(), max(0.001, PERFIL_INTERVALO_MS / 1000))
+        self._amostrador.iniciar()
+        self._inicio = time.perf_counter()
+        return self
+
+    def parar(self) -> list:
+        """Encerra e salva; devolve os caminhos gravados."""
+        if self._amostrador is None:
+            return self.arquivos
+        if self._perfil is not None:
+            self._perfil.disable()
+        self._amostrador.parar()
+        segundos = time.perf_counter() - self._inicio
+        try:
+            os.makedirs(self.diretorio, exist_ok=True)
+            base = os.path.join(self.diretorio, self.nome)
+            if self._perfil is not None:
+                self._perfil.dump_stats(base + ".pstats")
+                self.arquivos.append(base + ".pstats")
+            with open(base + ".folded", "w", encoding="utf-8") as f:
+                f.write(self._amostrador.colapsadas())
+            self.arquivos.append(base + ".folded")
+            limpar_perfis_antigos(self.diretorio)
+            registrar_log("PERFIL_SALVO", f"{self.nome}: {segundos:.2f}s, {self._amostrador.amostras} amostras")
+        except OSError as e:
+            registrar_log("PERFIL_NAO_SALVO", f"{self.nome}: {e}")
+        self._amostrador = None
+        return self.arquivos
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.parar()
+        return False
+
+def perfilar(pedido: bool, nome: str):
+    """PerfilExecucao(nome) se pedido, senão um contexto que não faz nada."""
+    return PerfilExecucao(nome) if pedido else contextlib.nullcontext()
+
+def perfis_salvos(diretorio: str = None) -> list:
+    """[(nome, [caminhos])], do mais recente para o mais antigo."""
+    diretorio = diretorio or DIR_PERFIS
+    if not os.path.isdir(diretorio):
+        return []
+    grupos = {}
+    for arquivo in os.listdir(diretorio):
+        nome, ext = os.path.splitext(arquivo)
+        if ext in (".pstats", ".folded"):
+            grupos.setdefault(nome, []).append(os.path.join(diretorio, arquivo))
+    return [(nome, sorted(grupos[nome])) for nome in sorted(grupos, reverse=True)]
+
+def limpar_perfis_antigos(diretorio: str, manter: int = MAX_PERFIS_GUARDADOS):
+    for _, caminhos in perfis_salvos(diretorio)[manter:]:
+        for caminho in caminhos:
+            os.remove(caminho)
+
+def resumo_pstats(caminho: str, linhas: int = 25) -> str:
+    saida = io.StringIO()
+    pstats.Stats(caminho, stream=saida).sort_stats("cumulative").print_stats(linhas)
+    return saida.getvalue()
+
+def painel_perfis():
+    """Perfis salvos em DIR_PERFIS, com download e as funções mais caras de cada um."""
+    salvos = perfis_salvos()
+    if not salvos:
+        st.caption("Nenhum perfil salvo. Abra a página com ?perfil=pagina ou ?perfil=exportacao.")
+        return
+    for nome, caminhos in salvos[:10]:
+        st.markdown(f"**{nome}**")
+        colunas = st.columns(len(caminhos))
+        for coluna, caminho in zip(colunas, caminhos):
+            with open(caminho, "rb") as f:
+                coluna.download_button(os.path.splitext(caminho)[1], f.read(), file_name=os.path.basename(caminho),
+                                       key=f"perfil_{os.path.basename(caminho)}")
+        pstats_arquivo = next((c for c in caminhos if c.endswith(".pstats")), None)
+        if pstats_arquivo and st.checkbox("Top 25 (cumulativo)", key=f"top_{nome}"):
+            st.code(resumo_pstats(pstats_arquivo))
+
+# =========================================================
+# CONTROLE DE TAXA — token bucket adaptativo por API
+# Todas as chamadas Docs, Drive e Calendar passam por um balde
+# de fichas compartilhado: a taxa sobe aos poucos enquanto as
+# respostas vêm bem, cai pela metade em 429/5xx e respeita o
+# Retry-After do servidor. O tamanho do lote segue o trabalho
+# restante em vez de um valor fixo.
+# =========================================================
+
+# (fichas/s iniciais, fichas/s máximas, lote máximo) — a cota de escrita do Docs é 60/min por usuário
+TAXAS_API = {
+    "docs":     (config_dsi("DSI_TAXA_DOCS", 1.0),     2.0,  500),
+    "drive":    (config_dsi("DSI_TAXA_DRIVE", 2.0),     5.0,  1),
+    "calendar": (config_dsi("DSI_TAXA_CALENDAR", 5.0), 10.0, 50),
+}
+# Cota por minuto por usuário (0 = sem janela). Docs: 60 escritas/min; cada batchUpdate conta uma,
+# seja qual for o número de requests dentro dele.
+COTAS_MINUTO = {
+    "docs":     config_dsi("DSI_COTA_DOCS_MINUTO", 60),
+    "drive":    config_dsi("DSI_COTA_DRIVE_MINUTO", 0),
+    "calendar": config_dsi("DSI_COTA_CALENDAR_MINUTO", 0),
+}
+# Duração inicial estimada de uma chamada (s); depois vale a média observada
+LATENCIAS_INICIAIS = {"docs": 2.0, "drive": 0.5, "calendar": 0.3}
+STATUS_REPETIR = {429, 500, 502, 503, 504}
+
+class ControladorTaxa:
+    def __init__(self, nome: str, taxa: float, taxa_maxima: float, lote_maximo: int, rajada: float = 5.0,
+                 cota_minuto: float = 0, latencia: float = 0.5):
+        self.nome        = nome
+        self.taxa        = taxa
+        self.taxa_minima = taxa / 8
+        self.taxa_maxima = max(taxa, taxa_maxima)
+        self.incremento  = self.taxa_maxima / 20
+        self.rajada      = rajada
+        self.lote_maximo = lote_maximo
+        self.lote        = lote_maximo
+        self.chamadas    = 0
+        self.limitadas   = 0
+        self.espera_total = 0.0
+        self.cota_minuto = cota_minuto
+        self.latencia    = latencia               # média móvel da duração de uma chamada
+        self._janela     = collections.deque()    # (instante, custo) do último minuto
+        self._na_janela  = 0.0
+        self._fichas     = rajada
+        self._atualizado = time.monotonic()
+        self._pausa_ate  = 0.0
+        self._lock       = threading.Lock()
+
+    def adquirir(self, custo: float = 1):
+        """Bloqueia até haver fichas; um custo maior que a rajada deixa o balde negativo."""
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self._fichas     = min(self.rajada, self._fichas + (agora - self._atualizado) * self.taxa)
+                self._atualizado = agora
+                espera = self._pausa_ate - agora
+                if espera <= 0:
+                    necessario = min(custo, self.rajada)
+                    if self._fichas < necessario:
+                        espera = (necessario - self._fichas) / self.taxa
+                    else:
+                        espera = self._espera_cota(agora, custo)
+                    if espera <= 0:
+                        self._fichas -= custo
+                        self.chamadas += 1
+                        if self.cota_minuto:
+                            self._janela.append((agora, custo))
+                            self._na_janela += custo
+                        contar(f"{self.nome}.requisicoes", custo)
+                        return
+                self.espera_total += espera
+            contar(f"{self.nome}.espera_s", espera)
+            time.sleep(espera)
+
+    def _espera_cota(self, agora: float, custo: float) -> float:
+        """Segundos até a janela de 60 s comportar `custo` (0 se já cabe ou sem cota)."""
+        while self._janela and self._janela[0][0] <= agora - 60:
+            self._na_janela -= self._janela.popleft()[1]
+        excesso = self._na_janela + custo - self.cota_minuto
+        if not self.cota_minuto or not self._janela or excesso <= 0:
+            return 0.0
+        for instante, c in self._janela:
+            excesso -= c
+            if excesso <= 0:
+                return instante + 60 - agora
+        return self._janela[-1][0] + 60 - agora
+
+    def registrar_latencia(self, segundos: float):
+        with self._lock:
+            self.latencia = 0.8 * self.latencia + 0.2 * segundos
+
+    def prever(self, custos: list) -> float:
+        """Segundos para fazer as chamadas `custos` em sequência, no ritmo, cota e latência atuais."""
+        with self._lock:
+            agora  = time.monotonic()
+            fichas = min(self.rajada, self._fichas + (agora - self._atualizado) * self.taxa)
+            janela = [(instante - agora, c) for instante, c in self._janela]
+            t      = max(0.0, self._pausa_ate - agora)
+            taxa, rajada, cota, latencia = self.taxa, self.rajada, self.cota_minuto, self.latencia
+        ultimo = 0.0
+        for custo in custos:
+            while True:
+                fichas, ultimo = min(rajada, fichas + (t - ultimo) * taxa), t
+                janela = [(i, c) for i, c in janela if i > t - 60]
+                necessario = min(custo, rajada)
+                if fichas < necessario:
+                    t += (necessario - fichas) / taxa
+                    fichas, ultimo = necessario, t
+                    continue
+                excesso = sum(c for _, c in janela) + custo - cota
+                if cota and janela and excesso > 0:
+                    for i, c in janela:
+                        excesso -= c
+                        if excesso <= 0:
+                            break
+                    t = max(t, i + 60)
+                    continue
                 break
-            except HttpError as e:
-                if e.resp.status == 429:
-                    espera = (2 ** tentativa) + random.uniform(0, 1)
-                    print(f"[429] Rate limit — aguardando {espera:.1f}s (tentativa {tentativa + 1}/{max_tentativas})")
-                    time.sleep(espera)
-                    if tentativa == max_tentativas - 1:
-                        raise
-                else:
-                    raise
+            fichas -= custo
+            if cota:
+                janela.append((t, custo))
+            t += latencia
+        return t
+
+    def sucesso(self):
+        with self._lock:
+            self.taxa = min(self.taxa_maxima, self.taxa + self.incremento)
+            self.lote = min(self.lote_maximo, self.lote * 2)
+
+    def penalizar(self, espera: float, reduzir_lote: bool = False):
+        """429/5xx: taxa pela metade e pausa de todas as chamadas da API por `espera` segundos."""
+        with self._lock:
+            self.taxa       = max(self.taxa_minima, self.taxa / 2)
+            self._fichas    = min(self._fichas, 0.0)
+            self._pausa_ate = max(self._pausa_ate, time.monotonic() + espera)
+            self.limitadas += 1
+            if reduzir_lote:
+                self.lote = max(1, self.lote // 2)
+
+    def tamanho_lote(self, restantes: int, maximo: int = None) -> int:
+        """Divide o restante em lotes iguais de no máximo o lote atual."""
+        limite = max(1, min(self.lote, maximo or self.lote_maximo))
+        n_lotes = -(-restantes // limite)
+        return -(-restantes // n_lotes) if n_lotes else 0
+
+@st.cache_resource(max_entries=60)
+def controlador_taxa(chave: str, api: str) -> ControladorTaxa:
+    taxa, taxa_maxima, lote_maximo = TAXAS_API[api]
+    return ControladorTaxa(api, taxa, taxa_maxima, lote_maximo,
+                           cota_minuto=COTAS_MINUTO[api],
+                           latencia=LATENCIA_LOCAL_SEGUNDOS if MODO_GOOGLE == "offline" else LATENCIAS_INICIAIS[api])
+
+def controle_taxa(creds, api: str) -> ControladorTaxa:
+    """Um controlador por usuário e API, compartilhado entre reruns e sessões do mesmo
+    usuário: a cota de escrita do Docs (60/min) é contada por usuário, não por projeto."""
+    recursos = recursos_ativos(creds)
+    if recursos is not None:
+        return recursos.controladores[api]
+    return controlador_taxa(chave_credencial(creds), api)
+
+def espera_sugerida(e: HttpError):
+    """Segundos do cabeçalho Retry-After (número ou data HTTP), se houver."""
+    valor = (getattr(e, "resp", None) or {}).get("retry-after")
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        quando = email.utils.parsedate_to_datetime(valor)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (quando - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+def erro_de_taxa(e: Exception) -> bool:
+    status = getattr(getattr(e, "resp", None), "status", None)
+    return status == 429 or (status == 403 and "ratelimitexceeded" in str(e).lower())
+
+def erro_repetivel(e: Exception, idempotente: bool = True) -> bool:
+    """429/limite de taxa sempre (a requisição não foi aplicada); 5xx só se repetir for seguro."""
+    status = getattr(getattr(e, "resp", None), "status", None)
+    return erro_de_taxa(e) or (idempotente and status in STATUS_REPETIR)
+
+def executar_com_controle(creds, requisicao, api: str, custo: float = 1, max_tentativas: int = 6, idempotente: bool = True):
+    """requisicao.execute() sob o controlador do usuário na API, repetindo em 429 (e 5xx se idempotente)."""
+    controlador = controle_taxa(creds, api)
+    for tentativa in range(max_tentativas):
+        controlador.adquirir(custo)
+        inicio = time.perf_counter()
+        try:
+            resposta = requisicao.execute()
+        except HttpError as e:
+            if not erro_repetivel(e, idempotente) or tentativa == max_tentativas - 1:
+                raise
+            espera = espera_sugerida(e)
+            if espera is None:
+                espera = (2 ** tentativa) + random.uniform(0, 1)
+            print(f"[{e.resp.status}] {api} — aguardando {espera:.1f}s (tentativa {tentativa + 1}/{max_tentativas})")
+            contar(f"{api}.repeticoes_429" if erro_de_taxa(e) else f"{api}.repeticoes_5xx")
+            controlador.penalizar(espera, reduzir_lote=not erro_de_taxa(e))
+            continue
+        controlador.registrar_latencia(time.perf_counter() - inicio)
+        controlador.sucesso()
+        return resposta
+
+def batch_update_com_retry(creds, docs_service, doc_id, requests_list, max_tentativas=6, tamanho_lote=50, ao_aplicar=None):
+    """ao_aplicar(n) é chamado após cada lote confirmado, com o número de requests do lote."""
+    if not requests_list:
+        return
+
+    controlador = controle_taxa(creds, "docs")
+    i = 0
+    while i < len(requests_list):
+        n    = controlador.tamanho_lote(len(requests_list) - i, tamanho_lote)
+        lote = requests_list[i:i + n]
+        executar_com_controle(
+            creds, docs_service.documents().batchUpdate(documentId=doc_id, body={"requests": lote}),
+            "docs", max_tentativas=max_tentativas, idempotente=False,
+        )
+        contar("docs.requests", n)
+        i += n
+        if ao_aplicar:
+            ao_aplicar(n)
 
 # =========================================================
 # FUNÇÕES DE TRATAMENTO
 # =========================================================
 
+# Uma passada: tags HTML e qualquer caractere fora do conjunto permitido (emojis inclusive)
+# saem juntos; \n e \t sobrevivem só para virar espaço no split/join final.
+_RE_DESCARTE_TEXTO = re.compile(r"<[^>]+>|[^0-9A-Za-zÁÉÍÓÚÀÂÊÔÃÕÇáéíóúàâêôãõçºª \-–—.,;:()\/@\n\t]")
+
+@functools.lru_cache(maxsize=8192)
+def _limpar_texto(s: str) -> str:
+    return " ".join(_RE_DESCARTE_TEXTO.sub("", s).split())
+
 def limpar_texto(val) -> str:
     if val is None:
         return ""
-    s = str(val)
-    s = re.sub(r"[\U00010000-\U0010FFFF]", "", s)
-    s = re.sub(r"<[^>]+>", "", s)
-    s = s.replace("\n", " ").replace("\t", " ")
-    s = re.sub(r"[^0-9A-Za-zÁÉÍÓÚÀÂÊÔÃÕÇáéíóúàâêôãõçºª \-–—.,;:()\/@]", "", s)
-    return re.sub(r"\s+", " ", s).strip()
+    return _limpar_texto(str(val))
 
 def formatar_dia_semana(dt_date: datetime.date):
     dias = ["SEG", "TER", "QUA", "QUI", "SEX", "SÁB", "DOM"]
@@ -155,6 +746,15 @@ def week_range(ref_date: datetime.date):
     fim = ini + datetime.timedelta(days=6)
     return ini, fim
 
+def data_hoje() -> datetime.date:
+    return datetime.date.fromisoformat(HOJE_FIXO) if HOJE_FIXO else datetime.date.today()
+
+def semanas_dsi(ref_date: datetime.date):
+    """(ini_sm1, fim_sm1, ini_s, fim_s, ini_s1, fim_s1) da DSI com a semana S de ref_date."""
+    ini_s, fim_s = week_range(ref_date)
+    semana       = datetime.timedelta(days=7)
+    return ini_s - semana, fim_s - semana, ini_s, fim_s, ini_s + semana, fim_s + semana
+
 def fmt_periodo_titulo(ini: datetime.date, fim: datetime.date) -> str:
     ini_txt = f"{ini.day:02d} {formatar_mes_abreviado(ini)} {str(ini.year)[-2:]}"
     fim_txt = f"{fim.day:02d} {formatar_mes_abreviado(fim)} {str(fim.year)[-2:]}"
@@ -182,6 +782,136 @@ def registrar_log(acao: str, detalhes: str = ""):
     timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     print(f"[{timestamp}] {acao} - {detalhes}")
 
+# =========================================================
+# RECURSOS GOOGLE (credencial, discovery e transportes)
+# Reaproveitados entre reruns e sessões: o discovery é lido
+# e interpretado uma vez por API, e cada thread mantém o seu
+# AuthorizedHttp com keep-alive (httplib2 não é thread-safe).
+# =========================================================
+
+MARGEM_RENOVACAO_TOKEN = datetime.timedelta(minutes=5)
+
+@functools.lru_cache(maxsize=None)
+def documento_discovery(api: str, versao: str):
+    """Discovery estático do googleapiclient já interpretado (None se não houver)."""
+    doc = get_static_doc(api, versao)
+    return json.loads(doc) if doc else None
+
+class HttpMedido(AuthorizedHttp):
+    """AuthorizedHttp que conta os bytes recebidos na medição em curso."""
+
+    def __init__(self, api: str, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.api = api
+
+    def request(self, *args, **kwargs):
+        resposta, conteudo = super().request(*args, **kwargs)
+        contar(f"{self.api}.bytes", len(conteudo or b""))
+        return resposta, conteudo
+
+class RecursosGoogle:
+    def __init__(self, creds):
+        self.creds   = creds
+        self._lock   = threading.Lock()
+        self._thread = threading.local()
+
+    def renovar_se_preciso(self, margem: datetime.timedelta = MARGEM_RENOVACAO_TOKEN) -> bool:
+        """Renova o token antes de expirar, fora de qualquer requisição. True se renovou."""
+        with self._lock:
+            agora = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)   # expiry é UTC ingênuo
+            expira = self.creds.expiry
+            if self.creds.token and (expira is None or expira - margem > agora):
+                return False
+            if not self.creds.refresh_token:
+                return False
+            self.creds.refresh(Request())
+            registrar_log("TOKEN_RENOVADO", f"expira em {self.creds.expiry}")
+            return True
+
+    def servico(self, api: str, versao: str):
+        self.renovar_se_preciso()
+        servicos = getattr(self._thread, "servicos", None)
+        if servicos is None:
+            servicos = self._thread.servicos = {}
+        if (api, versao) not in servicos:
+            http = HttpMedido(api, self.creds, http=httplib2.Http())
+            doc  = documento_discovery(api, versao)
+            servicos[(api, versao)] = (
+                build_from_document(doc, http=http) if doc
+                else build(api, versao, http=http, cache_discovery=False)
+            )
+        return servicos[(api, versao)]
+
+def chave_credencial(creds) -> str:
+    """Identifica o usuário pela credencial de longa duração (não muda quando o token é renovado)."""
+    base = f"{creds.client_id}|{creds.refresh_token or creds.token}"
+    return hashlib.sha256(base.encode("utf-8")).hexdigest()
+
+@st.cache_resource(max_entries=20)
+def recursos_google(chave: str, _creds) -> RecursosGoogle:
+    return RecursosGoogle(_creds)
+
+def servico_google(creds, api: str, versao: str):
+    return (recursos_ativos(creds) or RecursosUsuario(creds)).servico(api, versao)
+
+# Os workers da fila de exportação não têm o contexto de execução do Streamlit
+# (st.cache_resource e st.* não valem lá): a sessão resolve os recursos do
+# usuário ao enfileirar, e o worker os ativa enquanto a tarefa roda.
+_RECURSOS = contextvars.ContextVar("recursos_dsi", default=None)
+
+class RecursosUsuario:
+    """Serviços Google e controladores de taxa de uma credencial, já tirados dos caches."""
+
+    def __init__(self, creds):
+        chave = chave_credencial(creds)
+        self.creds         = creds
+        # credencial offline (dsi_offline.CredenciaisLocais): os serviços vêm do GoogleLocal dela
+        self.local         = getattr(creds, "google", None)
+        self.google        = recursos_google(chave, creds) if self.local is None else None
+        self.gravacoes     = gravacoes_google() if MODO_GOOGLE == "gravar" else None
+        self.controladores = {api: controlador_taxa(chave, api) for api in TAXAS_API}
+
+    def servico(self, api: str, versao: str):
+        if self.local is not None:
+            return self.local.servico(api)
+        servico = self.google.servico(api, versao)
+        if self.gravacoes is not None and api in dsi_offline.SERVICOS_GRAVADOS:
+            return dsi_offline.SERVICOS_GRAVADOS[api](servico, self.gravacoes)
+        return servico
+
+    @contextlib.contextmanager
+    def ativos(self):
+        token = _RECURSOS.set(self)
+        try:
+            yield self
+        finally:
+            _RECURSOS.reset(token)
+
+def recursos_ativos(creds):
+    """RecursosUsuario ativos no contexto para esta credencial (worker da fila), ou None."""
+    recursos = _RECURSOS.get()
+    return recursos if recursos is not None and recursos.creds is creds else None
+
+# =========================================================
+# GOOGLE OFFLINE — gravação e serviços locais (dsi_offline.py)
+# DSI_MODO_GOOGLE="gravar" grava em DIR_GRAVACOES as respostas
+# do Calendar e as chamadas documents(); "offline" troca
+# Calendar, Docs e Drive por serviços locais que respondem das
+# gravações. Aqui ficam só as instâncias compartilhadas.
+# =========================================================
+
+# Espera simulada por requisição (ou por lote HTTP) nos serviços locais
+LATENCIA_LOCAL_SEGUNDOS = config_dsi("DSI_LATENCIA_LOCAL", 0.0)
+
+@st.cache_resource
+def gravacoes_google():
+    return dsi_offline.GravacoesGoogle(DIR_GRAVACOES)
+
+@st.cache_resource
+def google_local():
+    return dsi_offline.GoogleLocal(dsi_offline.GravacoesGoogle(DIR_GRAVACOES).agendas(),
+                                   os.path.join(CACHE_DIR, "documentos"), LATENCIA_LOCAL_SEGUNDOS, contar=contar)
+
 # =========================================================
 # AUTH
 # =========================================================
@@ -192,6 +922,8 @@ def _first_param_value(x):
     return x
 
 def get_credentials():
+    if MODO_GOOGLE == "offline":
+        return dsi_offline.CredenciaisLocais(google_local())
     creds = None
 
     if "token_data" in st.session_state:
@@ -199,14 +931,15 @@ def get_credentials():
             creds = Credentials.from_authorized_user_info(
                 st.session_state.token_data, SCOPES
             )
+            # a mesma instância entre reruns: serviços e transportes ficam atrelados a ela
+            creds = recursos_google(chave_credencial(creds), creds).creds
         except Exception:
             creds = None
 
-    if creds and creds.expired and creds.refresh_token:
+    if creds and creds.refresh_token:
         try:
-            creds.refresh(Request())
-            st.session_state.token_data = json.loads(creds.to_json())
-            return creds
+            if recursos_google(chave_credencial(creds), creds).renovar_se_preciso():
+                st.session_state.token_data = json.loads(creds.to_json())
         except Exception:
             creds = None
 
@@ -270,69 +1003,174 @@ def get_credentials():
 # CALENDAR – LISTAR EVENTOS
 # =========================================================
 
-def list_events(service, calendar_id: str, d_ini: datetime.date, d_fim: datetime.date):
-    time_min = to_dt_utc_start(d_ini).isoformat()
-    time_max = to_dt_utc_end_exclusive(d_fim).isoformat()
-
-    nome_cal = next((k for k, v in IDS.items() if v == calendar_id), calendar_id[:20])
+def _nome_agenda(calendar_id: str) -> str:
+    return next((k for k, v in IDS.items() if v == calendar_id), calendar_id[:20])
+
+def classificar_erro_agenda(e: Exception) -> str:
+    status = getattr(getattr(e, "resp", None), "status", None)
+    erro   = str(e)
+    if status == 404 or "404" in erro or "notFound" in erro:
+        return "nao_encontrada"
+    if status == 403 or "403" in erro or "forbidden" in erro.lower():
+        return "sem_permissao"
+    return "erro"
+
+def registrar_erro_agenda(calendar_id: str, e: Exception) -> str:
+    nome_cal = _nome_agenda(calendar_id)
+    tipo     = classificar_erro_agenda(e)
+    erro     = str(e)
+    if tipo == "nao_encontrada":
+        print(f"Agenda {nome_cal} não encontrada: {erro[:80]}")
+    elif tipo == "sem_permissao":
+        print(f"Sem permissão: {nome_cal}")
+    else:
+        print(f"Erro agenda {nome_cal}: {erro[:80]}")
+    return tipo
+
+# Lidos por parse_start_end, construir_tabela_semana, buscar_* e bullets_periodo
+CAMPOS_LISTA_EVENTOS = mascara_campos(
+    "calendar.lista_eventos",
+    "nextPageToken, items(id, summary, description, location, start, end)",
+)
+
+def _requisicao_lista(service, calendar_id: str, d_ini: datetime.date, d_fim: datetime.date, page_token=None):
+    return service.events().list(
+        calendarId=calendar_id,
+        timeMin=to_dt_utc_start(d_ini).isoformat(),
+        timeMax=to_dt_utc_end_exclusive(d_fim).isoformat(),
+        singleEvents=True,
+        orderBy="startTime",
+        maxResults=250,
+        pageToken=page_token,
+        fields=CAMPOS_LISTA_EVENTOS,
+    )
 
+def _listar_eventos(creds, service, calendar_id: str, d_ini: datetime.date, d_fim: datetime.date):
     items = []
     page_token = None
+    while True:
+        res = executar_com_controle(creds, _requisicao_lista(service, calendar_id, d_ini, d_fim, page_token), "calendar")
+        items.extend(res.get("items", []))
+        page_token = res.get("nextPageToken")
+        if not page_token:
+            break
+    return items
+
+def list_events(creds, service, calendar_id: str, d_ini: datetime.date, d_fim: datetime.date):
     try:
-        while True:
-            res = service.events().list(
-                calendarId=calendar_id,
-                timeMin=time_min,
-                timeMax=time_max,
-                singleEvents=True,
-                orderBy="startTime",
-                maxResults=250,
-                pageToken=page_token
-            ).execute()
-
-            batch = res.get("items", [])
-            for e in batch:
-                e["_src_calendar_id"] = calendar_id
-            items.extend(batch)
-            page_token = res.get("nextPageToken")
-            if not page_token:
-                break
+        return _listar_eventos(creds, service, calendar_id, d_ini, d_fim)
     except Exception as e:
-        erro = str(e)
-        if "404" in erro or "notFound" in erro:
-            print(f"Agenda {nome_cal} não encontrada: {erro[:80]}")
-        elif "403" in erro or "forbidden" in erro.lower():
-            print(f"Sem permissão: {nome_cal}")
-        else:
-            print(f"Erro agenda {nome_cal}: {erro[:80]}")
+        registrar_erro_agenda(calendar_id, e)
         return []
 
-    return items
+# =========================================================
+# BUSCA PARALELA DE AGENDAS
+# httplib2 não é thread-safe: cada worker monta o próprio
+# serviço Calendar sobre um AuthorizedHttp exclusivo.
+# =========================================================
 
-def carregar_todos_eventos_paralelo(srv, d_ini, d_fim):
-    calendarios = [
-        "s3", "cmt", "cmdo", "sub_cmt", "adj_cmdo",
-        "sec_1", "sec_4",
-        "cia_1", "cia_1b", "cia_1_sgt",
-        "cia_2", "cia_2b", "cia_2_sgt",
-        "b_mus", "npor", "npor_ste",
-        "ass_jur", "brigada", "fisc_adm", "chales",
-        "com_soc", "fiscal", "prm", "sfpc",
-        "pgi", "cursos", "datas", "si", "fase", "operacoes"
-    ]
-    with ThreadPoolExecutor(max_workers=6) as executor:
+MAX_WORKERS_CALENDAR = 6
+# "paralelo" (um transporte por thread) ou "lote" (HTTP batch, uma conexão)
+MODO_BUSCA_CALENDAR  = config_dsi("DSI_MODO_BUSCA", "paralelo")
+LIMITE_LOTE_CALENDAR = 50
+
+def calendar_service_da_thread(creds):
+    return servico_google(creds, "calendar", "v3")
+
+def carregar_todos_eventos_paralelo(creds, pedidos: dict, max_workers: int = MAX_WORKERS_CALENDAR):
+    """pedidos: {calendar_id: (d_ini, d_fim)} → ({calendar_id: items}, {calendar_id: tipo_erro})"""
+    def buscar(calendar_id, d_ini, d_fim):
+        return _listar_eventos(creds, calendar_service_da_thread(creds), calendar_id, d_ini, d_fim)
+
+    resultados = {}
+    erros      = {}
+    if not pedidos:
+        return resultados, erros
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pedidos)))) as executor:
         futures = {
-            executor.submit(list_events, srv, IDS[cal], d_ini, d_fim): cal
-            for cal in calendarios
+            executor.submit(no_contexto(buscar), cal_id, d_ini, d_fim): cal_id
+            for cal_id, (d_ini, d_fim) in pedidos.items()
         }
-        resultados = {}
         for future in futures:
-            cal = futures[future]
+            cal_id = futures[future]
+            try:
+                resultados[cal_id] = future.result()
+            except Exception as e:
+                erros[cal_id]      = registrar_erro_agenda(cal_id, e)
+                resultados[cal_id] = []
+    return resultados, erros
+
+def carregar_todos_eventos_lote(creds, pedidos: dict, max_tentativas: int = 6):
+    """Mesmo contrato de carregar_todos_eventos_paralelo, via HTTP batch: as primeiras
+    páginas de todas as agendas vão num único multipart; as rodadas seguintes
+    seguem nextPageToken só das agendas que ainda têm páginas. Sub-requisições
+    limitadas (429/5xx) voltam na rodada seguinte, e cada multipart consome do
+    controlador de taxa uma ficha por sub-requisição."""
+    service     = calendar_service_da_thread(creds)
+    controlador = controle_taxa(creds, "calendar")
+    resultados  = {cal_id: [] for cal_id in pedidos}
+    erros       = {}
+    pendentes   = {cal_id: None for cal_id in pedidos}   # calendar_id -> pageToken
+    tentativas  = {}
+
+    def repetir(cal_id, e, proximos, limitadas) -> bool:
+        tentativas[cal_id] = tentativas.get(cal_id, 0) + 1
+        if not erro_repetivel(e) or tentativas[cal_id] >= max_tentativas:
+            return False
+        proximos[cal_id] = pendentes[cal_id]
+        limitadas.append(e)
+        return True
+
+    while pendentes:
+        proximos = {}
+        ids      = list(pendentes)
+        i        = 0
+        while i < len(ids):
+            grupo     = ids[i:i + controlador.tamanho_lote(len(ids) - i, LIMITE_LOTE_CALENDAR)]
+            i        += len(grupo)
+            limitadas = []
+
+            def callback(request_id, response, exception, grupo=grupo, limitadas=limitadas):
+                cal_id = grupo[int(request_id)]
+                if exception is not None:
+                    if not repetir(cal_id, exception, proximos, limitadas):
+                        erros[cal_id] = registrar_erro_agenda(cal_id, exception)
+                        resultados[cal_id] = []
+                    return
+                resultados[cal_id].extend(response.get("items", []))
+                if response.get("nextPageToken"):
+                    proximos[cal_id] = response["nextPageToken"]
+
+            lote = service.new_batch_http_request(callback=callback)
+            for n, cal_id in enumerate(grupo):
+                lote.add(_requisicao_lista(service, cal_id, *pedidos[cal_id], pendentes[cal_id]), request_id=str(n))
+            controlador.adquirir(len(grupo))
             try:
-                resultados[cal] = future.result()
-            except Exception:
-                resultados[cal] = []
-    return resultados
+                lote.execute()
+            except Exception as e:
+                for cal_id in grupo:
+                    proximos.pop(cal_id, None)
+                    if not repetir(cal_id, e, proximos, limitadas):
+                        erros[cal_id] = registrar_erro_agenda(cal_id, e)
+                        resultados[cal_id] = []
+
+            if limitadas:
+                espera = max((espera_sugerida(e) or 0.0) for e in limitadas)
+                if not espera:
+                    espera = (2 ** max(tentativas[c] for c in grupo if c in tentativas)) + random.uniform(0, 1)
+                print(f"[{len(limitadas)} limitada(s)] calendar — lote de {len(grupo)}, aguardando {espera:.1f}s")
+                for e in limitadas:
+                    contar("calendar.repeticoes_429" if erro_de_taxa(e) else "calendar.repeticoes_5xx")
+                controlador.penalizar(espera, reduzir_lote=True)
+            else:
+                controlador.sucesso()
+        pendentes = proximos
+    return resultados, erros
+
+def carregar_eventos(creds, pedidos: dict, max_workers: int = MAX_WORKERS_CALENDAR, modo: str = MODO_BUSCA_CALENDAR):
+    if modo == "lote":
+        return carregar_todos_eventos_lote(creds, pedidos)
+    return carregar_todos_eventos_paralelo(creds, pedidos, max_workers)
 
 def dedup_by_event_id(events):
     vistos = set()
@@ -364,104 +1202,584 @@ def parse_start_end(ev):
 
     return None, None, False, ""
 
-def event_intersects_day(ev, day: datetime.date) -> bool:
-    s_date, e_date, is_all_day, _ = parse_start_end(ev)
-    if s_date is None or e_date is None:
-        return False
-    if is_all_day:
-        return (s_date <= day) and (day < e_date)
+# =========================================================
+# REGISTRO NORMALIZADO DE EVENTO
+# O dict da API é interpretado uma única vez, na entrada do
+# armazém; buscar_*, bullets_periodo e construir_tabela_semana
+# leem os campos prontos (datas, hora, textos limpos, origem).
+# O cache e a sincronização continuam guardando o JSON da API.
+# =========================================================
+
+class Evento:
+    __slots__ = (
+        "id", "agenda", "prioridade",
+        "inicio", "fim", "dia_inteiro", "hora", "ordem",   # como parse_start_end; ordem = início ISO
+        "primeiro_dia", "ultimo_dia",                      # dias ocupados (inclusivo)
+        "inicio_utc", "fim_utc",                           # limites para o filtro de janela
+        "titulo", "local", "descricao", "texto_completo",
+    )
+
+    def __init__(self, ev: dict, agenda: str):
+        start = ev.get("start", {})
+        self.id         = ev.get("id")
+        self.agenda     = agenda
+        self.prioridade = PRIORIDADE_RESP.get(agenda, 50)
+        self.inicio, self.fim, self.dia_inteiro, self.hora = parse_start_end(ev)
+        self.ordem      = start.get("dateTime", start.get("date", ""))
+
+        # Dia inteiro: o fim é exclusivo. Com horário: terminar à 00:00 não ocupa o dia final.
+        ultimo = self.fim
+        if self.inicio is None or ultimo is None:
+            ultimo = None
+        elif self.dia_inteiro:
+            ultimo = ultimo - datetime.timedelta(days=1)
+        elif ev.get("end", {}).get("dateTime", "")[11:16] == "00:00" and ultimo > self.inicio:
+            ultimo = ultimo - datetime.timedelta(days=1)
+        self.primeiro_dia = self.inicio if ultimo is not None else None
+        self.ultimo_dia   = ultimo
+        self.inicio_utc, self.fim_utc = _limites_evento(ev)
+
+        # titulo None = evento sem summary (a tabela exibe "S/T"); textos já passam por limpar_texto
+        self.titulo         = limpar_texto(ev["summary"]) if "summary" in ev else None
+        self.local          = limpar_texto(ev.get("location", ""))
+        self.descricao      = limpar_texto(ev.get("description", ""))
+        # SI e FASE procuram no texto original (extrair_*_texto fazem a própria limpeza)
+        self.texto_completo = f"{ev.get('summary','')} {ev.get('description','')} {ev.get('location','')}"
+
+def registros_eventos(items, calendar_id: str) -> list:
+    return [Evento(ev, calendar_id) for ev in items]
+
+def event_intersects_day(ev: Evento, day: datetime.date) -> bool:
+    return ev.primeiro_dia is not None and ev.primeiro_dia <= day <= ev.ultimo_dia
+
+class IndiceDiario:
+    """Eventos distribuídos pelos dias que ocupam dentro de [d_ini, d_fim].
+    Cada dia já sai ordenado pelo início.
+    Montar o índice custa O(eventos + ocorrências), qualquer que seja o horizonte."""
+
+    def __init__(self, eventos, d_ini: datetime.date, d_fim: datetime.date):
+        self.d_ini = d_ini
+        self.d_fim = d_fim
+        self._dias = {}
+        um_dia = datetime.timedelta(days=1)
+        for ev in eventos:
+            if ev.primeiro_dia is None:
+                continue
+            cur = max(ev.primeiro_dia, d_ini)
+            fim = min(ev.ultimo_dia, d_fim)
+            while cur <= fim:
+                self._dias.setdefault(cur, []).append(ev)
+                cur += um_dia
+        for lista in self._dias.values():
+            lista.sort(key=lambda ev: ev.ordem)
+
+    def do_dia(self, dia: datetime.date) -> list:
+        return self._dias.get(dia, [])
+
+# =========================================================
+# CONSULTA POR SOBREPOSIÇÃO
+# timeMin filtra pelo FIM do evento (fim > timeMin) e timeMax
+# pelo início: a janela [d_ini, d_fim] já traz os eventos
+# longos que começaram antes, sem varrer um ano de histórico.
+# A margem de 1 dia cobre a diferença entre datas locais
+# (usadas no filtro) e os limites em UTC da consulta.
+# =========================================================
+
+def janela_sobreposicao(d_ini: datetime.date, d_fim: datetime.date):
+    margem = datetime.timedelta(days=MARGEM_FUSO_DIAS)
+    return d_ini - margem, d_fim + margem
+
+def intervalo_inclusivo(ev: Evento):
+    s_date, e_date = ev.inicio, ev.fim
+    if s_date and ev.dia_inteiro and e_date:
+        e_date = e_date - datetime.timedelta(days=1)
+    return s_date, e_date
+
+def sobrepoe_periodo(ev: Evento, d_ini: datetime.date, d_fim: datetime.date) -> bool:
+    s_date, e_date = intervalo_inclusivo(ev)
+    return bool(s_date) and (s_date <= d_fim) and (e_date >= d_ini)
 
+def list_events_sobrepostos(creds, service, calendar_id: str, d_ini: datetime.date, d_fim: datetime.date):
+    return [e for e in registros_eventos(list_events(creds, service, calendar_id, *janela_sobreposicao(d_ini, d_fim)), calendar_id)
+            if sobrepoe_periodo(e, d_ini, d_fim)]
+
+# =========================================================
+# CACHE LOCAL DE EVENTOS (SQLite)
+# Chave: calendar_id + janela. Uma entrada serve qualquer
+# janela contida nela enquanto estiver dentro do TTL.
+# =========================================================
+
+class CacheEventos:
+    def __init__(self, diretorio: str = CACHE_DIR, ttl_segundos: int = CACHE_TTL_SEGUNDOS, max_mb: float = CACHE_MAX_MB):
+        os.makedirs(diretorio, exist_ok=True)
+        self.caminho      = os.path.join(diretorio, "eventos.sqlite3")
+        self.ttl_segundos = ttl_segundos
+        self.max_bytes    = int(max_mb * 1024 * 1024)
+        with self._conectar() as con:
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS janelas (
+                    calendar_id TEXT NOT NULL,
+                    d_ini       TEXT NOT NULL,
+                    d_fim       TEXT NOT NULL,
+                    buscado_em  REAL NOT NULL,
+                    acessado_em REAL NOT NULL,
+                    tamanho     INTEGER NOT NULL,
+                    dados       TEXT NOT NULL,
+                    PRIMARY KEY (calendar_id, d_ini, d_fim)
+                )""")
+
+    def _conectar(self):
+        return sqlite3.connect(self.caminho, timeout=10)
+
+    def obter(self, calendar_id: str, d_ini: datetime.date, d_fim: datetime.date):
+        """Retorna (d_ini, d_fim, items) da menor entrada válida que cobre a janela, ou None."""
+        agora = time.time()
+        with self._conectar() as con:
+            linha = con.execute("""
+                SELECT d_ini, d_fim, dados FROM janelas
+                WHERE calendar_id = ? AND d_ini <= ? AND d_fim >= ? AND buscado_em >= ?
+                ORDER BY julianday(d_fim) - julianday(d_ini) LIMIT 1""",
+                (calendar_id, d_ini.isoformat(), d_fim.isoformat(), agora - self.ttl_segundos),
+            ).fetchone()
+            if not linha:
+                return None
+            con.execute(
+                "UPDATE janelas SET acessado_em = ? WHERE calendar_id = ? AND d_ini = ? AND d_fim = ?",
+                (agora, calendar_id, linha[0], linha[1]),
+            )
+        return (datetime.date.fromisoformat(linha[0]), datetime.date.fromisoformat(linha[1]), json.loads(linha[2]))
+
+    def gravar(self, calendar_id: str, d_ini: datetime.date, d_fim: datetime.date, items):
+        dados = json.dumps(items, ensure_ascii=False)
+        agora = time.time()
+        with self._conectar() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO janelas VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (calendar_id, d_ini.isoformat(), d_fim.isoformat(), agora, agora, len(dados), dados),
+            )
+        self._despejar()
+
+    def _despejar(self):
+        # Remove as entradas menos acessadas até caber no limite de tamanho
+        with self._conectar() as con:
+            total = con.execute("SELECT COALESCE(SUM(tamanho), 0) FROM janelas").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            for calendar_id, d_ini, d_fim, tamanho in con.execute(
+                    "SELECT calendar_id, d_ini, d_fim, tamanho FROM janelas ORDER BY acessado_em").fetchall():
+                con.execute("DELETE FROM janelas WHERE calendar_id = ? AND d_ini = ? AND d_fim = ?",
+                            (calendar_id, d_ini, d_fim))
+                total -= tamanho
+                if total <= self.max_bytes:
+                    break
+
+    def invalidar(self, calendar_id: str = None):
+        with self._conectar() as con:
+            if calendar_id is None:
+                con.execute("DELETE FROM janelas")
+            else:
+                con.execute("DELETE FROM janelas WHERE calendar_id = ?", (calendar_id,))
+
+    def revalidar(self, calendar_id: str):
+        with self._conectar() as con:
+            con.execute("UPDATE janelas SET buscado_em = ? WHERE calendar_id = ?", (time.time(), calendar_id))
+
+    def buscas_mais_antigas(self) -> dict:
+        with self._conectar() as con:
+            return dict(con.execute("SELECT calendar_id, MIN(buscado_em) FROM janelas GROUP BY calendar_id").fetchall())
+
+CAMPOS_VERIFICA_ALTERACAO = mascara_campos("calendar.verifica_alteracao", "items(id)")
+
+def invalidar_agendas_alteradas(creds, cache: CacheEventos, max_workers: int = MAX_WORKERS_CALENDAR) -> list:
+    """ATUALIZAR: consulta cada agenda em cache por eventos alterados desde a busca
+    (updatedMin, 1 item) e invalida só as que mudaram; as demais têm o TTL renovado."""
+    desde = cache.buscas_mais_antigas()
+
+    def alterada(calendar_id, buscado_em):
+        srv = calendar_service_da_thread(creds)
+        res = executar_com_controle(creds, srv.events().list(
+            calendarId=calendar_id,
+            updatedMin=datetime.datetime.fromtimestamp(buscado_em, datetime.timezone.utc).isoformat(),
+            showDeleted=True,
+            maxResults=1,
+            fields=CAMPOS_VERIFICA_ALTERACAO,
+        ), "calendar")
+        return bool(res.get("items"))
+
+    alteradas = []
+    if not desde:
+        return alteradas
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(desde)))) as executor:
+        futures = {executor.submit(no_contexto(alterada), cal_id, ts): cal_id for cal_id, ts in desde.items()}
+        for future in futures:
+            cal_id = futures[future]
+            try:
+                mudou = future.result()
+            except Exception as e:
+                registrar_erro_agenda(cal_id, e)
+                mudou = True
+            if mudou:
+                cache.invalidar(cal_id)
+                alteradas.append(cal_id)
+            else:
+                cache.revalidar(cal_id)
+    return alteradas
+
+# =========================================================
+# SINCRONIZAÇÃO INCREMENTAL (syncToken)
+# A primeira carga de cada agenda é completa (a API não aceita
+# timeMin/timeMax/orderBy junto com syncToken); as seguintes
+# trazem só eventos alterados ou excluídos, aplicados ao espelho
+# local. HTTP 410 (token expirado) refaz a carga completa.
+# =========================================================
+
+def _utc_iso(dt: datetime.datetime) -> str:
+    return dt.astimezone(datetime.timezone.utc).isoformat()
+
+# status identifica exclusões ("cancelled") nas cargas incrementais
+CAMPOS_SYNC_EVENTOS = mascara_campos(
+    "calendar.sync_eventos",
+    "nextPageToken, nextSyncToken, items(id, status, summary, description, location, start, end)",
+)
+
+def _sincronizar_agenda(creds, service, calendar_id: str, token: str = None):
+    """Retorna (completa, items, proximo_token)."""
+    items      = []
+    page_token = None
+    while True:
+        params = {"calendarId": calendar_id, "singleEvents": True, "maxResults": 2500,
+                  "pageToken": page_token, "fields": CAMPOS_SYNC_EVENTOS}
+        if token:
+            params["syncToken"] = token
+        res = executar_com_controle(creds, service.events().list(**params), "calendar")
+        items.extend(res.get("items", []))
+        page_token = res.get("nextPageToken")
+        if not page_token:
+            return token is None, items, res.get("nextSyncToken")
+
+def sincronizar_agenda(creds, service, calendar_id: str, token: str = None):
+    try:
+        return _sincronizar_agenda(creds, service, calendar_id, token)
+    except HttpError as e:
+        if token and e.resp.status == 410:
+            registrar_log("SYNC_TOKEN_EXPIRADO", _nome_agenda(calendar_id))
+            return _sincronizar_agenda(creds, service, calendar_id, None)
+        raise
+
+class SincronizadorAgendas:
+    def __init__(self, diretorio: str = CACHE_DIR, intervalo_segundos: int = CACHE_TTL_SEGUNDOS):
+        os.makedirs(diretorio, exist_ok=True)
+        self.caminho            = os.path.join(diretorio, "eventos.sqlite3")
+        self.intervalo_segundos = intervalo_segundos
+        with self._conectar() as con:
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS sync_tokens (
+                    calendar_id     TEXT PRIMARY KEY,
+                    token           TEXT,
+                    sincronizado_em REAL NOT NULL
+                )""")
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS eventos_sync (
+                    calendar_id TEXT NOT NULL,
+                    event_id    TEXT NOT NULL,
+                    inicio      TEXT NOT NULL,
+                    fim         TEXT NOT NULL,
+                    dados       TEXT NOT NULL,
+                    PRIMARY KEY (calendar_id, event_id)
+                )""")
+
+    def _conectar(self):
+        return sqlite3.connect(self.caminho, timeout=10)
+
+    def _estado(self) -> dict:
+        with self._conectar() as con:
+            return {c: (t, ts) for c, t, ts in con.execute("SELECT calendar_id, token, sincronizado_em FROM sync_tokens")}
+
+    def _aplicar(self, calendar_id: str, completa: bool, items, token: str):
+        with self._conectar() as con:
+            if completa:
+                con.execute("DELETE FROM eventos_sync WHERE calendar_id = ?", (calendar_id,))
+            for ev in items:
+                eid = ev.get("id")
+                if not eid:
+                    continue
+                if ev.get("status") == "cancelled":
+                    con.execute("DELETE FROM eventos_sync WHERE calendar_id = ? AND event_id = ?", (calendar_id, eid))
+                    continue
+                ini, fim = _limites_evento(ev)
+                if ini is None:
+                    continue
+                con.execute("INSERT OR REPLACE INTO eventos_sync VALUES (?, ?, ?, ?, ?)",
+                            (calendar_id, eid, _utc_iso(ini), _utc_iso(fim), json.dumps(ev, ensure_ascii=False)))
+            con.execute("INSERT OR REPLACE INTO sync_tokens VALUES (?, ?, ?)", (calendar_id, token, time.time()))
+
+    def sincronizar(self, creds, calendar_ids, max_workers: int = MAX_WORKERS_CALENDAR, forcar: bool = False) -> dict:
+        """Sincroniza as agendas vencidas; retorna (nº sincronizadas, {calendar_id: tipo_erro})."""
+        estado  = self._estado()
+        limite  = time.time() - self.intervalo_segundos
+        vencidas = [
+            c for c in calendar_ids
+            if forcar or c not in estado or estado[c][1] < limite
+        ]
+        erros = {}
+        if not vencidas:
+            return 0, erros
+
+        def buscar(calendar_id):
+            token = estado.get(calendar_id, (None, 0))[0]
+            return sincronizar_agenda(creds, calendar_service_da_thread(creds), calendar_id, token)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(vencidas)))) as executor:
+            futures = {executor.submit(no_contexto(buscar), cal_id): cal_id for cal_id in vencidas}
+            for future in futures:
+                cal_id = futures[future]
+                try:
+                    completa, items, token = future.result()
+                except Exception as e:
+                    erros[cal_id] = registrar_erro_agenda(cal_id, e)
+                    continue
+                self._aplicar(cal_id, completa, items, token)
+                registrar_log("SYNC", f"{_nome_agenda(cal_id)}: {'completa' if completa else 'incremental'}, {len(items)} evento(s)")
+        return len(vencidas), erros
+
+    def vencer_todas(self):
+        with self._conectar() as con:
+            con.execute("UPDATE sync_tokens SET sincronizado_em = 0")
+
+    def eventos(self, calendar_id: str, d_ini: datetime.date, d_fim: datetime.date):
+        with self._conectar() as con:
+            linhas = con.execute("""
+                SELECT dados FROM eventos_sync
+                WHERE calendar_id = ? AND fim > ? AND inicio < ?
+                ORDER BY inicio, event_id""",
+                (calendar_id, _utc_iso(to_dt_utc_start(d_ini)), _utc_iso(to_dt_utc_end_exclusive(d_fim))),
+            ).fetchall()
+        return [json.loads(dados) for (dados,) in linhas]
+
+# =========================================================
+# ARMAZÉM DE EVENTOS — cada agenda buscada uma vez por carga
+# Os consumidores registram as janelas de que precisam; o
+# armazém busca cada calendar_id uma única vez na janela-união
+# e entrega fatias em memória com o mesmo critério da API
+# (fim > timeMin e início < timeMax).
+# =========================================================
+
+def _limites_evento(ev):
     start = ev.get("start", {})
     end   = ev.get("end",   {})
-    edt   = end.get("dateTime", "")
-    if edt and edt[11:16] == "00:00" and e_date > s_date:
-        e_date = e_date - datetime.timedelta(days=1)
+    if "date" in start:
+        ini = to_dt_utc_start(datetime.date.fromisoformat(start["date"]))
+        fim = to_dt_utc_start(datetime.date.fromisoformat(end.get("date", start["date"])))
+        return ini, fim
+    sdt = start.get("dateTime")
+    edt = end.get("dateTime")
+    if not (sdt and edt):
+        return None, None
+    ini = datetime.datetime.fromisoformat(sdt.replace("Z", "+00:00"))
+    fim = datetime.datetime.fromisoformat(edt.replace("Z", "+00:00"))
+    if ini.tzinfo is None:
+        ini = ini.replace(tzinfo=datetime.timezone.utc)
+    if fim.tzinfo is None:
+        fim = fim.replace(tzinfo=datetime.timezone.utc)
+    return ini, fim
+
+def evento_na_janela(ev: Evento, d_ini: datetime.date, d_fim: datetime.date) -> bool:
+    if ev.inicio_utc is None:
+        return False
+    return ev.fim_utc > to_dt_utc_start(d_ini) and ev.inicio_utc < to_dt_utc_end_exclusive(d_fim)
+
+class ArmazemEventos:
+    def __init__(self, creds, max_workers: int = MAX_WORKERS_CALENDAR, cache: CacheEventos = None,
+                 sincronizador: SincronizadorAgendas = None, modo_busca: str = MODO_BUSCA_CALENDAR):
+        self.creds         = creds
+        self.max_workers   = max_workers
+        self.modo_busca    = modo_busca
+        self.cache         = cache
+        self.sincronizador = sincronizador
+        self._janelas    = {}   # calendar_id -> (d_ini, d_fim) pedida pelos consumidores
+        self._eventos    = {}   # calendar_id -> (d_ini, d_fim, [Evento]) já buscada
+        self.erros       = {}   # calendar_id -> "nao_encontrada" | "sem_permissao" | "erro"
+        self._quadro     = None # DataFrame de tudo o que foi carregado (motor pandas)
+        self.buscas      = 0
+        self.do_cache    = 0
+        self.tempos      = {}   # etapa ("busca", "normalizacao") -> segundos acumulados
+
+    def registrar(self, calendar_id: str, d_ini: datetime.date, d_fim: datetime.date):
+        atual = self._janelas.get(calendar_id)
+        if atual:
+            d_ini = min(d_ini, atual[0])
+            d_fim = max(d_fim, atual[1])
+        self._janelas[calendar_id] = (d_ini, d_fim)
+
+    def _coberta(self, calendar_id, d_ini, d_fim) -> bool:
+        carregada = self._eventos.get(calendar_id)
+        return bool(carregada) and carregada[0] <= d_ini and d_fim <= carregada[1]
+
+    def _cronometrar(self, etapa: str, inicio: float):
+        self.tempos[etapa] = self.tempos.get(etapa, 0.0) + time.perf_counter() - inicio
+
+    def carregar(self):
+        self._quadro = None
+        pendentes = {
+            cal_id: janela for cal_id, janela in self._janelas.items()
+            if not self._coberta(cal_id, *janela)
+        }
+        if self.sincronizador:
+            with etapa("busca"):
+                sincronizadas, erros = self.sincronizador.sincronizar(self.creds, list(pendentes), self.max_workers)
+            self.buscas += sincronizadas
+            contar("cache.acertos", len(pendentes) - sincronizadas)
+            contar("cache.falhas", sincronizadas)
+            self.erros.update(erros)
+            for cal_id, (d_ini, d_fim) in pendentes.items():
+                self._eventos[cal_id] = (d_ini, d_fim, registros_eventos(self.sincronizador.eventos(cal_id, d_ini, d_fim), cal_id))
+            return
+        if self.cache:
+            for cal_id in list(pendentes):
+                em_cache = self.cache.obter(cal_id, *pendentes[cal_id])
+                if em_cache:
+                    self._eventos[cal_id] = (em_cache[0], em_cache[1], registros_eventos(em_cache[2], cal_id))
+                    self.do_cache += 1
+                    contar("cache.acertos")
+                    del pendentes[cal_id]
+        contar("cache.falhas", len(pendentes))
+        inicio = time.perf_counter()
+        with etapa("busca"):
+            resultados, erros = carregar_eventos(self.creds, pendentes, self.max_workers, self.modo_busca)
+        self._cronometrar("busca", inicio)
+        self.buscas += len(pendentes)
+        self.erros.update(erros)
+        for cal_id, (d_ini, d_fim) in pendentes.items():
+            items  = resultados.get(cal_id, [])
+            inicio = time.perf_counter()
+            self._eventos[cal_id] = (d_ini, d_fim, registros_eventos(items, cal_id))
+            self._cronometrar("normalizacao", inicio)
+            if self.cache and cal_id not in erros:
+                self.cache.gravar(cal_id, d_ini, d_fim, items)
+
+    def garantir(self, pedidos: dict):
+        """Agendas fora do plano são buscadas juntas, em paralelo."""
+        fora = [cal_id for cal_id, janela in pedidos.items() if not self._coberta(cal_id, *janela)]
+        if fora:
+            registrar_log("ARMAZEM_FORA_DO_PLANO", ", ".join(_nome_agenda(c) for c in fora))
+            for cal_id in fora:
+                self.registrar(cal_id, *pedidos[cal_id])
+            self.carregar()
+
+    def quadro(self) -> pd.DataFrame:
+        """Todos os eventos carregados num único DataFrame, montado uma vez por carga."""
+        if self._quadro is None:
+            self._quadro = quadro_eventos([ev for _, _, evs in self._eventos.values() for ev in evs])
+        return self._quadro
+
+    def eventos_por_agenda(self, pedidos: dict) -> dict:
+        """pedidos: {calendar_id: (d_ini, d_fim)}"""
+        self.garantir(pedidos)
+        return {
+            cal_id: [e for e in self._eventos[cal_id][2] if evento_na_janela(e, d_ini, d_fim)]
+            for cal_id, (d_ini, d_fim) in pedidos.items()
+        }
+
+    def eventos(self, calendar_id: str, d_ini: datetime.date, d_fim: datetime.date):
+        return self.eventos_por_agenda({calendar_id: (d_ini, d_fim)})[calendar_id]
 
-    return (s_date <= day) and (day <= e_date)
+    def sobrepostos(self, calendar_id: str, d_ini: datetime.date, d_fim: datetime.date):
+        return [e for e in self.eventos(calendar_id, *janela_sobreposicao(d_ini, d_fim))
+                if sobrepoe_periodo(e, d_ini, d_fim)]
+
+    def eventos_varios(self, calendar_ids, d_ini: datetime.date, d_fim: datetime.date):
+        por_agenda = self.eventos_por_agenda({cal_id: (d_ini, d_fim) for cal_id in calendar_ids})
+        return [e for cal_id in calendar_ids for e in por_agenda[cal_id]]
 
 # =========================================================
 # SI / FASE
 # =========================================================
 
+# Todos os marcadores de SI numa varredura só; vale o de maior prioridade encontrado
+# (SN > SI-n > SI n > Sn/EB > Semana de Instrução n), não o primeiro no texto.
+_RE_LIMPEZA_SI = re.compile(r'[^\w\s\-]')
+_RE_MARCADORES_SI = re.compile(
+    r'(?P<sn>\bSN\b)'
+    r'|\bSI\s*-\s*(?P<negativa>\d{1,2})'
+    r'|\bSI\s+(?P<si>\d{1,2})'
+    r'|\bS(?P<eb>\d{1,2})\s*/\s*EB\b'
+    r'|\bSEMANA\s+DE\s+INSTRU[cç][aã]O\s*(?P<semana>\d{1,2})\b',
+    re.IGNORECASE,
+)
+_PRIORIDADE_SI = ("sn", "negativa", "si", "eb", "semana")
+
+@functools.lru_cache(maxsize=4096)
 def extrair_si_texto(texto: str):
     if not texto:
         return None
-    texto_limpo = re.sub(r'[^\w\s\-]', ' ', texto)
+    achados = {}
+    for m in _RE_MARCADORES_SI.finditer(_RE_LIMPEZA_SI.sub(' ', texto)):
+        achados.setdefault(m.lastgroup, m.group(m.lastgroup))
+    for tipo in _PRIORIDADE_SI:
+        if tipo in achados:
+            break
+    else:
+        return None
 
-    if re.search(r'\bSN\b', texto_limpo, flags=re.IGNORECASE):
+    if tipo == "sn":
         return "SN"
+    if tipo == "negativa":
+        return f"-{achados[tipo]}"
+    num = int(achados[tipo])
+    return f"{num:02d}" if num > 0 else "SN"
 
-    m = re.search(r'\bSI\s*-\s*(\d{1,2})', texto_limpo, flags=re.IGNORECASE)
-    if m:
-        return f"-{m.group(1)}"
-
-    m = re.search(r'\bSI\s+(\d{1,2})', texto_limpo, flags=re.IGNORECASE)
-    if m:
-        num = int(m.group(1))
-        return f"{num:02d}" if num > 0 else "SN"
-
-    m = re.search(r'\bS(\d{1,2})\s*/\s*EB\b', texto_limpo, flags=re.IGNORECASE)
-    if m:
-        num = int(m.group(1))
-        return f"{num:02d}" if num > 0 else "SN"
-
-    m = re.search(r'\bSEMANA\s+DE\s+INSTRU[cç][aã]O\s*(\d{1,2})\b', texto_limpo, flags=re.IGNORECASE)
-    if m:
-        num = int(m.group(1))
-        return f"{num:02d}" if num > 0 else "SN"
-
-    return None
+# Ordem de preferência. Uma fase casada como palavra também é substring, então basta o "in".
+FASES = ("IIB", "IIQ", "ADST", "IIA", "IIC", "ADM", "MDD ADM")
+_RE_LIMPEZA_FASE = re.compile(r'[^\w\s]')
 
+@functools.lru_cache(maxsize=4096)
 def extrair_fase_texto(texto: str):
     if not texto:
         return None
-    texto_limpo = re.sub(r'[^\w\s]', '', texto).upper()
-    fases = ["IIB", "IIQ", "ADST", "IIA", "IIC", "ADM", "MDD ADM"]
-    for fase in fases:
-        if re.search(rf'\b{re.escape(fase)}\b', texto_limpo):
-            return fase
+    texto_limpo = _RE_LIMPEZA_FASE.sub('', texto).upper()
+    for fase in FASES:
         if fase in texto_limpo:
             return fase
     return None
 
-def buscar_si_duplo(service, d_ini_s, d_fim_s, d_ini_s1, d_fim_s1):
-    d_antes_s  = d_ini_s  - datetime.timedelta(days=3)
-    d_depois_s = d_fim_s  + datetime.timedelta(days=3)
-    evs_s = list_events(service, IDS["si"], d_antes_s, d_depois_s)
+def buscar_si_duplo(armazem, d_ini_s, d_fim_s, d_ini_s1, d_fim_s1):
+    d_antes_s  = d_ini_s  - datetime.timedelta(days=MARGEM_SI_FASE_DIAS)
+    d_depois_s = d_fim_s  + datetime.timedelta(days=MARGEM_SI_FASE_DIAS)
+    evs_s = armazem.eventos(IDS["si"], d_antes_s, d_depois_s)
 
     si_s = None
     melhor_overlap_s = 0
 
     for ev in evs_s:
-        s_date, e_date, is_all_day, _ = parse_start_end(ev)
+        s_date, e_date, is_all_day = ev.inicio, ev.fim, ev.dia_inteiro
         if s_date and e_date:
             e_date_inc = e_date - datetime.timedelta(days=1) if is_all_day else e_date
             overlap_start = max(s_date, d_ini_s)
             overlap_end   = min(e_date_inc, d_fim_s)
             if overlap_start <= overlap_end:
                 dias_overlap  = (overlap_end - overlap_start).days + 1
-                texto_completo = f"{ev.get('summary','')} {ev.get('description','')} {ev.get('location','')}"
+                texto_completo = ev.texto_completo
                 si = extrair_si_texto(texto_completo)
                 if si and dias_overlap > melhor_overlap_s:
                     melhor_overlap_s = dias_overlap
                     si_s = si
 
-    d_antes_s1  = d_ini_s1 - datetime.timedelta(days=3)
-    d_depois_s1 = d_fim_s1 + datetime.timedelta(days=3)
-    evs_s1 = list_events(service, IDS["si"], d_antes_s1, d_depois_s1)
+    d_antes_s1  = d_ini_s1 - datetime.timedelta(days=MARGEM_SI_FASE_DIAS)
+    d_depois_s1 = d_fim_s1 + datetime.timedelta(days=MARGEM_SI_FASE_DIAS)
+    evs_s1 = armazem.eventos(IDS["si"], d_antes_s1, d_depois_s1)
 
     si_s1 = None
     melhor_overlap_s1 = 0
 
     for ev in evs_s1:
-        s_date, e_date, is_all_day, _ = parse_start_end(ev)
+        s_date, e_date, is_all_day = ev.inicio, ev.fim, ev.dia_inteiro
         if s_date and e_date:
             e_date_inc = e_date - datetime.timedelta(days=1) if is_all_day else e_date
             overlap_start = max(s_date, d_ini_s1)
             overlap_end   = min(e_date_inc, d_fim_s1)
             if overlap_start <= overlap_end:
                 dias_overlap   = (overlap_end - overlap_start).days + 1
-                texto_completo = f"{ev.get('summary','')} {ev.get('description','')} {ev.get('location','')}"
+                texto_completo = ev.texto_completo
                 si = extrair_si_texto(texto_completo)
                 if si and dias_overlap > melhor_overlap_s1:
                     melhor_overlap_s1 = dias_overlap
@@ -472,23 +1790,23 @@ def buscar_si_duplo(service, d_ini_s, d_fim_s, d_ini_s1, d_fim_s1):
     elif si_s1:          return f"-2/{si_s1}"
     else:                return "-2/-1"
 
-def buscar_fase(service, d_ini_s, d_fim_s1):
-    d_antes  = d_ini_s  - datetime.timedelta(days=3)
-    d_depois = d_fim_s1 + datetime.timedelta(days=3)
-    evs = list_events(service, IDS["fase"], d_antes, d_depois)
+def buscar_fase(armazem, d_ini_s, d_fim_s1):
+    d_antes  = d_ini_s  - datetime.timedelta(days=MARGEM_SI_FASE_DIAS)
+    d_depois = d_fim_s1 + datetime.timedelta(days=MARGEM_SI_FASE_DIAS)
+    evs = armazem.eventos(IDS["fase"], d_antes, d_depois)
 
     melhor_fase    = None
     melhor_overlap = 0
 
     for ev in evs:
-        s_date, e_date, is_all_day, _ = parse_start_end(ev)
+        s_date, e_date, is_all_day = ev.inicio, ev.fim, ev.dia_inteiro
         if s_date and e_date:
             e_date_inc    = e_date - datetime.timedelta(days=1) if is_all_day else e_date
             overlap_start = max(s_date, d_ini_s)
             overlap_end   = min(e_date_inc, d_fim_s1)
             if overlap_start <= overlap_end:
                 dias_overlap   = (overlap_end - overlap_start).days + 1
-                texto_completo = f"{ev.get('summary','')} {ev.get('description','')} {ev.get('location','')}"
+                texto_completo = ev.texto_completo
                 fase = extrair_fase_texto(texto_completo)
                 if fase and dias_overlap > melhor_overlap:
                     melhor_overlap = dias_overlap
@@ -500,26 +1818,32 @@ def buscar_fase(service, d_ini_s, d_fim_s1):
 # OPERAÇÕES
 # =========================================================
 
-def buscar_operacoes(service, d_ini_s, d_fim_s1):
-    d_busca_ini = d_ini_s  - datetime.timedelta(days=365)
-    d_busca_fim = d_fim_s1 + datetime.timedelta(days=30)
+_RE_TIPO_OPERACAO     = re.compile(r'\(([^)]+)\)')
+_RE_PARENTESES_OPERACAO = re.compile(r'\s*\([^)]+\)')
+
+@functools.lru_cache(maxsize=1024)
+def separar_operacao(summary: str):
+    """"Op Ágata (GLO)" -> ("Op Ágata", "GLO"); sem parênteses, o tipo fica vazio."""
+    tipo_match = _RE_TIPO_OPERACAO.search(summary)
+    if not tipo_match:
+        return summary, ""
+    return _RE_PARENTESES_OPERACAO.sub('', summary).strip(), tipo_match.group(1).strip().upper()
 
-    evs = list_events(service, IDS["operacoes"], d_busca_ini, d_busca_fim)
+def buscar_operacoes(armazem, d_ini_s, d_fim_s1):
+    evs = armazem.sobrepostos(IDS["operacoes"], d_ini_s, d_fim_s1)
     operacoes_ativas = []
 
     for ev in evs:
-        s_date, e_date, is_all_day, _ = parse_start_end(ev)
+        s_date, e_date, is_all_day = ev.inicio, ev.fim, ev.dia_inteiro
         if not s_date:
             continue
         if is_all_day and e_date:
             e_date = e_date - datetime.timedelta(days=1)
 
         if (s_date <= d_fim_s1) and (e_date >= d_ini_s):
-            summary = limpar_texto(ev.get("summary", "")).strip()
+            summary = ev.titulo
             if summary:
-                tipo_match    = re.search(r'\(([^)]+)\)', summary)
-                tipo          = tipo_match.group(1).strip().upper() if tipo_match else ""
-                nome_operacao = re.sub(r'\s*\([^)]+\)', '', summary).strip() if tipo_match else summary
+                nome_operacao, tipo = separar_operacao(summary)
                 operacoes_ativas.append({'nome': nome_operacao, 'tipo': tipo, 'data_inicio': s_date})
 
     operacoes_unicas = {}
@@ -545,16 +1869,16 @@ def buscar_operacoes(service, d_ini_s, d_fim_s1):
 # BULLETS CURSOS/ESTÁGIOS — com Smn, Local e Militares
 # =========================================================
 
-def bullets_periodo(service, calendar_id: str, d_ini: datetime.date, d_fim: datetime.date, incluir_responsavel: bool = False):
-    d_busca_ini = d_ini - datetime.timedelta(days=365)
-    d_busca_fim = d_fim + datetime.timedelta(days=30)
+_RE_MARCADOR_SMN     = re.compile(r'Smn\s+\d+/\d+', re.IGNORECASE)
+_RE_SEPARA_MILITARES = re.compile(r'[,;\n]')
 
-    evs  = list_events(service, calendar_id, d_busca_ini, d_busca_fim)
-    hoje = datetime.date.today()
+def bullets_periodo(armazem, calendar_id: str, d_ini: datetime.date, d_fim: datetime.date, incluir_responsavel: bool = False):
+    evs  = armazem.sobrepostos(calendar_id, d_ini, d_fim)
+    hoje = data_hoje()
     linhas = []
 
     for ev in evs:
-        s_date, e_date, is_all_day, _ = parse_start_end(ev)
+        s_date, e_date, is_all_day = ev.inicio, ev.fim, ev.dia_inteiro
         if not s_date:
             continue
         if is_all_day and e_date:
@@ -563,7 +1887,7 @@ def bullets_periodo(service, calendar_id: str, d_ini: datetime.date, d_fim: date
         if not ((s_date <= d_fim) and (e_date >= d_ini)):
             continue
 
-        s = limpar_texto(ev.get("summary", "")).strip()
+        s = ev.titulo
         if not s:
             continue
 
@@ -588,10 +1912,10 @@ def bullets_periodo(service, calendar_id: str, d_ini: datetime.date, d_fim: date
             sem_atual       = min((dias_decorridos // 7) + 1, total_sem)
             smn_txt         = f"Smn {sem_atual}/{total_sem}"
 
-        local     = limpar_texto(ev.get("location",    "")).strip()
-        militares = limpar_texto(ev.get("description", "")).strip()
+        local     = ev.local
+        militares = ev.descricao
 
-        ja_tem_smn = bool(re.search(r'Smn\s+\d+/\d+', s, re.IGNORECASE))
+        ja_tem_smn = bool(_RE_MARCADOR_SMN.search(s))
         if ja_tem_smn:
             texto = f"{periodo_fmt} - {s}"
         else:
@@ -600,7 +1924,7 @@ def bullets_periodo(service, calendar_id: str, d_ini: datetime.date, d_fim: date
         if local:
             texto += f" - {local}"
         if militares:
-            lista_mil = [m.strip() for m in re.split(r'[,;\n]', militares) if m.strip()]
+            lista_mil = [m.strip() for m in _RE_SEPARA_MILITARES.split(militares) if m.strip()]
             if lista_mil:
                 texto += " - " + ", ".join(lista_mil)
 
@@ -622,11 +1946,11 @@ def bullets_periodo(service, calendar_id: str, d_ini: datetime.date, d_fim: date
 # FERIADOS
 # =========================================================
 
-def buscar_feriados(service, d_ini: datetime.date, d_fim: datetime.date):
-    evs      = list_events(service, IDS["datas"], d_ini, d_fim)
+def buscar_feriados(armazem, d_ini: datetime.date, d_fim: datetime.date):
+    evs      = armazem.eventos(IDS["datas"], d_ini, d_fim)
     feriados = set()
     for ev in evs:
-        s_date, e_date, is_all_day, _ = parse_start_end(ev)
+        s_date, e_date, is_all_day = ev.inicio, ev.fim, ev.dia_inteiro
         if s_date:
             cur = s_date
             while cur < e_date if is_all_day else cur <= e_date:
@@ -638,42 +1962,41 @@ def buscar_feriados(service, d_ini: datetime.date, d_fim: datetime.date):
 # ATIVIDADES FUTURAS — automático, 45 dias após fim S+1
 # =========================================================
 
-def buscar_atividades_futuras(service, fim_s1: datetime.date) -> list:
-    d_ini_fut = fim_s1 + datetime.timedelta(days=1)
-    d_fim_fut = fim_s1 + datetime.timedelta(days=45)
-
-    agendas_futuras = {
-        "pgi":       IDS["pgi"],
-        "s3":        IDS["s3"],
-        "cmt":       IDS["cmt"],
-        "adj_cmdo":  IDS["adj_cmdo"],
-        "b_mus":     IDS["b_mus"],
-        "cia_2":     IDS["cia_2"],
-        "npor":      IDS["npor"],
-        "datas":     IDS["datas"],
-        "operacoes": IDS["operacoes"],
-    }
+AGENDAS_FUTURAS = ["pgi", "s3", "cmt", "adj_cmdo", "b_mus", "cia_2", "npor", "datas", "operacoes"]
 
-    todos_eventos = []
+def pedidos_futuras(d_ini_fut: datetime.date, d_fim_fut: datetime.date) -> dict:
+    pedidos = {}
+    for nome_cal in AGENDAS_FUTURAS:
+        if nome_cal == "operacoes":
+            # Operações longas começam antes do período: basta a margem de fuso no início
+            pedidos[IDS[nome_cal]] = (janela_sobreposicao(d_ini_fut, d_fim_fut)[0], d_fim_fut)
+        else:
+            pedidos[IDS[nome_cal]] = (d_ini_fut, d_fim_fut)
+    return pedidos
 
-    for nome_cal, cal_id in agendas_futuras.items():
-        try:
-            if nome_cal == "operacoes":
-                evs = list_events(service, cal_id,
-                                  d_ini_fut - datetime.timedelta(days=365),
-                                  d_fim_fut)
-            else:
-                evs = list_events(service, cal_id, d_ini_fut, d_fim_fut)
+def linha_futura(s_date: datetime.date, e_date: datetime.date, summary: str) -> str:
+    dia_fmt = f"{s_date.day:02d} {formatar_mes_abreviado(s_date)}"
 
-            for ev in evs:
-                ev["_cal_nome"] = nome_cal
-            todos_eventos.extend(evs)
-        except Exception as e:
-            print(f"Erro atividades futuras ({nome_cal}): {e}")
+    if e_date and e_date != s_date:
+        ano_fim      = str(e_date.year)[-2:]
+        data_fim_fmt = f"{e_date.day:02d} {formatar_mes_abreviado(e_date)} {ano_fim}"
+        data_exib    = f"{dia_fmt} a {data_fim_fmt}"
+    else:
+        data_exib = dia_fmt
+
+    return f" {data_exib} - {summary}"
+
+def buscar_atividades_futuras(armazem, fim_s1: datetime.date) -> list:
+    d_ini_fut = fim_s1 + datetime.timedelta(days=1)
+    d_fim_fut = fim_s1 + datetime.timedelta(days=HORIZONTE_FUTURAS_DIAS)
+
+    por_agenda = armazem.eventos_por_agenda(pedidos_futuras(d_ini_fut, d_fim_fut))
+
+    todos_eventos = [ev for nome_cal in AGENDAS_FUTURAS for ev in por_agenda[IDS[nome_cal]]]
 
     eventos_validos = []
     for ev in todos_eventos:
-        s_date, e_date, is_all_day, _ = parse_start_end(ev)
+        s_date, e_date, is_all_day = ev.inicio, ev.fim, ev.dia_inteiro
         if not s_date:
             continue
 
@@ -686,7 +2009,7 @@ def buscar_atividades_futuras(service, fim_s1: datetime.date) -> list:
         if not ativo_no_periodo:
             continue
 
-        summary = limpar_texto(ev.get("summary", "")).strip()
+        summary = ev.titulo
         if not summary:
             continue
 
@@ -717,24 +2040,7 @@ def buscar_atividades_futuras(service, fim_s1: datetime.date) -> list:
 
     unicos.sort(key=lambda x: x["s_date"])
 
-    linhas = []
-    for ev in unicos:
-        s_date  = ev["s_date"]
-        e_date  = ev["e_date"]
-        summary = ev["summary"]
-
-        dia_fmt = f"{s_date.day:02d} {formatar_mes_abreviado(s_date)}"
-
-        if e_date and e_date != s_date:
-            ano_fim      = str(e_date.year)[-2:]
-            data_fim_fmt = f"{e_date.day:02d} {formatar_mes_abreviado(e_date)} {ano_fim}"
-            data_exib    = f"{dia_fmt} a {data_fim_fmt}"
-        else:
-            data_exib = dia_fmt
-
-        linhas.append(f" {data_exib} - {summary}")
-
-    return linhas
+    return [linha_futura(ev["s_date"], ev["e_date"], ev["summary"]) for ev in unicos]
 
 # =========================================================
 # TABELAS
@@ -782,29 +2088,49 @@ AGENDAS_TABELA = [
     "com_soc", "fiscal", "prm", "sfpc",
 ]
 
-def construir_tabela_semana(service, d_ini, d_fim, incluir_cmt, incluir_pgi, feriados, semana_tipo="s"):
-    # semana_tipo: "sm1" | "s" | "s1"
-    todos = []
-
-    for chave in AGENDAS_TABELA:
-        if chave == "cmt" and not incluir_cmt:
-            continue
-        evs = list_events(service, IDS[chave], d_ini, d_fim)
-        todos.extend(evs)
-
+def agendas_da_tabela(incluir_cmt, incluir_pgi):
+    chaves = [c for c in AGENDAS_TABELA if incluir_cmt or c != "cmt"]
     if incluir_pgi:
-        evs_pgi = list_events(service, IDS["pgi"], d_ini, d_fim)
-        todos.extend(evs_pgi)
+        chaves.append("pgi")
+    return chaves
+
+STATUS_DIA_VAZIO   = "Realizado\nHistórico\nReagendado"
+STATUS_DIA_EVENTOS = "☐ Realizado\n☐ Histórico\n☐ Reagendado"
+
+def linha_dia_vazio(cur: datetime.date, eh_especial: bool) -> dict:
+    return {
+        "DATA":      fmt_data_coluna(cur),
+        "HORA":      "", "ATIVIDADE": "", "ATIV_DESC": "",
+        "LOCAL":     "", "UNIF":      "", "AGENDA":    "",
+        "OBS":       "", "STATUS":    STATUS_DIA_VAZIO,
+        "_especial": eh_especial, "_tem_desc": False,
+    }
 
-    # Desduplicação com prioridade
+def primeira_linha_descricao(descricao: str) -> str:
+    return descricao.split("  ")[0].split("\n")[0].strip()[:120]
+
+def linha_evento(data: str, hora: str, atividade: str, atividade_exib: str, local: str,
+                 resp: str, eh_especial: bool, tem_desc: bool) -> dict:
+    return {
+        "DATA":        data,
+        "HORA":        hora,
+        "ATIVIDADE":   atividade,
+        "ATIV_DESC":   atividade_exib,   # com description em azul
+        "LOCAL":       local,
+        "UNIF":        "",
+        "AGENDA":      resp,
+        "OBS":         "",
+        "STATUS":      STATUS_DIA_EVENTOS,
+        "_especial":   eh_especial,
+        "_tem_desc":   tem_desc,
+    }
+
+def desduplicar_por_prioridade(eventos) -> list:
+    """Um evento por título + data + hora: o da agenda de maior prioridade."""
     mapa_titulo = {}
-    for e in todos:
-        s_date, e_date, is_all_day, hora = parse_start_end(e)
-        titulo    = limpar_texto(e.get("summary", "")).strip()
-        hora_norm = "D" if is_all_day else hora
-        chave_titulo = f"{titulo}_{s_date}_{hora_norm}"
-        src       = e.get("_src_calendar_id", "")
-        prioridade = PRIORIDADE_RESP.get(src, 50)
+    for e in eventos:
+        chave_titulo = f"{e.titulo or ''}_{e.inicio}_{e.hora}"
+        prioridade   = e.prioridade
 
         if chave_titulo not in mapa_titulo:
             mapa_titulo[chave_titulo] = (prioridade, e)
@@ -812,63 +2138,305 @@ def construir_tabela_semana(service, d_ini, d_fim, incluir_cmt, incluir_pgi, fer
             prioridade_atual, _ = mapa_titulo[chave_titulo]
             if prioridade < prioridade_atual:
                 mapa_titulo[chave_titulo] = (prioridade, e)
+    return [e for _, e in mapa_titulo.values()]
 
-    evs = [e for _, e in mapa_titulo.values()]
+def construir_tabela_semana(armazem, d_ini, d_fim, incluir_cmt, incluir_pgi, feriados, semana_tipo="s"):
+    # semana_tipo: "sm1" | "s" | "s1"
+    todos  = armazem.eventos_varios([IDS[c] for c in agendas_da_tabela(incluir_cmt, incluir_pgi)], d_ini, d_fim)
+    indice = IndiceDiario(desduplicar_por_prioridade(todos), d_ini, d_fim)
 
     rows = []
     cur  = d_ini
     while cur <= d_fim:
-        evs_dia = [e for e in evs if event_intersects_day(e, cur)]
-        evs_dia.sort(key=lambda x: x.get("start", {}).get("dateTime",
-                     x.get("start", {}).get("date", "")))
+        evs_dia = indice.do_dia(cur)
 
         eh_especial = eh_fim_de_semana(cur) or cur in feriados
 
         if not evs_dia:
-            rows.append({
-                "DATA":      fmt_data_coluna(cur),
-                "HORA":      "", "ATIVIDADE": "", "ATIV_DESC": "",
-                "LOCAL":     "", "UNIF":      "", "AGENDA":    "",
-                "OBS":       "", "STATUS":    "Realizado\nHistórico\nReagendado",
-                "_especial": eh_especial, "_tem_desc": False,
-            })
+            rows.append(linha_dia_vazio(cur, eh_especial))
         else:
             for i, e in enumerate(evs_dia):
-                start    = e.get("start", {})
-                data_iso = start.get("dateTime", start.get("date", ""))
-                hora     = data_iso[11:16] if "T" in data_iso else "D"
-
-                atividade    = limpar_texto(e.get("summary",  "S/T"))
-                local        = limpar_texto(e.get("location", ""))
-                src          = e.get("_src_calendar_id", "")
-                resp         = RESP_MAP.get(src, "S3")
-                descricao    = limpar_texto(e.get("description", "")).strip()
+                atividade = e.titulo if e.titulo is not None else "S/T"
+                descricao = e.descricao
 
                 # Description em azul entre parênteses — apenas primeira linha
                 if descricao:
-                    primeira_linha_desc = descricao.split("  ")[0].split("\n")[0].strip()[:120]
-                    atividade_exib = f"{atividade}\n({primeira_linha_desc})"
+                    atividade_exib = f"{atividade}\n({primeira_linha_descricao(descricao)})"
                 else:
                     atividade_exib = atividade
 
-                rows.append({
-                    "DATA":        fmt_data_coluna(cur) if i == 0 else "",
-                    "HORA":        hora,
-                    "ATIVIDADE":   atividade,
-                    "ATIV_DESC":   atividade_exib,   # com description em azul
-                    "LOCAL":       local,
-                    "UNIF":        "",
-                    "AGENDA":      resp,
-                    "OBS":         "",
-                    "STATUS":      "☐ Realizado\n☐ Histórico\n☐ Reagendado",
-                    "_especial":   eh_especial if i == 0 else False,
-                    "_tem_desc":   bool(descricao),
-                })
+                rows.append(linha_evento(
+                    fmt_data_coluna(cur) if i == 0 else "", e.hora, atividade, atividade_exib,
+                    e.local, RESP_MAP.get(e.agenda, "S3"), eh_especial if i == 0 else False, bool(descricao),
+                ))
 
         cur += datetime.timedelta(days=1)
 
     return rows
 
+# =========================================================
+# MOTOR COLUNAR (pandas) — opcional, DSI_MOTOR_EVENTOS="pandas"
+# Os eventos carregados viram um DataFrame (uma linha por
+# evento, datas em datetime64); filtro de janela, desduplicação
+# por prioridade, expansão por dia e aglutinação das atividades
+# futuras são operações vetorizadas. Saída idêntica à do
+# caminho Python: as mesmas linhas de tabela e de futuras.
+# =========================================================
+
+def _ordinais(datas) -> list:
+    return [d.toordinal() if d else -1 for d in datas]
+
+def _timestamps(instantes) -> list:
+    return [t.timestamp() if t else np.nan for t in instantes]
+
+def quadro_eventos(eventos: list) -> pd.DataFrame:
+    """Uma linha por Evento. Datas como ordinais (-1 = sem data) e limites UTC como timestamp;
+    'pos' guarda a ordem de chegada, usada nos desempates como no caminho Python."""
+    return pd.DataFrame({
+        "agenda":       pd.Categorical([ev.agenda for ev in eventos]),
+        "prioridade":   [ev.prioridade for ev in eventos],
+        "inicio":       _ordinais(ev.inicio for ev in eventos),
+        "fim":          _ordinais(ev.fim for ev in eventos),
+        "dia_inteiro":  [ev.dia_inteiro for ev in eventos],
+        "hora":         [ev.hora for ev in eventos],
+        "ordem":        [ev.ordem for ev in eventos],
+        "primeiro_dia": _ordinais(ev.primeiro_dia for ev in eventos),
+        "ultimo_dia":   _ordinais(ev.ultimo_dia for ev in eventos),
+        "inicio_utc":   _timestamps(ev.inicio_utc for ev in eventos),
+        "fim_utc":      _timestamps(ev.fim_utc for ev in eventos),
+        "titulo":       [ev.titulo for ev in eventos],
+        "local":        [ev.local for ev in eventos],
+        "descricao":    [ev.descricao for ev in eventos],
+        "pos":          np.arange(len(eventos)),
+    })
+
+def quadro_por_agenda(armazem, calendar_ids: list, pedidos: dict) -> pd.DataFrame:
+    """Equivalente colunar de eventos_varios/eventos_por_agenda: eventos das agendas, na ordem
+    de calendar_ids, dentro da janela pedida para cada uma (critério de evento_na_janela)."""
+    armazem.garantir(pedidos)
+    df    = armazem.quadro()
+    cats  = df["agenda"].cat.categories
+    codes = df["agenda"].cat.codes.to_numpy()
+    posicao = {cal_id: i for i, cal_id in enumerate(calendar_ids)}
+    ini   = np.array([to_dt_utc_start(pedidos[c][0]).timestamp() if c in pedidos else np.inf for c in cats])
+    fim   = np.array([to_dt_utc_end_exclusive(pedidos[c][1]).timestamp() if c in pedidos else -np.inf for c in cats])
+    ordem = np.array([posicao.get(c, -1) for c in cats], dtype=int)
+
+    na_janela = (df["fim_utc"].to_numpy() > ini[codes]) & (df["inicio_utc"].to_numpy() < fim[codes])
+    out = df[na_janela].assign(ordem_agenda=ordem[codes[na_janela]])
+    out = out.sort_values(["ordem_agenda", "pos"], kind="stable")
+    return out.assign(pos=np.arange(len(out)))
+
+def construir_tabela_semana_pandas(armazem, d_ini, d_fim, incluir_cmt, incluir_pgi, feriados, semana_tipo="s"):
+    ids = [IDS[c] for c in agendas_da_tabela(incluir_cmt, incluir_pgi)]
+    df  = quadro_por_agenda(armazem, ids, {cal_id: (d_ini, d_fim) for cal_id in ids})
+
+    # Desduplicação: por título/data/hora fica a agenda de menor prioridade (empate: a primeira).
+    # Entre eventos do mesmo dia e mesmo início vale a ordem da primeira aparição da chave.
+    chave = ["titulo_chave", "inicio", "hora"]
+    df = df.assign(titulo_chave=df["titulo"].fillna(""))
+    df = df.assign(pos_chave=df.groupby(chave, sort=False)["pos"].transform("min"))
+    df = df.sort_values(["prioridade", "pos"], kind="stable").drop_duplicates(chave)
+
+    # Textos por evento (antes da expansão, que só os repete)
+    atividade = df["titulo"].fillna("S/T")
+    tem_desc  = df["descricao"] != ""
+    primeira  = df["descricao"].str.split("  ").str[0].str.split("\n").str[0].str.strip().str[:120]
+    df = df.assign(
+        atividade=atividade,
+        ativ_desc=atividade.where(~tem_desc, atividade + "\n(" + primeira + ")"),
+        resp=df["agenda"].map(RESP_MAP).astype(object).fillna("S3"),
+        tem_desc=tem_desc,
+    )
+
+    # Expansão por dia: uma linha por (evento, dia ocupado) dentro de [d_ini, d_fim]
+    ini = np.maximum(df["primeiro_dia"].to_numpy(), d_ini.toordinal())
+    fim = np.minimum(df["ultimo_dia"].to_numpy(), d_fim.toordinal())
+    n   = np.clip(fim - ini + 1, 0, None)
+    deslocamento = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    exp = df.iloc[np.repeat(np.arange(len(df)), n)].assign(dia=np.repeat(ini, n) + deslocamento)
+    exp = exp.sort_values(["dia", "ordem", "pos_chave"], kind="stable")
+
+    por_dia = {}
+    colunas = ("dia", "hora", "atividade", "ativ_desc", "local", "resp", "tem_desc")
+    for dia, *linha in zip(*(exp[c].tolist() for c in colunas)):
+        por_dia.setdefault(dia, []).append(linha)
+
+    rows = []
+    cur  = d_ini
+    while cur <= d_fim:
+        eh_especial = eh_fim_de_semana(cur) or cur in feriados
+        linhas = por_dia.get(cur.toordinal())
+        if not linhas:
+            rows.append(linha_dia_vazio(cur, eh_especial))
+        else:
+            for i, (hora, ativ, ativ_exib, local, ag, desc) in enumerate(linhas):
+                rows.append(linha_evento(
+                    fmt_data_coluna(cur) if i == 0 else "", hora, ativ, ativ_exib,
+                    local, ag, eh_especial if i == 0 else False, desc,
+                ))
+        cur += datetime.timedelta(days=1)
+    return rows
+
+def buscar_atividades_futuras_pandas(armazem, fim_s1: datetime.date) -> list:
+    d_ini_fut = fim_s1 + datetime.timedelta(days=1)
+    d_fim_fut = fim_s1 + datetime.timedelta(days=HORIZONTE_FUTURAS_DIAS)
+    df = quadro_por_agenda(armazem, [IDS[n] for n in AGENDAS_FUTURAS], pedidos_futuras(d_ini_fut, d_fim_fut))
+
+    ini   = df["inicio"].to_numpy()
+    fim   = df["fim"].to_numpy()
+    e_inc = np.where(df["dia_inteiro"].to_numpy() & (fim >= 0), fim - 1, np.where(fim >= 0, fim, ini))
+    df    = df.assign(e_inc=e_inc)
+    df    = df[(df["inicio"] >= 0) & (df["inicio"] <= d_fim_fut.toordinal())
+               & (df["e_inc"] >= d_ini_fut.toordinal()) & df["titulo"].fillna("").ne("")]
+
+    # Aglutinação: mesmo título, intervalos que se tocam ou se sobrepõem viram um só
+    df   = df.sort_values(["titulo", "inicio"], kind="stable")
+    ate  = df.groupby("titulo")["e_inc"].cummax().groupby(df["titulo"]).shift()
+    novo = ate.isna() | (df["inicio"] > ate + 1)
+    grupos = (df.assign(grupo=novo.cumsum())
+                .groupby("grupo", sort=True)
+                .agg(titulo=("titulo", "first"), s_date=("inicio", "min"), e_date=("e_inc", "max")))
+    grupos = grupos.drop_duplicates(["titulo", "s_date", "e_date"]).sort_values("s_date", kind="stable")
+
+    return [linha_futura(datetime.date.fromordinal(int(s_ord)), datetime.date.fromordinal(int(e_ord)), titulo)
+            for titulo, s_ord, e_ord in zip(grupos["titulo"], grupos["s_date"], grupos["e_date"])]
+
+# =========================================================
+# CARGA DE EVENTOS DA PÁGINA
+# Janela-união de todos os consumidores, por agenda.
+# =========================================================
+
+def planejar_janelas_dsi(armazem, ini_sm1, ini_s, fim_s, ini_s1, fim_s1, incluir_cmt, incluir_pgi):
+    margem = datetime.timedelta(days=MARGEM_SI_FASE_DIAS)
+    ini_fut = fim_s1 + datetime.timedelta(days=1)
+    fim_fut = fim_s1 + datetime.timedelta(days=HORIZONTE_FUTURAS_DIAS)
+
+    # buscar_si_duplo / buscar_fase
+    armazem.registrar(IDS["si"],   ini_s  - margem, fim_s1 + margem)
+    armazem.registrar(IDS["fase"], ini_s  - margem, fim_s1 + margem)
+    # buscar_operacoes / bullets_periodo
+    armazem.registrar(IDS["operacoes"], *janela_sobreposicao(ini_s, fim_s1))
+    armazem.registrar(IDS["cursos"],    *janela_sobreposicao(ini_s, fim_s1))
+    armazem.registrar(IDS["datas"],     *janela_sobreposicao(ini_s, fim_s1))
+    # buscar_feriados
+    armazem.registrar(IDS["datas"], ini_sm1, fim_s1)
+    # buscar_atividades_futuras
+    for nome_cal in AGENDAS_FUTURAS:
+        d_ini = janela_sobreposicao(ini_fut, fim_fut)[0] if nome_cal == "operacoes" else ini_fut
+        armazem.registrar(IDS[nome_cal], d_ini, fim_fut)
+    # construir_tabela_semana (S-1, S e S+1)
+    for chave in agendas_da_tabela(incluir_cmt, incluir_pgi):
+        armazem.registrar(IDS[chave], ini_sm1, fim_s1)
+
+# =========================================================
+# CARGA DE DADOS DA DSI
+# =========================================================
+# Tudo que depende do Calendar sai daqui, memoizado nas entradas que de fato
+# mudam o resultado: o usuário (chave_credencial, já que cada um vê as agendas
+# que lhe foram compartilhadas), ref_date, incluir_cmt e incluir_pgi. Nº da DSI,
+# textos da Formatura Geral e demais campos de formulário não disparam nova busca.
+# ATUALIZAR limpa este cache (st.cache_data.clear()).
+
+def armazem_dsi(creds) -> ArmazemEventos:
+    return ArmazemEventos(
+        creds,
+        cache=None if SYNC_INCREMENTAL else CacheEventos(),
+        sincronizador=SincronizadorAgendas() if SYNC_INCREMENTAL else None,
+    )
+
+def carregar_armazem(armazem: ArmazemEventos):
+    t_carga = time.perf_counter()
+    with etapa("eventos"):
+        armazem.carregar()
+    registrar_log("EVENTOS_CARREGADOS", f"{armazem.buscas} agendas buscadas ({armazem.modo_busca}), "
+                                        f"{armazem.do_cache} do cache, {time.perf_counter() - t_carga:.2f}s")
+
+@st.cache_data(ttl=CACHE_TTL_SEGUNDOS, show_spinner="🔍 Buscando informações dos calendários...")
+def carregar_dados_dsi(chave: str, _creds, ref_date: datetime.date, incluir_cmt: bool, incluir_pgi: bool) -> dict:
+    contar("memo.falhas")
+    ini_sm1, _, ini_s, fim_s, ini_s1, fim_s1 = semanas_dsi(ref_date)
+    armazem = armazem_dsi(_creds)
+    planejar_janelas_dsi(armazem, ini_sm1, ini_s, fim_s, ini_s1, fim_s1, incluir_cmt, incluir_pgi)
+    carregar_armazem(armazem)
+    return dados_semana_dsi(armazem, ref_date, incluir_cmt, incluir_pgi)
+
+def dados_semana_dsi(armazem: ArmazemEventos, ref_date: datetime.date, incluir_cmt: bool, incluir_pgi: bool,
+                     feriados: set = None, tabelas: dict = None) -> dict:
+    """Dados da DSI da semana de ref_date, de um armazém já carregado.
+
+    feriados e tabelas ({início da semana: rows}) podem vir de fora para um
+    lote de semanas: a tabela de uma semana é a mesma como S+1, S ou S-1.
+    """
+    ini_sm1, fim_sm1, ini_s, fim_s, ini_s1, fim_s1 = semanas_dsi(ref_date)
+    if MOTOR_EVENTOS == "pandas":
+        tabela, futuras = construir_tabela_semana_pandas, buscar_atividades_futuras_pandas
+    else:
+        tabela, futuras = construir_tabela_semana, buscar_atividades_futuras
+    with etapa("extracao"):
+        if feriados is None:
+            feriados   = buscar_feriados(armazem, ini_sm1, fim_s1)
+        si             = buscar_si_duplo(armazem, ini_s, fim_s, ini_s1, fim_s1)
+        fase           = buscar_fase(armazem, ini_s, fim_s1) or "Mdd Adm"
+        operacoes      = buscar_operacoes(armazem, ini_s, fim_s1)
+        bullets_cursos = bullets_periodo(armazem, IDS["cursos"], ini_s, fim_s1, incluir_responsavel=True)
+        bullets_datas  = bullets_periodo(armazem, IDS["datas"],  ini_s, fim_s1)
+    with etapa("futuras"):
+        ativ_futuras = futuras(armazem, fim_s1)
+    with etapa("tabelas"):
+        tabelas = {} if tabelas is None else tabelas
+        for ini, fim in ((ini_sm1, fim_sm1), (ini_s, fim_s), (ini_s1, fim_s1)):
+            if ini not in tabelas:
+                tabelas[ini] = tabela(armazem, ini, fim, incluir_cmt, incluir_pgi, feriados)
+        rows_sm1, rows_s, rows_s1 = tabelas[ini_sm1], tabelas[ini_s], tabelas[ini_s1]
+    return {
+        "si":                  si,
+        "fase":                fase,
+        "operacoes_linhas":    operacoes,
+        "ativ_futuras_linhas": ativ_futuras,
+        "bullets_cursos":      bullets_cursos,
+        "bullets_datas":       bullets_datas,
+        "rows_sm1":            rows_sm1,
+        "rows_s":              rows_s,
+        "rows_s1":             rows_s1,
+        "erros":               dict(armazem.erros),
+    }
+
+# =========================================================
+# LOTE DE SEMANAS
+# No início de uma fase a S3 planeja várias DSIs de uma vez. As
+# janelas de todas as semanas vão para um único armazém, que é
+# carregado uma vez; cada DSI (S-1/S/S+1) sai da memória, e a
+# tabela de cada semana é montada uma só vez para todo o lote.
+# =========================================================
+
+MAX_SEMANAS_LOTE = 8
+
+def semanas_do_lote(ref_inicial: datetime.date, quantidade: int) -> list:
+    """Datas de referência (segundas) das `quantidade` DSIs a partir da semana de ref_inicial."""
+    inicio = monday_of(ref_inicial)
+    return [inicio + datetime.timedelta(weeks=k) for k in range(quantidade)]
+
+@st.cache_data(ttl=CACHE_TTL_SEGUNDOS, show_spinner="🔍 Buscando as agendas do lote...")
+def carregar_lote_dsi(chave: str, _creds, ref_inicial: datetime.date, quantidade: int, incluir_cmt: bool, incluir_pgi: bool) -> list:
+    """[dados] de cada semana do lote, no formato de carregar_dados_dsi, com uma carga só."""
+    contar("memo.falhas")
+    refs    = semanas_do_lote(ref_inicial, quantidade)
+    armazem = armazem_dsi(_creds)
+    for ref in refs:
+        ini_sm1, _, ini_s, fim_s, ini_s1, fim_s1 = semanas_dsi(ref)
+        planejar_janelas_dsi(armazem, ini_sm1, ini_s, fim_s, ini_s1, fim_s1, incluir_cmt, incluir_pgi)
+    carregar_armazem(armazem)
+
+    with etapa("feriados"):
+        feriados = buscar_feriados(armazem, semanas_dsi(refs[0])[0], semanas_dsi(refs[-1])[5])
+    tabelas = {}
+    lote    = []
+    for ref in refs:
+        with etapa(f"semana {ref.isoformat()}"):
+            lote.append(dados_semana_dsi(armazem, ref, incluir_cmt, incluir_pgi, feriados, tabelas))
+    return lote
+
 # =========================================================
 # EXPORTAÇÃO EXCEL
 # =========================================================
@@ -925,22 +2493,432 @@ def salvar_historico(num_dsi: int, periodo: str, doc_id: str):
         st.warning(f"⚠️ Não foi possível salvar histórico: {e}")
 
 # =========================================================
-# GOOGLE DOCS
+# PREVIEW HTML
 # =========================================================
 
-def criar_google_doc(creds, titulo_doc, num_fmt, ref_date,
-                     ini_sm1, fim_sm1, ini_s, fim_s, ini_s1, fim_s1,
-                     si, fase, operacoes_linhas, bullets_cursos, bullets_datas,
-                     rows_sm1, rows_s, rows_s1, ativ_futuras_linhas,
-                     fg=None, su="", ativ_nao_exec=""):
-    if fg is None:
-        fg = {"finalidade": "", "dia": "", "dobrado": "", "cancao": "", "gs": "", "armado": ""}
+def render_tabela_html(rows, especial_list, table_id="dsi", semana_tipo="s"):
+    if semana_tipo == "sm1":
+        cols   = ["DATA", "HORA", "ATIV_DESC", "LOCAL", "UNIF", "AGENDA", "STATUS"]
+        hdrs   = ["DATA", "HORA", "ATIVIDADE", "LOCAL", "UNIF", "AG",     "STATUS"]
+        widths = {"DATA":"10%","HORA":"5%","ATIV_DESC":"30%","LOCAL":"20%","UNIF":"5%","AGENDA":"5%","STATUS":"10%"}
+    else:
+        cols   = ["DATA", "HORA", "ATIV_DESC", "LOCAL", "UNIF", "AGENDA", "OBS"]
+        hdrs   = ["DATA", "HORA", "ATIVIDADE", "LOCAL", "UNIF", "AG",     "OBS"]
+        widths = {"DATA":"11%","HORA":"5%","ATIV_DESC":"33%","LOCAL":"22%","UNIF":"5%","AGENDA":"6%","OBS":"8%"}
+    html   = f"""
+    <style>
+    #{table_id} {{width:100%;border-collapse:collapse;font-size:12px;font-family:Calibri,Arial,sans-serif;}}
+    #{table_id} th {{background:#555;color:white;text-align:center;vertical-align:middle;padding:4px 3px;border:1px solid #999;font-weight:bold;}}
+    #{table_id} td {{text-align:center;vertical-align:middle;padding:3px 3px;border:1px solid #ccc;line-height:1.2;}}
+    #{table_id} tr.alt {{background:#ddd;}} #{table_id} tr.normal {{background:#fff;}}
+    #{table_id} tr.especial td {{color:red;background:#fdd;}}
+    .desc-azul {{color:#1258ae;}}
+    </style><table id="{table_id}"><thead><tr>"""
+    for c, h in zip(cols, hdrs):
+        html += f'<th style="width:{widths[c]}">{h}</th>'
+    html += "</tr></thead><tbody>"
+    alt = True
+    for idx, row in enumerate(rows):
+        eh_esp = especial_list[idx] if idx < len(especial_list) else False
+        if row.get("DATA"):
+            alt = not alt
+        cls  = "especial" if eh_esp else ("alt" if alt else "normal")
+        html += f'<tr class="{cls}">'
+        for c in cols:
+            val = row.get(c, "") or ""
+            if c == "ATIV_DESC" and row.get("_tem_desc"):
+                # description está na segunda linha (separada por \n)
+                partes = val.split("\n", 1)
+                if len(partes) == 2:
+                    val = partes[0] + f'<br><span class="desc-azul">' + partes[1] + "</span>"
+                else:
+                    abre = val.find("(")
+                    if abre >= 0:
+                        val = val[:abre] + f'<span class="desc-azul">' + val[abre:] + "</span>"
+            elif c == "STATUS":
+                if val:
+                    linhas_s = val.split("\n")
+                    cores_s  = ["#1258ae", "#008021", "#c71414"]
+                    val = "<br>".join(
+                        f'<span style="color:{c};font-size:10px">{l}</span>'
+                        for l, c in zip(linhas_s, cores_s)
+                    )
+            html += f"<td>{val}</td>"
+        html += "</tr>"
+    html += "</tbody></table>"
+    return html
+
+# =========================================================
+# ESTILO DA DSI — comum ao Google Docs e ao .docx local
+# =========================================================
+
+PADRAO_TITULO_DSI    = re.compile(r'DIRETRIZ SEMANAL DE INSTRUÇÃO \d+', re.IGNORECASE)
+PADRAO_CABECALHO_BTL = re.compile(
+    r'MINISTÉRIO DA DEFESA|EXÉRCITO BRASILEIRO|BATALHÃO DE INFANTARIA|'
+    r'Batalhão de Caçadores|BATALHÃO BARÃO DE CAXIAS',
+    re.IGNORECASE
+)
+# Linhas do cabeçalho superior (DSI Nº, data, Visto S3, traço, Cap PIERROTI)
+PADRAO_CABECALHO_DSI = re.compile(r'^DSI Nº|^Visto S3|^Cap PIERROTI|^_+$', re.IGNORECASE)
+PADRAO_DATA_DSI      = re.compile(r'^\d{1,2} [A-Z]{3} \d{2}$')
+PADRAO_QTS           = re.compile(r'\(QTS nº', re.IGNORECASE)
+PADRAO_CONFIRMACAO   = re.compile(r'CONFIRMAR OU REAGENDAR|EXECUTAR OU REAGENDAR|PLANEJAR', re.IGNORECASE)
+PADROES_SECOES_NEGRITO = [
+    r"1\.\s+OPERA[ÇC][ÕO]ES[:\s]?",
+    r"2\.\s+CURSOS E EST[ÁA]GIOS",
+    r"3\.\s+DATAS COMEMORATIVAS",
+    r"4\.\s+INSTRU[ÇC][ÃA]O",
+    r"5\.\s+FORMATURA GERAL",
+    r"6\.\s+ATIVIDADES FUTURAS",
+]
+SEC_CURSOS  = re.compile(r'^2\.\s+CURSOS', re.IGNORECASE)
+SEC_DATAS   = re.compile(r'^3\.\s+DATAS', re.IGNORECASE)
+SEC_FUTURAS = re.compile(r'^6\.\s+ATIVIDADES FUTURAS', re.IGNORECASE)
+
+COR_AZUL          = {'red': 0.07, 'green': 0.36, 'blue': 0.68}
+COR_LARANJA       = {'red': 0.85, 'green': 0.33, 'blue': 0.1}
+COR_CINZA_CLARO   = {'red': 0.85, 'green': 0.85, 'blue': 0.85}
+COR_CINZA_HEADER  = {'red': 0.4,  'green': 0.4,  'blue': 0.4}
+COR_DIA_ESPECIAL  = {'red': 1.0,  'green': 0.8,  'blue': 0.8}
+COR_BRANCO        = {'red': 1.0,  'green': 1.0,  'blue': 1.0}
+COR_PRETO         = {'red': 0.0,  'green': 0.0,  'blue': 0.0}
+# ☐ Realizado — azul / ☐ Histórico — verde / ☐ Reagendado — vermelho
+CORES_LINHAS_STATUS = [
+    {'red': 0.07, 'green': 0.36, 'blue': 0.68},
+    {'red': 0.0,  'green': 0.50, 'blue': 0.13},
+    {'red': 0.78, 'green': 0.08, 'blue': 0.08},
+]
+
+def colunas_tabela(semana_tipo: str):
+    """(chaves das linhas, cabeçalhos, larguras em pt) da tabela no documento."""
+    if semana_tipo == "sm1":
+        return (["DATA", "HORA", "ATIV_DESC", "LOCAL", "AGENDA", "STATUS"],
+                ["DATA", "HORA", "ATIVIDADE", "LOCAL", "AG",     "STATUS"],
+                [80, 38, 190, 120, 35, 65])
+    return (["DATA", "HORA", "ATIV_DESC", "LOCAL", "UNIF", "AGENDA", "OBS"],
+            ["DATA", "HORA", "ATIVIDADE", "LOCAL", "UNIF", "AG",     "OBS"],
+            [95, 38, 185, 125, 28, 28, 28])
+
+def agrupar_linhas_por_data(rows):
+    """{rótulo DATA: [índices das linhas do dia]} na ordem da tabela."""
+    grupos_data = {}
+    data_atual  = None
+    for idx, row_data in enumerate(rows):
+        data = row_data.get("DATA", "")
+        if data:
+            data_atual = data
+            grupos_data[data_atual] = []
+        if data_atual:
+            grupos_data[data_atual].append(idx)
+    return grupos_data
+
+def cores_fundo_linhas(rows, grupos_data):
+    """Cor de fundo de cada linha: dias especiais em vermelho claro, demais alternando cinza/branco."""
+    cores = {}
+    cor_alternada = True
+    for data, indices in grupos_data.items():
+        eh_dia_especial = any(rows[idx].get('_especial', False) for idx in indices)
+        if eh_dia_especial:
+            cor = COR_DIA_ESPECIAL
+        else:
+            cor = COR_CINZA_CLARO if cor_alternada else COR_BRANCO
+        for idx in indices:
+            cores[idx] = cor
+        if not eh_dia_especial:
+            cor_alternada = not cor_alternada
+    return cores
 
-    docs_service = build('docs', 'v1', credentials=creds)
-    doc    = docs_service.documents().create(body={'title': titulo_doc}).execute()
-    doc_id = doc['documentId']
-    hoje   = datetime.date.today()
+def texto_celula(valor) -> str:
+    if valor is None or (isinstance(valor, float) and pd.isna(valor)):
+        return ""
+    return str(valor).strip()
+
+# =========================================================
+# GOOGLE DOCS – MODELO LOCAL DE ÍNDICES
+# O documento é criado vazio e preenchido só com inserções no
+# fim do corpo, então a posição de cada parágrafo, tabela,
+# linha e célula é calculada aqui (em unidades UTF-16, como a
+# API conta) em vez de relida com documents().get.
+# =========================================================
 
+# Requests por chamada de batchUpdate quando o documento inteiro vai de uma vez
+TAMANHO_LOTE_DOCS = 500
+
+def _tam_utf16(texto: str) -> int:
+    return len(texto.encode("utf-16-le")) // 2
+
+def _normalizar_texto_doc(texto: str) -> str:
+    return texto.replace("\r\n", "\n").replace("\r", "\n")
+
+def _paragrafos_de(texto: str) -> list:
+    """Parágrafos (cada um com o "\\n" final) formados por um trecho terminado em "\\n"."""
+    return [linha + "\n" for linha in texto.split("\n")[:-1]]
+
+def _tam_bloco(bloco) -> int:
+    if isinstance(bloco, str):
+        return _tam_utf16(bloco)
+    # tabela: marcador de início e de fim; por linha, um marcador;
+    # por célula, um marcador + o texto + o "\n" do último parágrafo
+    return 2 + sum(1 + sum(2 + _tam_utf16(texto) for texto in linha) for linha in bloco)
+
+def _paragrafo_modelo(texto: str, inicio: int) -> dict:
+    fim = inicio + _tam_utf16(texto)
+    return {'startIndex': inicio, 'endIndex': fim, 'paragraph': {'elements': [
+        {'startIndex': inicio, 'endIndex': fim, 'textRun': {'content': texto}}
+    ]}}
+
+def fins_apos_requests(requests: list) -> list:
+    """endIndex do corpo após os k primeiros requests (só inserções mudam o tamanho)."""
+    fins = [2]
+    for r in requests:
+        if 'insertText' in r:
+            delta = _tam_utf16(r['insertText']['text'])
+        elif 'insertTable' in r:
+            t     = r['insertTable']
+            delta = 3 + t['rows'] * (2 * t['columns'] + 1)
+        else:
+            delta = 0
+        fins.append(fins[-1] + delta)
+    return fins
+
+class ModeloDocumento:
+    """Corpo de um documento novo, atualizado a cada inserção no fim.
+
+    Um documento recém-criado tem a quebra de seção [0, 1) e um parágrafo vazio
+    [1, 2). insertTable acrescenta um "\\n" antes da tabela, e a tabela vazia
+    ocupa 2 + linhas × (2 × colunas + 1) posições.
+    """
+
+    def __init__(self):
+        # parágrafos (str terminada em "\n") e tabelas (lista de linhas de textos)
+        self.blocos = ["\n"]
+
+    @property
+    def fim(self) -> int:
+        """endIndex do corpo."""
+        return 1 + sum(_tam_bloco(b) for b in self.blocos)
+
+    def inserir_texto(self, texto: str) -> list:
+        texto = _normalizar_texto_doc(texto)
+        if not texto:
+            return []
+        indice = self.fim - 1
+        ultimo = self.blocos.pop()
+        self.blocos.extend(_paragrafos_de(ultimo[:-1] + texto + "\n"))
+        return [{'insertText': {'location': {'index': indice}, 'text': texto}}]
+
+    def inserir_tabela(self, celulas: list):
+        """Insere e preenche uma tabela no fim do corpo: (startIndex da tabela, requests).
+
+        As células são preenchidas da última para a primeira, para que cada
+        insertText use a posição da célula ainda vazia.
+        """
+        celulas  = [[_normalizar_texto_doc(texto) for texto in linha] for linha in celulas]
+        n_linhas = len(celulas)
+        n_cols   = len(celulas[0])
+        indice   = self.fim - 1
+        inicio   = indice + 1
+        passo    = 2 * n_cols + 1
+        requests = [{'insertTable': {'rows': n_linhas, 'columns': n_cols, 'location': {'index': indice}}}]
+        for r in range(n_linhas - 1, -1, -1):
+            for c in range(n_cols - 1, -1, -1):
+                if celulas[r][c]:
+                    requests.append({'insertText': {
+                        'location': {'index': inicio + 3 + r * passo + 2 * c},
+                        'text': celulas[r][c],
+                    }})
+        # o "\n" inserido fecha o parágrafo atual; o "\n" final do corpo fica após a tabela
+        ultimo = self.blocos.pop()
+        self.blocos.extend([ultimo, celulas, "\n"])
+        return inicio, requests
+
+    def conteudo(self) -> list:
+        """body.content no formato de documents().get, com os índices calculados."""
+        content = [{'endIndex': 1, 'sectionBreak': {}}]
+        pos = 1
+        for bloco in self.blocos:
+            if isinstance(bloco, str):
+                content.append(_paragrafo_modelo(bloco, pos))
+                pos += _tam_utf16(bloco)
+                continue
+            inicio_tabela = pos
+            pos += 1
+            linhas = []
+            for linha in bloco:
+                inicio_linha = pos
+                pos += 1
+                celulas = []
+                for texto in linha:
+                    inicio_celula = pos
+                    pos += 1
+                    paragrafos = []
+                    for p in _paragrafos_de(texto + "\n"):
+                        paragrafos.append(_paragrafo_modelo(p, pos))
+                        pos += _tam_utf16(p)
+                    celulas.append({'startIndex': inicio_celula, 'endIndex': pos, 'content': paragrafos})
+                linhas.append({'startIndex': inicio_linha, 'endIndex': pos, 'tableCells': celulas})
+            pos += 1
+            content.append({'startIndex': inicio_tabela, 'endIndex': pos, 'table': {
+                'rows': len(bloco), 'columns': len(bloco[0]), 'tableRows': linhas,
+            }})
+        return content
+
+# =========================================================
+# EXPORTAÇÃO RETOMÁVEL
+# Cada exportação tem uma chave (usuário + nº da DSI + semana S) e um
+# checkpoint em disco com o documento, a fase e os requests já
+# aplicados; uma nova tentativa continua do ponto salvo no mesmo
+# doc_id. O arquivo no Drive leva a chave em appProperties, de
+# modo que a mesma DSI nunca é criada duas vezes.
+# =========================================================
+
+PROPRIEDADE_CHAVE_DSI = "dsi_chave"
+CAMPOS_ARQUIVOS_DSI   = mascara_campos("drive.arquivos_dsi", "files(id)")
+CAMPOS_DOC_FIM        = mascara_campos("docs.fim", "body(content(endIndex))")
+
+def chave_exportacao(creds, num_fmt, ini_s: datetime.date) -> str:
+    """A credencial entra na chave: checkpoints e tarefas de um usuário não servem a outro."""
+    return f"DSI-{num_fmt}-{ini_s.isoformat()}-{chave_credencial(creds)}"
+
+def impressao_exportacao(*partes) -> str:
+    """Resumo do conteúdo exportado: muda se qualquer texto ou linha da DSI mudar."""
+    dados = json.dumps(partes, default=str, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(dados.encode("utf-8")).hexdigest()
+
+class CheckpointsExportacao:
+    def __init__(self, diretorio: str = CACHE_DIR):
+        os.makedirs(diretorio, exist_ok=True)
+        self.caminho = os.path.join(diretorio, "exportacoes.sqlite3")
+        with self._conectar() as con:
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS exportacoes (
+                    chave         TEXT PRIMARY KEY,
+                    doc_id        TEXT,
+                    impressao     TEXT NOT NULL,
+                    hoje          TEXT NOT NULL,
+                    fase          TEXT NOT NULL,
+                    aplicados     INTEGER NOT NULL,
+                    concluida     INTEGER NOT NULL,
+                    atualizado_em REAL NOT NULL
+                )""")
+
+    def _conectar(self):
+        return sqlite3.connect(self.caminho, timeout=10)
+
+    def obter(self, chave: str):
+        with self._conectar() as con:
+            linha = con.execute(
+                "SELECT doc_id, impressao, hoje, fase, aplicados, concluida FROM exportacoes WHERE chave = ?",
+                (chave,),
+            ).fetchone()
+        if not linha:
+            return None
+        return {"doc_id": linha[0], "impressao": linha[1], "hoje": linha[2],
+                "fase": linha[3], "aplicados": linha[4], "concluida": bool(linha[5])}
+
+    def gravar(self, chave: str, estado: dict):
+        with self._conectar() as con:
+            con.execute("INSERT OR REPLACE INTO exportacoes VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (
+                chave, estado["doc_id"], estado["impressao"], estado["hoje"], estado["fase"],
+                estado["aplicados"], int(estado["concluida"]), time.time(),
+            ))
+
+class ExportacaoRetomavel:
+    """Estado de uma exportação, gravado a cada fase/lote quando há chave e checkpoints."""
+
+    def __init__(self, chave: str = None, impressao: str = "", checkpoints: CheckpointsExportacao = None, tarefa=None):
+        self.chave       = chave
+        self.checkpoints = checkpoints
+        self.tarefa      = tarefa
+        salvo = checkpoints.obter(chave) if checkpoints and chave else None
+        if salvo and salvo["impressao"] == impressao:
+            self.estado = salvo
+        else:
+            # Exportação nova ou conteúdo alterado: mesmo documento, se houver, montado do zero
+            doc_id = salvo["doc_id"] if salvo else None
+            self.estado = {"doc_id": doc_id, "impressao": impressao,
+                           "hoje": data_hoje().isoformat(), "fase": "reconstruir" if doc_id else "criar",
+                           "aplicados": 0, "concluida": False}
+            self._gravar()
+
+    @property
+    def doc_id(self):
+        return self.estado["doc_id"]
+
+    @property
+    def reconstruir(self) -> bool:
+        """O corpo do documento é de outro conteúdo (ou desconhecido): esvaziar antes de enviar."""
+        return self.estado["fase"] == "reconstruir"
+
+    @property
+    def hoje(self) -> datetime.date:
+        # a data da assinatura fica fixa entre tentativas, para o conteúdo não mudar
+        return datetime.date.fromisoformat(self.estado["hoje"])
+
+    def marcar(self, **campos):
+        self.estado.update(campos)
+        self._gravar()
+
+    def _gravar(self):
+        if self.checkpoints and self.chave:
+            self.checkpoints.gravar(self.chave, self.estado)
+
+    def relatar(self, etapa: str, feito: int = 0, total: int = 0):
+        """Repassa o progresso à tarefa da fila (que também interrompe se foi cancelada)."""
+        if self.tarefa:
+            self.tarefa.relatar(etapa, feito, total)
+
+    def obter_documento(self, creds, drive_service):
+        """doc_id do checkpoint ou, sem ele, o arquivo marcado com a chave no Drive."""
+        if self.doc_id is None and self.chave:
+            doc_id = localizar_documento_exportado(creds, drive_service, self.chave)
+            if doc_id:
+                self.marcar(doc_id=doc_id, aplicados=0, fase="reconstruir")
+        return self.doc_id
+
+    def propriedades(self) -> dict:
+        return {PROPRIEDADE_CHAVE_DSI: self.chave} if self.chave else {}
+
+def localizar_documento_exportado(creds, drive_service, chave: str):
+    res = executar_com_controle(creds, drive_service.files().list(
+        q=f"appProperties has {{ key='{PROPRIEDADE_CHAVE_DSI}' and value='{chave}' }} and trashed = false",
+        spaces="drive",
+        pageSize=1,
+        fields=CAMPOS_ARQUIVOS_DSI,
+    ), "drive")
+    arquivos = res.get("files", [])
+    return arquivos[0]["id"] if arquivos else None
+
+def retomar_documento(creds, docs_service, doc_id: str, fins: list, aplicados: int, reconstruir: bool = False) -> int:
+    """Confere o documento com o modelo e devolve quantos requests já estão aplicados.
+
+    O corpo só cresce com as inserções, então o endIndex real mostra se o último
+    lote incerto chegou a ser aplicado (batchUpdate é atômico). Isso só vale para
+    uma exportação inacabada do mesmo conteúdo: com reconstruir (conteúdo alterado
+    ou documento achado sem checkpoint) ou sem correspondência, o corpo é
+    esvaziado e a montagem recomeça no mesmo documento.
+    """
+    doc      = executar_com_controle(creds, docs_service.documents().get(documentId=doc_id, fields=CAMPOS_DOC_FIM), "docs")
+    fim_real = doc['body']['content'][-1]['endIndex']
+    for k in ([] if reconstruir else range(aplicados, len(fins))):
+        if fins[k] == fim_real:
+            return k
+        if fins[k] > fim_real:
+            break
+    if fim_real > 2:
+        batch_update_com_retry(creds, docs_service, doc_id, [
+            {'deleteContentRange': {'range': {'startIndex': 1, 'endIndex': fim_real - 1}}}
+        ])
+    return 0
+
+# =========================================================
+# GOOGLE DOCS
+# =========================================================
+
+def montar_textos_dsi(num_fmt, hoje, ini_sm1, fim_sm1, ini_s, fim_s, ini_s1, fim_s1,
+                      si, fase, operacoes_linhas, bullets_cursos, bullets_datas, ativ_futuras_linhas,
+                      fg, su, ativ_nao_exec):
+    """Texto da DSI fora das tabelas: (linhas iniciais, cabeçalho S, cabeçalho S+1, linhas finais)."""
     conteudo = []
     conteudo.append(f"DSI Nº {num_fmt} - S3/24º BIS")
     conteudo.append(f"{hoje.day} {formatar_mes_abreviado(hoje)} {str(hoje.year)[-2:]}")
@@ -986,47 +2964,8 @@ def criar_google_doc(creds, titulo_doc, num_fmt, ref_date,
     conteudo.append(f" a. Semana (S-1) - {fmt_periodo_titulo(ini_sm1, fim_sm1)} - CONFIRMAR OU REAGENDAR")
     conteudo.append(" (Realizado - Realizado/Histórico - Reagendado)")
 
-    texto_completo = "\n".join(conteudo)
-
-    # --- Inserção do texto inicial ---
-    batch_update_com_retry(docs_service, doc_id, [
-        {'insertText': {'location': {'index': 1}, 'text': texto_completo}}
-    ])
-
-    # --- Tabela Semana S-1 ---
-    doc_atual = docs_service.documents().get(documentId=doc_id).execute()
-    end_index = doc_atual['body']['content'][-1]['endIndex']
-    inserir_e_preencher_tabela(docs_service, doc_id, rows_sm1, end_index - 1, semana_tipo="sm1")
-
-    # --- Cabeçalho Semana S ---
-    doc_atual = docs_service.documents().get(documentId=doc_id).execute()
-    end_index = doc_atual['body']['content'][-1]['endIndex']
-    texto_s   = f"\n b. Semana (S) - {fmt_periodo_titulo(ini_s, fim_s)} - EXECUTAR OU REAGENDAR\n"
-    batch_update_com_retry(docs_service, doc_id, [
-        {'insertText': {'location': {'index': end_index - 1}, 'text': texto_s}}
-    ])
-
-    # --- Tabela Semana S ---
-    doc_atual = docs_service.documents().get(documentId=doc_id).execute()
-    end_index = doc_atual['body']['content'][-1]['endIndex']
-    inserir_e_preencher_tabela(docs_service, doc_id, rows_s, end_index - 1, semana_tipo="s")
-
-    # --- Cabeçalho Semana S+1 ---
-    doc_atual = docs_service.documents().get(documentId=doc_id).execute()
-    end_index = doc_atual['body']['content'][-1]['endIndex']
-    texto_s1  = f"\n c. Semana (S+1) - {fmt_periodo_titulo(ini_s1, fim_s1)} - PLANEJAR\n"
-    batch_update_com_retry(docs_service, doc_id, [
-        {'insertText': {'location': {'index': end_index - 1}, 'text': texto_s1}}
-    ])
-
-    # --- Tabela Semana S+1 ---
-    doc_atual = docs_service.documents().get(documentId=doc_id).execute()
-    end_index = doc_atual['body']['content'][-1]['endIndex']
-    inserir_e_preencher_tabela(docs_service, doc_id, rows_s1, end_index - 1, semana_tipo="s1")
-
-    # --- Conteúdo final (seções 5–8 + assinatura) ---
-    doc_atual = docs_service.documents().get(documentId=doc_id).execute()
-    end_index = doc_atual['body']['content'][-1]['endIndex']
+    texto_s  = f"\n b. Semana (S) - {fmt_periodo_titulo(ini_s, fim_s)} - EXECUTAR OU REAGENDAR\n"
+    texto_s1 = f"\n c. Semana (S+1) - {fmt_periodo_titulo(ini_s1, fim_s1)} - PLANEJAR\n"
 
     conteudo_final = []
 
@@ -1068,357 +3007,306 @@ def criar_google_doc(creds, titulo_doc, num_fmt, ref_date,
     data_assinatura = f"São Luís, MA, {hoje.day} de {meses_completos[hoje.month-1]} de {hoje.year}"
     conteudo_final.append(f"{data_assinatura}\n\n\n\nJOÃO CARLOS DUQUE – Ten Cel\nComandante do 24º Batalhão de Infantaria de Selva\n")
 
-    batch_update_com_retry(docs_service, doc_id, [
-        {'insertText': {'location': {'index': end_index - 1}, 'text': "\n".join(conteudo_final)}}
-    ])
+    return conteudo, texto_s, texto_s1, conteudo_final
+
+# Rótulos das fases mostrados no progresso das tarefas de exportação
+ROTULOS_FASES = {
+    "criar":       "criando documento",
+    "texto":       "texto inicial",
+    "tabela_sm1":  "tabela S-1: preenchimento",
+    "texto_s":     "cabeçalho S",
+    "tabela_s":    "tabela S: preenchimento",
+    "texto_s1":    "cabeçalho S+1",
+    "tabela_s1":   "tabela S+1: preenchimento",
+    "texto_final": "seções finais",
+    "formatacao":  "formatação",
+    "estilo_sm1":  "tabela S-1: estilo",
+    "estilo_s":    "tabela S: estilo",
+    "estilo_s1":   "tabela S+1: estilo",
+    "mesclas":     "mesclas",
+    "docx":        "montando .docx",
+    "envio":       "enviando ao Drive",
+    "concluida":   "concluída",
+}
+
+def fases_documento_dsi(conteudo, texto_s, texto_s1, conteudo_final, rows_sm1, rows_s, rows_s1,
+                        bullets_cursos, ativ_futuras_linhas) -> list:
+    """[(fase, requests)] que montam a DSI num documento vazio, na ordem de envio."""
+    # --- Fases: inserções (texto inicial, S-1, cabeçalho S, S, cabeçalho S+1, S+1, seções 5–8) ---
+    modelo = ModeloDocumento()
+    fases  = [
+        ("texto",       modelo.inserir_texto("\n".join(conteudo))),
+        ("tabela_sm1",  inserir_e_preencher_tabela(modelo, rows_sm1, semana_tipo="sm1")),
+        ("texto_s",     modelo.inserir_texto(texto_s)),
+        ("tabela_s",    inserir_e_preencher_tabela(modelo, rows_s, semana_tipo="s")),
+        ("texto_s1",    modelo.inserir_texto(texto_s1)),
+        ("tabela_s1",   inserir_e_preencher_tabela(modelo, rows_s1, semana_tipo="s1")),
+        ("texto_final", modelo.inserir_texto("\n".join(conteudo_final))),
+    ]
+
+    # --- Formatação global e das tabelas, com os índices finais do modelo ---
+    corpo   = modelo.conteudo()
+    fases.append(("formatacao", formatar_documento_completo(corpo, rows_sm1, rows_s, rows_s1, bullets_cursos=bullets_cursos, ativ_futuras_linhas=ativ_futuras_linhas)))
+    mesclas = []
+    tabelas = [el for el in corpo if 'table' in el]
+    for tabela_element, rows, semana_tipo in zip(tabelas, (rows_sm1, rows_s, rows_s1), ("sm1", "s", "s1")):
+        estilos_tabela, mesclas_tabela = aplicar_formatacao_tabela(tabela_element, rows, semana_tipo=semana_tipo)
+        fases.append((f"estilo_{semana_tipo}", estilos_tabela))
+        mesclas = mesclas_tabela + mesclas
+    # Mesclas por último e da última tabela para a primeira: juntar o conteúdo
+    # das células desloca tudo o que vem depois, mas não o início das tabelas acima
+    fases.append(("mesclas", mesclas))
+    return fases
+
+def criar_google_doc(creds, titulo_doc, num_fmt, ref_date,
+                     ini_sm1, fim_sm1, ini_s, fim_s, ini_s1, fim_s1,
+                     si, fase, operacoes_linhas, bullets_cursos, bullets_datas,
+                     rows_sm1, rows_s, rows_s1, ativ_futuras_linhas,
+                     fg=None, su="", ativ_nao_exec="", exportacao=None):
+    if fg is None:
+        fg = {"finalidade": "", "dia": "", "dobrado": "", "cancao": "", "gs": "", "armado": ""}
+    if exportacao is None:
+        exportacao = ExportacaoRetomavel()
+
+    with etapa("textos"):
+        conteudo, texto_s, texto_s1, conteudo_final = montar_textos_dsi(
+            num_fmt, exportacao.hoje, ini_sm1, fim_sm1, ini_s, fim_s, ini_s1, fim_s1,
+            si, fase, operacoes_linhas, bullets_cursos, bullets_datas, ativ_futuras_linhas,
+            fg, su, ativ_nao_exec,
+        )
 
-    # --- Formatação global ---
-    time.sleep(3)
-    formatar_documento_completo(docs_service, doc_id, rows_sm1, rows_s, rows_s1, bullets_cursos=bullets_cursos, ativ_futuras_linhas=ativ_futuras_linhas)
+    with etapa("requests"):
+        fases = fases_documento_dsi(conteudo, texto_s, texto_s1, conteudo_final, rows_sm1, rows_s, rows_s1,
+                                    bullets_cursos, ativ_futuras_linhas)
+
+    requests = [r for _, reqs in fases for r in reqs]
+    fins     = fins_apos_requests(requests)
+    limites  = []
+    for nome, reqs in fases:
+        limites.append((nome, (limites[-1][1] if limites else 0) + len(reqs)))
+
+    def fase_de(aplicados):
+        return next((nome for nome, limite in limites if aplicados < limite), "concluida")
+
+    def relatar_progresso(aplicados):
+        fase_atual = fase_de(aplicados)
+        inicio = 0
+        for nome, limite in limites:
+            if nome == fase_atual:
+                exportacao.relatar(ROTULOS_FASES[nome], aplicados - inicio, limite - inicio)
+                return
+            inicio = limite
+        exportacao.relatar(ROTULOS_FASES["concluida"])
+
+    planejar_envio(creds, exportacao, [(nome, len(reqs)) for nome, reqs in fases], modo="docs_api")
+
+    # --- Documento: o do checkpoint (conferido com o modelo) ou um novo, marcado com a chave ---
+    exportacao.relatar(ROTULOS_FASES["criar"])
+    with etapa("documento"):
+        docs_service  = servico_google(creds, 'docs', 'v1')
+        drive_service = servico_google(creds, 'drive', 'v3')
+        doc_id = exportacao.obter_documento(creds, drive_service)
+        if doc_id:
+            aplicados = retomar_documento(creds, docs_service, doc_id, fins, exportacao.estado["aplicados"],
+                                          reconstruir=exportacao.reconstruir)
+        else:
+            doc_id = executar_com_controle(creds, drive_service.files().create(
+                body={'name': titulo_doc, 'mimeType': MIME_GOOGLE_DOCS, 'appProperties': exportacao.propriedades()},
+                fields=CAMPOS_ARQUIVO_CRIADO,
+            ), "drive", idempotente=False)['id']
+            aplicados = 0
+    exportacao.marcar(doc_id=doc_id, aplicados=aplicados, fase=fase_de(aplicados))
+    relatar_progresso(aplicados)
+
+    def registrar_lote(n):
+        total = exportacao.estado["aplicados"] + n
+        exportacao.marcar(aplicados=total, fase=fase_de(total))
+        relatar_progresso(total)
+
+    t_envio = time.perf_counter()
+    with etapa("envio"):
+        batch_update_com_retry(creds, docs_service, doc_id, requests[aplicados:], tamanho_lote=TAMANHO_LOTE_DOCS, ao_aplicar=registrar_lote)
+    exportacao.marcar(concluida=True)
+    lotes = -(-(len(requests) - aplicados) // TAMANHO_LOTE_DOCS)
+    registrar_log("DOCS_ENVIADO", f"{titulo_doc}: {len(requests) - aplicados} de {len(requests)} requests "
+                                  f"em {lotes} lote(s), {time.perf_counter() - t_envio:.1f}s")
     return doc_id
 
 # =========================================================
 # GOOGLE DOCS – TABELA
 # =========================================================
 
-def inserir_e_preencher_tabela(docs_service, doc_id, rows, insert_index, semana_tipo="s"):
-    num_cols = 6 if semana_tipo == "sm1" else 7
-    batch_update_com_retry(docs_service, doc_id, [
-        {'insertTable': {'rows': len(rows) + 1, 'columns': num_cols, 'location': {'index': insert_index}}}
-    ])
-    time.sleep(2)
-
-    def get_ultima_tabela():
-        doc     = docs_service.documents().get(documentId=doc_id).execute()
-        content = doc['body']['content']
-        for element in reversed(content):
-            if 'table' in element:
-                return element['table']
-        return None
-
-    tabela = get_ultima_tabela()
-    if not tabela:
-        return
-
-    if semana_tipo == "sm1":
-        larguras_pt = [80, 38, 190, 120, 35, 65]   # 6 cols: DATA HORA ATIV LOCAL AG STATUS
-    else:
-        larguras_pt = [95, 38, 185, 125, 28, 28, 28]   # 7 cols
-
-    doc_temp = docs_service.documents().get(documentId=doc_id).execute()
-    for el in reversed(doc_temp['body']['content']):
-        if 'table' in el:
-            tbl_start = el['startIndex']
-            col_reqs  = [
-                {'updateTableColumnProperties': {
-                    'tableStartLocation': {'index': tbl_start},
-                    'columnIndices': [ci],
-                    'tableColumnProperties': {'widthType': 'FIXED_WIDTH', 'width': {'magnitude': larg, 'unit': 'PT'}},
-                    'fields': 'widthType,width'
-                }} for ci, larg in enumerate(larguras_pt)
-            ]
-            try:
-                batch_update_com_retry(docs_service, doc_id, col_reqs)
-            except Exception as e:
-                print(f"Erro larguras: {e}")
-            break
-
-    grupos_data = {}
-    data_atual  = None
-    for idx, row_data in enumerate(rows):
-        data = row_data.get("DATA", "")
-        if data:
-            data_atual = data
-            grupos_data[data_atual] = []
-        if data_atual:
-            grupos_data[data_atual].append(idx)
-
-    all_requests = []
-    if semana_tipo == "sm1":
-        cols    = ["DATA", "HORA", "ATIV_DESC", "LOCAL", "AGENDA", "STATUS"]
-        headers = ["DATA", "HORA", "ATIVIDADE", "LOCAL", "AG",     "STATUS"]
-    else:
-        cols    = ["DATA", "HORA", "ATIV_DESC", "LOCAL", "UNIF", "AGENDA", "OBS"]
-        headers = ["DATA", "HORA", "ATIVIDADE", "LOCAL", "UNIF", "AG",     "OBS"]
-    n_cols = len(cols)
-
-    for row_idx in range(len(rows) - 1, -1, -1):
-        if row_idx + 1 >= len(tabela['tableRows']):
-            continue
-        linha_tabela = tabela['tableRows'][row_idx + 1]
-        row_data     = rows[row_idx]
-        for col_idx in range(n_cols - 1, -1, -1):
-            if col_idx < len(linha_tabela['tableCells']):
-                celula       = linha_tabela['tableCells'][col_idx]
-                cell_content = celula.get('content')
-                if cell_content:
-                    start_idx = cell_content[0].get('startIndex')
-                    if start_idx is not None:
-                        valor = row_data.get(cols[col_idx], "")
-                        texto = "" if (pd.isna(valor) if isinstance(valor, float) else (valor is None or str(valor).strip() == '')) else str(valor).strip()
-                        if texto:
-                            # STATUS: inserir só a primeira linha aqui;
-                            # as outras linhas são inseridas depois via parágrafos
-                            if cols[col_idx] == "STATUS":
-                                primeira = texto.split("\n")[0]
-                                all_requests.append({'insertText': {'location': {'index': start_idx}, 'text': primeira}})
-                            else:
-                                all_requests.append({'insertText': {'location': {'index': start_idx}, 'text': texto}})
-
-    primeira_linha = tabela['tableRows'][0]
-    for i in range(n_cols - 1, -1, -1):
-        if i < len(primeira_linha['tableCells']):
-            cell_content = primeira_linha['tableCells'][i].get('content')
-            if cell_content:
-                start_idx = cell_content[0].get('startIndex')
-                if start_idx is not None:
-                    all_requests.append({'insertText': {'location': {'index': start_idx}, 'text': headers[i]}})
-
-    if all_requests:
-        try:
-            batch_update_com_retry(docs_service, doc_id, all_requests)
-        except Exception as e:
-            print(f"Erro preencher tabela: {e}")
-
-    # --- Inserir linhas 2 e 3 do STATUS como parágrafos separados ---
-    if semana_tipo == "sm1":
-        time.sleep(1)
-        doc_status = docs_service.documents().get(documentId=doc_id).execute()
-        tabela_st  = None
-        for el in reversed(doc_status['body']['content']):
-            if 'table' in el:
-                tabela_st = el['table']
-                break
-        if tabela_st:
-            col_status_idx = cols.index("STATUS")
-            reqs_status = []
-            # Percorre de trás para frente para não deslocar índices
-            for row_idx in range(len(rows) - 1, -1, -1):
-                if row_idx + 1 >= len(tabela_st['tableRows']):
-                    continue
-                tbl_row = tabela_st['tableRows'][row_idx + 1]
-                if col_status_idx >= len(tbl_row['tableCells']):
-                    continue
-                cell_st  = tbl_row['tableCells'][col_status_idx]
-                cnt_st   = cell_st.get('content', [])
-                if not cnt_st:
-                    continue
-                # endIndex do último parágrafo da célula = onde inserir
-                insert_at = cnt_st[-1].get('endIndex', 0) - 1
-                if insert_at <= 0:
-                    continue
-                # Inserir "\n☐ Reagendado\n☐ Histórico" de trás pra frente
-                # Ordem reversa: primeiro Reagendado, depois Histórico antes do final da célula
-                reqs_status.append({'insertText': {
-                    'location': {'index': insert_at},
-                    'text': "\nReagendado\nHistórico"
-                }})
-            if reqs_status:
-                batch_update_com_retry(docs_service, doc_id, reqs_status)
-
-    time.sleep(0.5)
-    aplicar_formatacao_tabela(docs_service, doc_id, rows, grupos_data, semana_tipo=semana_tipo)
-
+# Borda preta, conteúdo ao meio e padding em todas as células das tabelas
+BORDA_TABELA = {'color': {'color': {'rgbColor': COR_PRETO}}, 'width': {'magnitude': 1, 'unit': 'PT'}, 'dashStyle': 'SOLID'}
+ESTILO_CELULA_BASE = {
+    'borderTop': BORDA_TABELA, 'borderBottom': BORDA_TABELA, 'borderLeft': BORDA_TABELA, 'borderRight': BORDA_TABELA,
+    'contentAlignment': 'MIDDLE',
+    'paddingTop':  {'magnitude': 2, 'unit': 'PT'}, 'paddingBottom': {'magnitude': 2, 'unit': 'PT'},
+    'paddingLeft': {'magnitude': 3, 'unit': 'PT'}, 'paddingRight':  {'magnitude': 3, 'unit': 'PT'},
+}
 
-def aplicar_formatacao_tabela(docs_service, doc_id, rows, grupos_data, semana_tipo="s"):
-    doc     = docs_service.documents().get(documentId=doc_id).execute()
-    content = doc['body']['content']
+def coalescer_estilos_celulas(table_start, estilos: dict) -> list:
+    """Um updateTableCellStyle por retângulo de células com o mesmo estilo.
+
+    `estilos` mapeia (linha, coluna) → tableCellStyle. Cada linha é dividida em
+    trechos de colunas contíguas com estilo idêntico, e o mesmo trecho em linhas
+    consecutivas é estendido com rowSpan; todos os campos do estilo vão juntos.
+    """
+    por_linha = {}
+    for (r, c), estilo in estilos.items():
+        por_linha.setdefault(r, {})[c] = estilo
+
+    abertos, retangulos = {}, []
+    for r in sorted(por_linha):
+        trechos = []
+        for c in sorted(por_linha[r]):
+            chave = json.dumps(por_linha[r][c], sort_keys=True)
+            if trechos and trechos[-1]['c1'] == c - 1 and trechos[-1]['chave'] == chave:
+                trechos[-1]['c1'] = c
+            else:
+                trechos.append({'c0': c, 'c1': c, 'chave': chave, 'estilo': por_linha[r][c]})
+        continuam = {}
+        for t in trechos:
+            ident = (t['c0'], t['c1'], t['chave'])
+            ret   = abertos.pop(ident, None)
+            if ret is not None and ret['r1'] == r - 1:
+                ret['r1'] = r
+            else:
+                if ret is not None:
+                    retangulos.append(ret)
+                ret = dict(t, r0=r, r1=r)
+            continuam[ident] = ret
+        retangulos.extend(abertos.values())
+        abertos = continuam
+    retangulos.extend(abertos.values())
+
+    return [{'updateTableCellStyle': {
+        'tableRange': {
+            'tableCellLocation': {'tableStartLocation': {'index': table_start}, 'rowIndex': ret['r0'], 'columnIndex': ret['c0']},
+            'rowSpan': ret['r1'] - ret['r0'] + 1, 'columnSpan': ret['c1'] - ret['c0'] + 1,
+        },
+        'tableCellStyle': ret['estilo'],
+        'fields': ','.join(ret['estilo']),
+    }} for ret in sorted(retangulos, key=lambda x: (x['r0'], x['c0']))]
+
+def inserir_e_preencher_tabela(modelo, rows, semana_tipo="s"):
+    """Requests que inserem no fim do documento a tabela já preenchida, com as larguras das colunas."""
+    cols, headers, larguras_pt = colunas_tabela(semana_tipo)
+    celulas = [headers] + [[texto_celula(row_data.get(col, "")) for col in cols] for row_data in rows]
+
+    tbl_start, requests = modelo.inserir_tabela(celulas)
+    requests += [
+        {'updateTableColumnProperties': {
+            'tableStartLocation': {'index': tbl_start},
+            'columnIndices': [ci],
+            'tableColumnProperties': {'widthType': 'FIXED_WIDTH', 'width': {'magnitude': larg, 'unit': 'PT'}},
+            'fields': 'widthType,width'
+        }} for ci, larg in enumerate(larguras_pt)
+    ]
+    return requests
 
-    tabela_element = None
-    for element in reversed(content):
-        if 'table' in element:
-            tabela_element = element
-            break
-    if not tabela_element:
-        return
 
+def aplicar_formatacao_tabela(tabela_element, rows, semana_tipo="s"):
+    """(requests de estilo, requests de mescla) de uma tabela já posicionada pelo modelo."""
     tabela      = tabela_element['table']
     table_start = tabela_element['startIndex']
+    grupos_data = agrupar_linhas_por_data(rows)
     requests    = []
+    mesclas     = []
 
     n_cols_tab = 6 if semana_tipo == "sm1" else 7
-    for row_idx in range(len(tabela.get('tableRows', []))):
+    n_linhas   = len(tabela.get('tableRows', []))
+
+    # Borda, alinhamento, padding e fundo de cada célula; o otimizador junta
+    # células vizinhas de estilo idêntico num só updateTableCellStyle
+    cores   = cores_fundo_linhas(rows, grupos_data)
+    estilos = {}
+    for row_idx in range(n_linhas):
+        cor = COR_CINZA_HEADER if row_idx == 0 else cores.get(row_idx - 1)
         for col_idx in range(n_cols_tab):
-            borda = {'color': {'color': {'rgbColor': {'red': 0, 'green': 0, 'blue': 0}}}, 'width': {'magnitude': 1, 'unit': 'PT'}, 'dashStyle': 'SOLID'}
-            requests.append({'updateTableCellStyle': {
-                'tableRange': {'tableCellLocation': {'tableStartLocation': {'index': table_start}, 'rowIndex': row_idx, 'columnIndex': col_idx}, 'rowSpan': 1, 'columnSpan': 1},
-                'tableCellStyle': {'borderTop': borda, 'borderBottom': borda, 'borderLeft': borda, 'borderRight': borda},
-                'fields': 'borderTop,borderBottom,borderLeft,borderRight'
-            }})
-
-    for col_idx in range(n_cols_tab):
-        requests.append({'updateTableCellStyle': {
-            'tableRange': {'tableCellLocation': {'tableStartLocation': {'index': table_start}, 'rowIndex': 0, 'columnIndex': col_idx}, 'rowSpan': 1, 'columnSpan': 1},
-            'tableCellStyle': {'backgroundColor': {'color': {'rgbColor': {'red': 0.4, 'green': 0.4, 'blue': 0.4}}}},
-            'fields': 'backgroundColor'
-        }})
+            estilo = dict(ESTILO_CELULA_BASE)
+            if cor:
+                estilo['backgroundColor'] = {'color': {'rgbColor': cor}}
+            estilos[(row_idx, col_idx)] = estilo
+    requests += coalescer_estilos_celulas(table_start, estilos)
 
     for data, indices in grupos_data.items():
         if len(indices) > 1:
-            requests.append({'mergeTableCells': {
+            mesclas.append({'mergeTableCells': {
                 'tableRange': {'tableCellLocation': {'tableStartLocation': {'index': table_start}, 'rowIndex': indices[0] + 1, 'columnIndex': 0}, 'rowSpan': len(indices), 'columnSpan': 1}
             }})
 
-    cor_alternada = True
-    for data, indices in grupos_data.items():
-        eh_dia_especial = any(rows[idx].get('_especial', False) for idx in indices)
-        if eh_dia_especial:
-            cor = {'red': 1.0, 'green': 0.8, 'blue': 0.8}
-        else:
-            cor = {'red': 0.85, 'green': 0.85, 'blue': 0.85} if cor_alternada else {'red': 1.0, 'green': 1.0, 'blue': 1.0}
-        for idx in indices:
-            for col_idx in range(n_cols_tab):
-                requests.append({'updateTableCellStyle': {
-                    'tableRange': {'tableCellLocation': {'tableStartLocation': {'index': table_start}, 'rowIndex': idx + 1, 'columnIndex': col_idx}, 'rowSpan': 1, 'columnSpan': 1},
-                    'tableCellStyle': {'backgroundColor': {'color': {'rgbColor': cor}}},
-                    'fields': 'backgroundColor'
+    # Centralizar os parágrafos com texto de cada célula (um range por célula)
+    for row in tabela['tableRows']:
+        for cell in row.get('tableCells', []):
+            com_texto = [p for p in cell.get('content', [])
+                         if p.get('startIndex') is not None and p.get('endIndex') is not None
+                         and p['endIndex'] > p['startIndex'] + 1]
+            if com_texto:
+                requests.append({'updateParagraphStyle': {
+                    'paragraphStyle': {'alignment': 'CENTER'},
+                    'fields': 'alignment',
+                    'range': {'startIndex': com_texto[0]['startIndex'], 'endIndex': com_texto[-1]['endIndex'] - 1}
                 }})
-        if not eh_dia_especial:
-            cor_alternada = not cor_alternada
-
-    # Aplicar contentAlignment MIDDLE + padding via tableRange (não depende de startIndex)
-    for row_idx in range(len(tabela.get('tableRows', []))):
-        for col_idx in range(n_cols_tab):
-            requests.append({'updateTableCellStyle': {
-                'tableRange': {'tableCellLocation': {'tableStartLocation': {'index': table_start}, 'rowIndex': row_idx, 'columnIndex': col_idx}, 'rowSpan': 1, 'columnSpan': 1},
-                'tableCellStyle': {'contentAlignment': 'MIDDLE', 'paddingTop': {'magnitude': 2, 'unit': 'PT'}, 'paddingBottom': {'magnitude': 2, 'unit': 'PT'}, 'paddingLeft': {'magnitude': 3, 'unit': 'PT'}, 'paddingRight': {'magnitude': 3, 'unit': 'PT'}},
-                'fields': 'contentAlignment,paddingTop,paddingBottom,paddingLeft,paddingRight'
-            }})
 
-    if requests:
-        batch_update_com_retry(docs_service, doc_id, requests)
-
-    # Recarregar doc DEPOIS de inserir o texto para ter startIndex corretos
-    time.sleep(1)
-    doc_recarregado = docs_service.documents().get(documentId=doc_id).execute()
-    tabela_atualizada = None
-    for el in reversed(doc_recarregado['body']['content']):
-        if 'table' in el:
-            tabela_atualizada = el
-            break
-    if tabela_atualizada:
-        reqs_center = []
-        for row in tabela_atualizada['table']['tableRows']:
-            for cell in row.get('tableCells', []):
-                for para in cell.get('content', []):
-                    p_s = para.get('startIndex')
-                    p_e = para.get('endIndex')
-                    if p_s is not None and p_e is not None and p_e > p_s + 1:
-                        reqs_center.append({'updateParagraphStyle': {
-                            'paragraphStyle': {'alignment': 'CENTER'},
-                            'fields': 'alignment',
-                            'range': {'startIndex': p_s, 'endIndex': p_e - 1}
-                        }})
-        if reqs_center:
-            batch_update_com_retry(docs_service, doc_id, reqs_center)
-
-    time.sleep(0.5)
-    doc = docs_service.documents().get(documentId=doc_id).execute()
-    tabela_element = None
-    for element in reversed(doc['body']['content']):
-        if 'table' in element:
-            tabela_element = element
-            break
-    if tabela_element:
-        tabela         = tabela_element['table']
-        primeira_linha = tabela['tableRows'][0]
-        reqs_negrito   = []
-        for col_idx in range(n_cols_tab):
-            if col_idx < len(primeira_linha['tableCells']):
-                cell_content = primeira_linha['tableCells'][col_idx].get('content', [])
-                if cell_content:
-                    s = cell_content[0].get('startIndex')
-                    e = cell_content[0].get('endIndex')
-                    if s and e and e > s:
-                        reqs_negrito.append({'updateTextStyle': {
-                            'range': {'startIndex': s, 'endIndex': e - 1},
-                            'textStyle': {'bold': True, 'foregroundColor': {'color': {'rgbColor': {'red': 1.0, 'green': 1.0, 'blue': 1.0}}}},
-                            'fields': 'bold,foregroundColor'
-                        }})
-        if reqs_negrito:
-            try:
-                batch_update_com_retry(docs_service, doc_id, reqs_negrito)
-            except Exception as e:
-                print(f"Erro negrito: {e}")
+    # Cabeçalho em negrito branco
+    primeira_linha = tabela['tableRows'][0]
+    for col_idx in range(n_cols_tab):
+        if col_idx < len(primeira_linha['tableCells']):
+            cell_content = primeira_linha['tableCells'][col_idx].get('content', [])
+            if cell_content:
+                s = cell_content[0].get('startIndex')
+                e = cell_content[0].get('endIndex')
+                if s and e and e > s:
+                    requests.append({'updateTextStyle': {
+                        'range': {'startIndex': s, 'endIndex': e - 1},
+                        'textStyle': {'bold': True, 'foregroundColor': {'color': {'rgbColor': COR_BRANCO}}},
+                        'fields': 'bold,foregroundColor'
+                    }})
 
     # --- Colorir description (em azul) nas células de ATIVIDADE ---
     # e colorir STATUS nas células correspondentes
-    try:
-        doc_refresco = docs_service.documents().get(documentId=doc_id).execute()
-        tabela_el2   = None
-        for el in reversed(doc_refresco['body']['content']):
-            if 'table' in el:
-                tabela_el2 = el
-                break
-        if tabela_el2:
-            tabela2     = tabela_el2['table']
-            tbl_start2  = tabela_el2['startIndex']
-            col_ativ    = 2  # coluna ATIVIDADE (índice 2)
-            col_status  = 5  # coluna STATUS (índice 5 em sm1 sem UNIF)
-            reqs_cor    = []
-            azul        = {'red': 0.07, 'green': 0.36, 'blue': 0.68}
-            CORES_STATUS = {
-                'Realizado':           {'red': 0.0,  'green': 0.39, 'blue': 0.0},
-                'Realizado/Histórico': {'red': 0.0,  'green': 0.55, 'blue': 0.27},
-                'Reagendado':          {'red': 0.85, 'green': 0.33, 'blue': 0.1},
-            }
-            for row_idx_t, (tbl_row, row_data) in enumerate(
-                    zip(tabela2['tableRows'][1:], rows), 1):
-                # Colorir description (2º parágrafo da célula ATIVIDADE) em azul negrito
-                if row_data.get('_tem_desc') and col_ativ < len(tbl_row['tableCells']):
-                    cell  = tbl_row['tableCells'][col_ativ]
-                    cnt   = cell.get('content', [])
-                    # barra-n cria 2 parágrafos na célula: [0]=atividade, [1]=(description)
-                    if len(cnt) >= 2:
-                        para_desc = cnt[1]
-                        d_start   = para_desc.get('startIndex')
-                        d_end     = para_desc.get('endIndex')
-                        if d_start is not None and d_end is not None and d_end > d_start + 1:
-                            reqs_cor.append({'updateTextStyle': {
-                                'range': {'startIndex': d_start, 'endIndex': d_end - 1},
-                                'textStyle': {
-                                    'foregroundColor': {'color': {'rgbColor': azul}},
-                                    'bold': True,
-                                },
-                                'fields': 'foregroundColor,bold'
-                            }})
-                # Colorir STATUS (3 parágrafos) apenas para tabela sm1
-                # Ordem de inserção foi: ☐ Realizado / ☐ Histórico / ☐ Reagendado
-                if semana_tipo == "sm1" and col_status < len(tbl_row['tableCells']):
-                    cell_s = tbl_row['tableCells'][col_status]
-                    cnt_s  = cell_s.get('content', [])
-                    COR_STATUS_LINES = [
-                        # (cor_rgb, strikethrough)
-                        ({'red': 0.07, 'green': 0.36, 'blue': 0.68}, False),  # ☐ Realizado — azul
-                        ({'red': 0.0,  'green': 0.50, 'blue': 0.13}, False),  # ☐ Histórico — verde
-                        ({'red': 0.78, 'green': 0.08, 'blue': 0.08}, False),  # ☐ Reagendado — vermelho
-                    ]
-                    for par_idx, paragrafo in enumerate(cnt_s):
-                        if par_idx >= len(COR_STATUS_LINES):
-                            break
-                        p_start = paragrafo.get('startIndex')
-                        p_end   = paragrafo.get('endIndex')
-                        if p_start is None or p_end is None or p_end <= p_start + 1:
-                            continue
-                        cor_linha, strike = COR_STATUS_LINES[par_idx]
-                        reqs_cor.append({'updateTextStyle': {
-                            'range': {'startIndex': p_start, 'endIndex': p_end - 1},
-                            'textStyle': {
-                                'foregroundColor': {'color': {'rgbColor': cor_linha}},
-                                'fontSize': {'magnitude': 10, 'unit': 'PT'},
-                                'strikethrough': strike,
-                            },
-                            'fields': 'foregroundColor,fontSize,strikethrough'
-                        }})
-            if reqs_cor:
-                batch_update_com_retry(docs_service, doc_id, reqs_cor)
-    except Exception as e:
-        print(f"Erro coloração description/status: {e}")
+    col_ativ   = 2  # coluna ATIVIDADE (índice 2)
+    col_status = 5  # coluna STATUS (índice 5 em sm1 sem UNIF)
+    for tbl_row, row_data in zip(tabela['tableRows'][1:], rows):
+        # Colorir description (2º parágrafo da célula ATIVIDADE) em azul negrito
+        if row_data.get('_tem_desc') and col_ativ < len(tbl_row['tableCells']):
+            cnt = tbl_row['tableCells'][col_ativ].get('content', [])
+            # barra-n cria 2 parágrafos na célula: [0]=atividade, [1]=(description)
+            if len(cnt) >= 2:
+                d_start = cnt[1].get('startIndex')
+                d_end   = cnt[1].get('endIndex')
+                if d_start is not None and d_end is not None and d_end > d_start + 1:
+                    requests.append({'updateTextStyle': {
+                        'range': {'startIndex': d_start, 'endIndex': d_end - 1},
+                        'textStyle': {
+                            'foregroundColor': {'color': {'rgbColor': COR_AZUL}},
+                            'bold': True,
+                        },
+                        'fields': 'foregroundColor,bold'
+                    }})
+        # Colorir STATUS (3 parágrafos) apenas para tabela sm1
+        if semana_tipo == "sm1" and col_status < len(tbl_row['tableCells']):
+            cnt_s = tbl_row['tableCells'][col_status].get('content', [])
+            for paragrafo, cor_linha in zip(cnt_s, CORES_LINHAS_STATUS):
+                p_start = paragrafo.get('startIndex')
+                p_end   = paragrafo.get('endIndex')
+                if p_start is None or p_end is None or p_end <= p_start + 1:
+                    continue
+                requests.append({'updateTextStyle': {
+                    'range': {'startIndex': p_start, 'endIndex': p_end - 1},
+                    'textStyle': {
+                        'foregroundColor': {'color': {'rgbColor': cor_linha}},
+                        'fontSize': {'magnitude': 10, 'unit': 'PT'},
+                        'strikethrough': False,
+                    },
+                    'fields': 'foregroundColor,fontSize,strikethrough'
+                }})
 
+    return requests, mesclas
 
-def formatar_documento_completo(docs_service, doc_id, rows_sm1, rows_s, rows_s1, bullets_cursos=None, ativ_futuras_linhas=None):
-    doc       = docs_service.documents().get(documentId=doc_id).execute()
-    content   = doc['body']['content']
+def formatar_documento_completo(content, rows_sm1, rows_s, rows_s1, bullets_cursos=None, ativ_futuras_linhas=None):
+    """Requests de formatação do corpo (fonte, margens, títulos, seções, cores) a partir de body.content."""
     end_index = content[-1]['endIndex']
     requests  = []
 
@@ -1438,33 +3326,19 @@ def formatar_documento_completo(docs_service, doc_id, rows_sm1, rows_s, rows_s1,
         'fields': 'marginTop,marginBottom,marginLeft,marginRight'
     }})
 
-    if requests:
-        batch_update_com_retry(docs_service, doc_id, requests)
-        requests = []
-
     # --- Título DSI: caixa cinza com borda + negrito ---
     # --- QTS: centralizado e negrito ---
-    titulo_pattern   = re.compile(r'DIRETRIZ SEMANAL DE INSTRUÇÃO \d+', re.IGNORECASE)
-    cabecalho_pattern = re.compile(
-        r'MINISTÉRIO DA DEFESA|EXÉRCITO BRASILEIRO|BATALHÃO DE INFANTARIA|'
-        r'Batalhão de Caçadores|BATALHÃO BARÃO DE CAXIAS',
-        re.IGNORECASE
-    )
-    # Pattern para as linhas do cabeçalho superior (DSI Nº, data, Visto S3, traço, Cap PIERROTI)
-    cabecalho_dsi_pattern = re.compile(
-        r'^DSI Nº|^Visto S3|^Cap PIERROTI|^_+$',
-        re.IGNORECASE
-    )
-    data_dsi_pattern = re.compile(r'^\d{1,2} [A-Z]{3} \d{2}$')
-    qts_pattern    = re.compile(r'\(QTS nº', re.IGNORECASE)
-    conf_pattern   = re.compile(r'CONFIRMAR OU REAGENDAR|EXECUTAR OU REAGENDAR|PLANEJAR', re.IGNORECASE)
-    cinza_claro    = {'red': 0.85, 'green': 0.85, 'blue': 0.85}
-    laranja        = {'red': 0.85, 'green': 0.33, 'blue': 0.1}
-
-    doc2    = docs_service.documents().get(documentId=doc_id).execute()
-    cont2   = doc2['body']['content']
+    titulo_pattern        = PADRAO_TITULO_DSI
+    cabecalho_pattern     = PADRAO_CABECALHO_BTL
+    cabecalho_dsi_pattern = PADRAO_CABECALHO_DSI
+    data_dsi_pattern      = PADRAO_DATA_DSI
+    qts_pattern           = PADRAO_QTS
+    conf_pattern          = PADRAO_CONFIRMACAO
+    cinza_claro           = COR_CINZA_CLARO
+    laranja               = COR_LARANJA
+
     reqs2   = []
-    for element in cont2:
+    for element in content:
         if 'paragraph' not in element:
             continue
         para      = element['paragraph']
@@ -1521,7 +3395,7 @@ def formatar_documento_completo(docs_service, doc_id, rows_sm1, rows_s, rows_s1,
 
         elif qts_pattern.search(full_text):
             # Centralizar + negrito + azul
-            azul_qts = {'red': 0.07, 'green': 0.36, 'blue': 0.68}
+            azul_qts = COR_AZUL
             reqs2.append({'updateParagraphStyle': {
                 'range': {'startIndex': p_start, 'endIndex': p_end},
                 'paragraphStyle': {'alignment': 'CENTER'},
@@ -1544,19 +3418,10 @@ def formatar_documento_completo(docs_service, doc_id, rows_sm1, rows_s, rows_s1,
                 'fields': 'foregroundColor,bold'
             }})
 
-    if reqs2:
-        batch_update_com_retry(docs_service, doc_id, reqs2)
-        requests = []  # reset para evitar duplicação
-
-    padroes_negrito = [
-        r"1\.\s+OPERA[ÇC][ÕO]ES[:\s]?",
-        r"2\.\s+CURSOS E EST[ÁA]GIOS",
-        r"3\.\s+DATAS COMEMORATIVAS",
-        r"4\.\s+INSTRU[ÇC][ÃA]O",
-        r"5\.\s+FORMATURA GERAL",
-        r"6\.\s+ATIVIDADES FUTURAS",
+    requests += reqs2
+    reqs_negrito = []
 
-    ]
+    padroes_negrito = PADROES_SECOES_NEGRITO
 
     for element in content:
         if 'paragraph' not in element:
@@ -1575,33 +3440,27 @@ def formatar_documento_completo(docs_service, doc_id, rows_sm1, rows_s, rows_s1,
                 if re.search(padrao, texto_run, re.IGNORECASE):
                     safe_end = min(run_end, end_index - 1)
                     if safe_end > run_start:
-                        requests.append({'updateTextStyle': {
+                        reqs_negrito.append({'updateTextStyle': {
                             'range': {'startIndex': run_start, 'endIndex': safe_end},
                             'textStyle': {'bold': True},
                             'fields': 'bold'
                         }})
                     break
 
-    if requests:
-        batch_update_com_retry(docs_service, doc_id, requests)
+    requests += reqs_negrito
 
     # --- Colorir cursos (após primeiro " - ") e atividades futuras (após " - ") em azul ---
-    azul_rgb = {'red': 0.07, 'green': 0.36, 'blue': 0.68}
+    azul_rgb = COR_AZUL
 
     # Colorir texto após " - " nos itens das seções 2 (Cursos) e 6 (Ativ Futuras)
     # Abordagem: varrer doc por seção, sem depender de matching por texto
-    SEC_CURSOS  = re.compile(r'^2\.\s+CURSOS', re.IGNORECASE)
-    SEC_DATAS   = re.compile(r'^3\.\s+DATAS', re.IGNORECASE)
-    SEC_FUTURAS = re.compile(r'^6\.\s+ATIVIDADES FUTURAS', re.IGNORECASE)
 
-    doc3  = docs_service.documents().get(documentId=doc_id).execute()
-    cont3 = doc3['body']['content']
     reqs3 = []
 
     dentro_cursos  = False
     dentro_futuras = False
 
-    for element in cont3:
+    for element in content:
         if 'paragraph' not in element:
             dentro_cursos  = False
             dentro_futuras = False
@@ -1647,32 +3506,738 @@ def formatar_documento_completo(docs_service, doc_id, rows_sm1, rows_s, rows_s1,
                 'fields': 'foregroundColor,bold'
             }})
 
-    if reqs3:
-        try:
-            batch_update_com_retry(docs_service, doc_id, reqs3)
-        except Exception as e:
-            print(f"Erro colorir cursos/futuras: {e}")
+    requests += reqs3
+    return requests
+
 
+# =========================================================
+# DOCUMENTO LOCAL (.docx)
+# A DSI inteira é montada em memória como OOXML (textos,
+# três tabelas, células de data mescladas, cores e STATUS) e
+# enviada ao Drive numa única chamada, com conversão para
+# Google Docs — sem insertText/documents().get por etapa.
+# =========================================================
+
+MIME_DOCX         = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+MIME_GOOGLE_DOCS  = "application/vnd.google-apps.document"
+MARGEM_PAGINA_PT  = 28.35
+
+_NS_W = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+_XML_INVALIDO = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+_DOCX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '<Override PartName="/word/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>'
+    '</Types>'
+)
+_DOCX_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '</Relationships>'
+)
+_DOCX_DOCUMENT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>'
+    '</Relationships>'
+)
+# Calibri 12 em todo o documento, como em formatar_documento_completo
+_DOCX_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    f'<w:styles xmlns:w="{_NS_W}">'
+    '<w:docDefaults>'
+    '<w:rPrDefault><w:rPr><w:rFonts w:ascii="Calibri" w:hAnsi="Calibri" w:eastAsia="Calibri" w:cs="Calibri"/>'
+    '<w:sz w:val="24"/><w:szCs w:val="24"/><w:lang w:val="pt-BR"/></w:rPr></w:rPrDefault>'
+    '<w:pPrDefault><w:pPr><w:spacing w:after="0" w:line="276" w:lineRule="auto"/></w:pPr></w:pPrDefault>'
+    '</w:docDefaults>'
+    '<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/></w:style>'
+    '</w:styles>'
+)
+
+def _hex_cor(rgb) -> str:
+    return "".join(f"{round(rgb.get(c, 0) * 255):02X}" for c in ("red", "green", "blue"))
+
+def _twips(pt) -> int:
+    return int(round(pt * 20))
+
+def _docx_run(texto: str, negrito=False, cor=None, tamanho_pt=None) -> str:
+    rpr = ""
+    if negrito:
+        rpr += "<w:b/>"
+    if cor:
+        rpr += f'<w:color w:val="{_hex_cor(cor)}"/>'
+    if tamanho_pt:
+        rpr += f'<w:sz w:val="{int(tamanho_pt * 2)}"/><w:szCs w:val="{int(tamanho_pt * 2)}"/>'
+    if rpr:
+        rpr = f"<w:rPr>{rpr}</w:rPr>"
+    return f'<w:r>{rpr}<w:t xml:space="preserve">{escape(_XML_INVALIDO.sub("", texto))}</w:t></w:r>'
+
+def _docx_paragrafo(runs, centralizado=False, sombreamento=None, compacto=False) -> str:
+    ppr = ""
+    if sombreamento:
+        ppr += f'<w:shd w:val="clear" w:color="auto" w:fill="{_hex_cor(sombreamento)}"/>'
+    if compacto:
+        ppr += '<w:spacing w:before="0" w:after="0" w:line="240" w:lineRule="auto"/>'
+    if centralizado:
+        ppr += '<w:jc w:val="center"/>'
+    if ppr:
+        ppr = f"<w:pPr>{ppr}</w:pPr>"
+    return f"<w:p>{ppr}{''.join(runs)}</w:p>"
+
+def _docx_linha_texto(texto: str, estado: dict) -> str:
+    """Parágrafo do corpo com as mesmas regras de formatar_documento_completo."""
+    full = texto.strip()
+    if not full:
+        return _docx_paragrafo([])
+
+    centralizado = compacto = negrito = False
+    sombreamento = cor = None
+    if PADRAO_CABECALHO_DSI.search(full) or PADRAO_DATA_DSI.search(full):
+        negrito, cor, compacto = True, COR_PRETO, True
+    elif PADRAO_CABECALHO_BTL.search(full):
+        centralizado = True
+    elif PADRAO_TITULO_DSI.search(full):
+        centralizado, sombreamento, negrito = True, COR_CINZA_CLARO, True
+    elif PADRAO_QTS.search(full):
+        centralizado, negrito, cor = True, True, COR_AZUL
+    elif PADRAO_CONFIRMACAO.search(full):
+        negrito, cor = True, COR_LARANJA
+    if any(re.search(padrao, full, re.IGNORECASE) for padrao in PADROES_SECOES_NEGRITO):
+        negrito = True
+
+    runs = [_docx_run(texto, negrito, cor)]
+    if SEC_CURSOS.search(full):
+        estado["cursos"], estado["futuras"] = True, False
+    elif SEC_DATAS.search(full):
+        estado["cursos"] = False
+    elif SEC_FUTURAS.search(full):
+        estado["cursos"], estado["futuras"] = False, True
+    elif (estado["cursos"] or estado["futuras"]) and " - " in texto:
+        # Cursos e atividades futuras: azul negrito após o primeiro " - "
+        corte = texto.find(" - ") + 3
+        runs = [_docx_run(texto[:corte], negrito, cor), _docx_run(texto[corte:], True, COR_AZUL)]
+    return _docx_paragrafo(runs, centralizado, sombreamento, compacto)
+
+def _docx_celula(paragrafos, largura_pt, fundo=None, vmerge=None) -> str:
+    tcpr = f'<w:tcW w:w="{_twips(largura_pt)}" w:type="dxa"/>'
+    if vmerge == "inicio":
+        tcpr += '<w:vMerge w:val="restart"/>'
+    elif vmerge == "continua":
+        tcpr += "<w:vMerge/>"
+    if fundo:
+        tcpr += f'<w:shd w:val="clear" w:color="auto" w:fill="{_hex_cor(fundo)}"/>'
+    tcpr += '<w:vAlign w:val="center"/>'
+    return f"<w:tc><w:tcPr>{tcpr}</w:tcPr>{''.join(paragrafos) or _docx_paragrafo([], True)}</w:tc>"
+
+def _docx_tabela(rows, semana_tipo: str) -> str:
+    cols, headers, larguras = colunas_tabela(semana_tipo)
+    grupos = agrupar_linhas_por_data(rows)
+    cores  = cores_fundo_linhas(rows, grupos)
+    mescla = {}
+    for indices in grupos.values():
+        if len(indices) > 1:
+            mescla[indices[0]] = "inicio"
+            for idx in indices[1:]:
+                mescla[idx] = "continua"
+
+    bordas = "".join(
+        f'<w:{lado} w:val="single" w:sz="8" w:space="0" w:color="000000"/>'
+        for lado in ("top", "left", "bottom", "right", "insideH", "insideV")
+    )
+    xml = (
+        "<w:tbl><w:tblPr>"
+        f'<w:tblW w:w="{_twips(sum(larguras))}" w:type="dxa"/>'
+        f"<w:tblBorders>{bordas}</w:tblBorders>"
+        '<w:tblLayout w:type="fixed"/>'
+        '<w:tblCellMar><w:top w:w="40" w:type="dxa"/><w:left w:w="60" w:type="dxa"/>'
+        '<w:bottom w:w="40" w:type="dxa"/><w:right w:w="60" w:type="dxa"/></w:tblCellMar>'
+        "</w:tblPr><w:tblGrid>"
+        + "".join(f'<w:gridCol w:w="{_twips(l)}"/>' for l in larguras)
+        + "</w:tblGrid>"
+    )
+
+    xml += "<w:tr>" + "".join(
+        _docx_celula([_docx_paragrafo([_docx_run(h, True, COR_BRANCO)], True)], l, COR_CINZA_HEADER)
+        for h, l in zip(headers, larguras)
+    ) + "</w:tr>"
+
+    for idx, row in enumerate(rows):
+        xml += "<w:tr>"
+        for col, largura in zip(cols, larguras):
+            vmerge = mescla.get(idx) if col == "DATA" else None
+            paragrafos = []
+            texto = "" if vmerge == "continua" else texto_celula(row.get(col, ""))
+            for n, linha in enumerate(texto.split("\n") if texto else []):
+                if col == "ATIV_DESC" and row.get("_tem_desc") and n == 1:
+                    run = _docx_run(linha, True, COR_AZUL)
+                elif col == "STATUS" and semana_tipo == "sm1" and n < len(CORES_LINHAS_STATUS):
+                    run = _docx_run(linha, cor=CORES_LINHAS_STATUS[n], tamanho_pt=10)
+                else:
+                    run = _docx_run(linha)
+                paragrafos.append(_docx_paragrafo([run], True))
+            xml += _docx_celula(paragrafos, largura, cores.get(idx), vmerge)
+        xml += "</w:tr>"
+    return xml + "</w:tbl>"
+
+def gerar_docx_dsi(num_fmt, hoje, ini_sm1, fim_sm1, ini_s, fim_s, ini_s1, fim_s1,
+                   si, fase, operacoes_linhas, bullets_cursos, bullets_datas,
+                   rows_sm1, rows_s, rows_s1, ativ_futuras_linhas,
+                   fg, su="", ativ_nao_exec="") -> bytes:
+    conteudo, texto_s, texto_s1, conteudo_final = montar_textos_dsi(
+        num_fmt, hoje, ini_sm1, fim_sm1, ini_s, fim_s, ini_s1, fim_s1,
+        si, fase, operacoes_linhas, bullets_cursos, bullets_datas, ativ_futuras_linhas,
+        fg, su, ativ_nao_exec,
+    )
+    estado = {"cursos": False, "futuras": False}
+    corpo  = []
+
+    def textos(bloco: str):
+        corpo.extend(_docx_linha_texto(linha, estado) for linha in bloco.split("\n"))
+
+    def tabela(rows, semana_tipo):
+        # Elementos que não são parágrafo encerram as seções coloridas
+        estado["cursos"] = estado["futuras"] = False
+        corpo.append(_docx_tabela(rows, semana_tipo))
+
+    textos("\n".join(conteudo))
+    tabela(rows_sm1, "sm1")
+    textos(texto_s.rstrip("\n"))
+    tabela(rows_s, "s")
+    textos(texto_s1.rstrip("\n"))
+    tabela(rows_s1, "s1")
+    textos("\n".join(conteudo_final))
+
+    margem = _twips(MARGEM_PAGINA_PT)
+    documento = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        f'<w:document xmlns:w="{_NS_W}"><w:body>'
+        + "".join(corpo)
+        + '<w:sectPr><w:pgSz w:w="11906" w:h="16838"/>'
+        f'<w:pgMar w:top="{margem}" w:right="{margem}" w:bottom="{margem}" w:left="{margem}" '
+        'w:header="0" w:footer="0" w:gutter="0"/></w:sectPr>'
+        "</w:body></w:document>"
+    )
+
+    saida = io.BytesIO()
+    with zipfile.ZipFile(saida, "w", zipfile.ZIP_DEFLATED) as pacote:
+        for nome, parte in (("[Content_Types].xml", _DOCX_CONTENT_TYPES), ("_rels/.rels", _DOCX_RELS),
+                            ("word/_rels/document.xml.rels", _DOCX_DOCUMENT_RELS),
+                            ("word/styles.xml", _DOCX_STYLES), ("word/document.xml", documento)):
+            # data fixa nas entradas: o mesmo conteúdo gera sempre os mesmos bytes
+            pacote.writestr(zipfile.ZipInfo(nome, date_time=(1980, 1, 1, 0, 0, 0)), parte, zipfile.ZIP_DEFLATED)
+    return saida.getvalue()
+
+CAMPOS_ARQUIVO_CRIADO = mascara_campos("drive.criado", "id")
+
+def criar_google_doc_docx(creds, titulo_doc, num_fmt, ref_date,
+                          ini_sm1, fim_sm1, ini_s, fim_s, ini_s1, fim_s1,
+                          si, fase, operacoes_linhas, bullets_cursos, bullets_datas,
+                          rows_sm1, rows_s, rows_s1, ativ_futuras_linhas,
+                          fg=None, su="", ativ_nao_exec="", exportacao=None):
+    if fg is None:
+        fg = {"finalidade": "", "dia": "", "dobrado": "", "cancao": "", "gs": "", "armado": ""}
+    if exportacao is None:
+        exportacao = ExportacaoRetomavel()
+
+    exportacao.relatar(ROTULOS_FASES["docx"])
+    with etapa("docx"):
+        dados = gerar_docx_dsi(
+            num_fmt, exportacao.hoje, ini_sm1, fim_sm1, ini_s, fim_s, ini_s1, fim_s1,
+            si, fase, operacoes_linhas, bullets_cursos, bullets_datas,
+            rows_sm1, rows_s, rows_s1, ativ_futuras_linhas, fg, su, ativ_nao_exec,
+        )
+    planejar_envio(creds, exportacao, modo="docx")
+    with etapa("documento"):
+        drive_service = servico_google(creds, 'drive', 'v3')
+        media  = MediaIoBaseUpload(io.BytesIO(dados), mimetype=MIME_DOCX, resumable=False)
+        doc_id = exportacao.obter_documento(creds, drive_service)
+    exportacao.marcar(fase="envio")
+    exportacao.relatar(ROTULOS_FASES["envio"])
+    with etapa("envio"):
+        if doc_id:
+            # Documento já existe (tentativa anterior ou mesma DSI): o conteúdo é substituído
+            executar_com_controle(creds, drive_service.files().update(
+                fileId=doc_id, media_body=media, fields=CAMPOS_ARQUIVO_CRIADO,
+            ), "drive")
+        else:
+            doc_id = executar_com_controle(creds, drive_service.files().create(
+                body={'name': titulo_doc, 'mimeType': MIME_GOOGLE_DOCS, 'appProperties': exportacao.propriedades()},
+                media_body=media,
+                fields=CAMPOS_ARQUIVO_CRIADO,
+            ), "drive", idempotente=False)['id']
+    exportacao.marcar(doc_id=doc_id, fase="concluida", concluida=True)
+    registrar_log("DOCX_ENVIADO", f"{titulo_doc} ({len(dados) // 1024} KB)")
+    return doc_id
+
+# =========================================================
+# PLANO DE COTA DA EXPORTAÇÃO
+# Antes de enviar, a exportação conta as chamadas que vai fazer
+# (leituras e escritas no Drive e no Docs, com os batchUpdate já
+# divididos em lotes) e as agenda contra a cota por minuto e o
+# ritmo atual do controlador de cada API. O ControladorTaxa não
+# deixa passar mais que COTAS_MINUTO chamadas em 60 s, então a
+# exportação anda no ritmo previsto em vez de parar num 429.
+# =========================================================
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def requests_por_fase_dsi(num_fmt, hoje, ini_sm1, fim_sm1, ini_s, fim_s, ini_s1, fim_s1,
+                          si, fase, operacoes_linhas, bullets_cursos, bullets_datas,
+                          rows_sm1, rows_s, rows_s1, ativ_futuras_linhas, fg, su="", ativ_nao_exec="") -> list:
+    """[(fase, nº de requests)] da DSI, do mesmo modelo que criar_google_doc envia."""
+    conteudo, texto_s, texto_s1, conteudo_final = montar_textos_dsi(
+        num_fmt, hoje, ini_sm1, fim_sm1, ini_s, fim_s, ini_s1, fim_s1,
+        si, fase, operacoes_linhas, bullets_cursos, bullets_datas, ativ_futuras_linhas,
+        fg, su, ativ_nao_exec,
+    )
+    fases = fases_documento_dsi(conteudo, texto_s, texto_s1, conteudo_final, rows_sm1, rows_s, rows_s1,
+                                bullets_cursos, ativ_futuras_linhas)
+    return [(nome, len(reqs)) for nome, reqs in fases]
+
+def lotes_docs(creds, restantes: int, tamanho_lote: int = TAMANHO_LOTE_DOCS) -> list:
+    """Tamanhos dos batchUpdate, como batch_update_com_retry os dividiria agora."""
+    controlador = controle_taxa(creds, "docs")
+    lotes = []
+    while restantes > 0:
+        lotes.append(controlador.tamanho_lote(restantes, tamanho_lote))
+        restantes -= lotes[-1]
+    return lotes
+
+def planejar_exportacao(creds, por_fase: list = (), aplicados: int = 0, doc_id=None, checkpoint: bool = False,
+                        modo: str = None) -> dict:
+    """Chamadas e duração prevista de uma exportação, sob os controladores do usuário.
+
+    por_fase: [(fase, nº de requests)] (modo docs_api); aplicados: requests já no
+    documento; doc_id: documento já conhecido (retomada confere o corpo com um get);
+    checkpoint: se o doc_id veio do checkpoint, o Drive não é consultado.
+    """
+    modo     = modo or MODO_EXPORTACAO
+    total    = sum(n for _, n in por_fase)
+    drive    = [] if checkpoint else [1]                    # files.list pela chave da DSI
+    docs     = []
+    lotes    = []
+    if modo == "docx":
+        drive.append(1)                                     # files.create/update com o .docx
+    else:
+        if doc_id:
+            docs.append(1)                                  # documents.get da retomada
+        else:
+            drive.append(1)                                 # files.create do documento vazio
+        lotes = lotes_docs(creds, total - aplicados)
+        docs += [1] * len(lotes)
+    segundos = {"drive": controle_taxa(creds, "drive").prever(drive), "docs": controle_taxa(creds, "docs").prever(docs)}
+    return {
+        "modo":      modo,
+        "requests":  total - aplicados if modo != "docx" else 0,
+        "por_fase":  list(por_fase),
+        "lotes":     lotes,
+        "chamadas":  {"drive": len(drive), "docs": len(docs)},
+        "leituras":  (0 if checkpoint else 1) + (1 if doc_id and modo != "docx" else 0),
+        "cota_docs": controle_taxa(creds, "docs").cota_minuto,
+        "segundos":  segundos["drive"] + segundos["docs"],
+    }
+
+def descrever_plano(plano: dict) -> str:
+    """Ex.: "13 batchUpdate (6015 requests) + 2 Drive, cota Docs 60/min → ~28s"."""
+    partes = []
+    if plano["chamadas"]["docs"]:
+        partes.append(f"{len(plano['lotes'])} batchUpdate ({plano['requests']} requests)")
+    partes.append(f"{plano['chamadas']['drive']} Drive")
+    cota = f", cota Docs {plano['cota_docs']:g}/min" if plano["cota_docs"] and plano["chamadas"]["docs"] else ""
+    return f"{' + '.join(partes)}{cota} → ~{plano['segundos']:.0f}s"
+
+def planejar_envio(creds, exportacao: ExportacaoRetomavel, por_fase: list = (), modo: str = None) -> dict:
+    """Plano da exportação antes da primeira chamada: vai para o log, a medição e a tarefa."""
+    plano = planejar_exportacao(
+        creds, por_fase, exportacao.estado["aplicados"], doc_id=exportacao.doc_id,
+        checkpoint=exportacao.doc_id is not None or not exportacao.chave, modo=modo,
+    )
+    registrar_log("PLANO_EXPORTACAO", descrever_plano(plano))
+    contar("plano.previsto_s", plano["segundos"])
+    if exportacao.tarefa:
+        exportacao.tarefa.plano = plano
+    return plano
+
+def criar_google_doc_safe(creds, titulo_doc, num_fmt, ref_date, ini_sm1, fim_sm1, ini_s, *args, tarefa=None, **kwargs):
+    exportar   = criar_google_doc_docx if MODO_EXPORTACAO == "docx" else criar_google_doc
+    argumentos = (titulo_doc, num_fmt, ref_date, ini_sm1, fim_sm1, ini_s) + args
+    avisar     = tarefa.avisar if tarefa else functools.partial(registrar_log, "AVISO_EXPORTACAO")
+    exportacao = ExportacaoRetomavel(
+        chave_exportacao(creds, num_fmt, ini_s),
+        impressao_exportacao(MODO_EXPORTACAO, titulo_doc, num_fmt, ini_sm1, fim_sm1, ini_s, args, kwargs),
+        CheckpointsExportacao(),
+        tarefa=tarefa,
+    )
+    if exportacao.estado["concluida"]:
+        registrar_log("EXPORTACAO_EXISTENTE", f"{exportacao.chave}: {exportacao.doc_id}")
+        return exportacao.doc_id
 
-def criar_google_doc_safe(creds, *args, **kwargs):
     for tentativa in range(3):
         try:
-            return criar_google_doc(creds, *args, **kwargs)
-        except Exception as e:
+            return exportar(creds, *argumentos, exportacao=exportacao, **kwargs)
+        except ExportacaoCancelada:
+            raise
+        except Exception:
             if tentativa < 2:
-                st.warning(f"⚠️ Tentativa {tentativa + 1} falhou. Tentando novamente em 5s...")
+                avisar(f"⚠️ Tentativa {tentativa + 1} falhou. Retomando da fase '{exportacao.estado['fase']}' em 5s...")
+                contar("exportacao.repeticoes")
+                contar("exportacao.espera_s", 5)
                 time.sleep(5)
             else:
-                st.error(f"❌ Erro após 3 tentativas: {e}")
                 raise
 
+# =========================================================
+# FILA DE EXPORTAÇÃO EM SEGUNDO PLANO
+# As exportações rodam num pool de workers compartilhado entre
+# sessões: a página não fica presa num spinner, reruns não as
+# interrompem e várias DSIs (ou usuários) exportam ao mesmo
+# tempo. Cada tarefa informa fase e progresso e pode ser
+# cancelada entre lotes; o checkpoint permite retomá-la depois.
+# =========================================================
+
+MAX_WORKERS_EXPORTACAO = config_dsi("DSI_WORKERS_EXPORTACAO", 2)
+MAX_TAREFAS_GUARDADAS  = 50
+
+class ExportacaoCancelada(Exception):
+    pass
+
+class TarefaExportacao:
+    def __init__(self, sessao: str, titulo: str, numero: int, periodo: str, chave: str, perfilar: bool = False,
+                 recursos: RecursosUsuario = None):
+        self.id         = uuid.uuid4().hex[:8]
+        self.sessao     = sessao
+        self.titulo     = titulo
+        self.numero     = numero
+        self.periodo    = periodo
+        self.chave      = chave
+        self.status     = "na_fila"   # na_fila, executando, concluida, erro, cancelada
+        self.etapa      = "na fila"
+        self.feito      = 0
+        self.total      = 0
+        self.doc_id     = None
+        self.erro       = None
+        self.medicao    = None        # Medicao da execução (etapas, chamadas, esperas)
+        self.perfilar   = perfilar    # roda sob PerfilExecucao
+        self.perfil     = None        # nome do perfil salvo em DIR_PERFIS
+        self.plano      = None        # planejar_exportacao(): chamadas e duração prevista
+        self.recursos   = recursos    # RecursosUsuario resolvidos na sessão, ativos no worker
+        self.criada_em  = time.time()
+        self.registrada = False       # já lançada no histórico da sessão
+        self._cancelar  = threading.Event()
+
+    @property
+    def ativa(self) -> bool:
+        return self.status in ("na_fila", "executando")
+
+    def relatar(self, etapa: str, feito: int = 0, total: int = 0):
+        self.etapa, self.feito, self.total = etapa, feito, total
+        if self._cancelar.is_set():
+            raise ExportacaoCancelada(self.id)
+
+    def avisar(self, mensagem: str):
+        self.etapa = mensagem
+
+    def cancelar(self):
+        self._cancelar.set()
+
+    def descricao(self) -> str:
+        """Ex.: "tabela S+1: estilo 3/7"."""
+        return f"{self.etapa} {self.feito}/{self.total}" if self.total else self.etapa
+
+class FilaExportacao:
+    def __init__(self, max_workers: int = MAX_WORKERS_EXPORTACAO):
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="exportacao")
+        self._tarefas  = {}
+        self._lock     = threading.Lock()
+
+    def submeter(self, tarefa: TarefaExportacao, funcao, *args, **kwargs) -> TarefaExportacao:
+        """Enfileira funcao(*args, tarefa=tarefa, **kwargs); a mesma DSI do mesmo usuário (chave) não roda duas vezes ao mesmo tempo."""
+        with self._lock:
+            ativa = next((t for t in self._tarefas.values() if t.chave == tarefa.chave and t.ativa), None)
+            if ativa:
+                return ativa
+            self._tarefas[tarefa.id] = tarefa
+            finalizadas = sorted((t for t in self._tarefas.values() if not t.ativa), key=lambda t: t.criada_em)
+            for antiga in finalizadas[:max(0, len(self._tarefas) - MAX_TAREFAS_GUARDADAS)]:
+                del self._tarefas[antiga.id]
+        self._executor.submit(self._executar, tarefa, funcao, args, kwargs)
+        return tarefa
+
+    def _executar(self, tarefa: TarefaExportacao, funcao, args, kwargs):
+        with medir("exportacao", tarefa=tarefa.id, titulo=tarefa.titulo, modo=MODO_EXPORTACAO) as medicao:
+            tarefa.medicao = medicao
+            try:
+                tarefa.relatar("iniciando")
+                tarefa.status = "executando"
+                with tarefa.recursos.ativos() if tarefa.recursos else contextlib.nullcontext(), \
+                     perfilar(tarefa.perfilar, f"exportacao-{tarefa.numero:03d}") as perfil:
+                    if perfil:
+                        tarefa.perfil = medicao.rotulos["perfil"] = perfil.nome
+                    tarefa.doc_id = funcao(*args, tarefa=tarefa, **kwargs)
+                tarefa.status, tarefa.etapa, tarefa.total = "concluida", ROTULOS_FASES["concluida"], 0
+                registrar_log("EXPORTACAO_CONCLUIDA", f"{tarefa.id} {tarefa.titulo}")
+            except ExportacaoCancelada:
+                tarefa.status, tarefa.etapa, tarefa.total = "cancelada", "cancelada", 0
+                registrar_log("EXPORTACAO_CANCELADA", f"{tarefa.id} {tarefa.titulo}")
+            except Exception as e:
+                tarefa.status, tarefa.etapa, tarefa.total = "erro", "erro", 0
+                tarefa.erro = str(e)
+                registrar_log("ERRO_EXPORTACAO", f"{tarefa.id} {tarefa.titulo}: {e}")
+            medicao.rotulos["status"] = tarefa.status
+
+    def tarefas(self, sessao: str = None) -> list:
+        with self._lock:
+            lista = [t for t in self._tarefas.values() if sessao is None or t.sessao == sessao]
+        return sorted(lista, key=lambda t: t.criada_em, reverse=True)
+
+@st.cache_resource
+def fila_exportacao() -> FilaExportacao:
+    """Um pool por processo, compartilhado por todas as sessões."""
+    return FilaExportacao()
+
+# =========================================================
+# EXPORTAÇÃO EM LOTE
+# As DSIs de carregar_lote_dsi vão todas para a fila: os workers
+# exportam em paralelo e o controlador mantém o conjunto dentro
+# da cota do Docs. As planilhas saem da memória num só ZIP.
+# =========================================================
+
+def submeter_exportacao_dsi(creds, sessao: str, num_doc: int, ref_date: datetime.date, dados: dict,
+                            fg=None, su: str = "", ativ_nao_exec: str = "", perfilar: bool = False) -> TarefaExportacao:
+    """Põe a exportação da DSI na fila compartilhada (a mesma DSI ativa não é enfileirada duas vezes)."""
+    num_fmt = f"{int(num_doc):03d}"
+    ini_sm1, fim_sm1, ini_s, fim_s, ini_s1, fim_s1 = semanas_dsi(ref_date)
+    periodo = fmt_periodo_titulo(ini_s1, fim_s1)
+    titulo  = f"DIRETRIZ SEMANAL DE INSTRUÇÃO {num_fmt} ({periodo})"
+    return fila_exportacao().submeter(
+        TarefaExportacao(sessao, titulo, int(num_doc), periodo, chave_exportacao(creds, num_fmt, ini_s),
+                         perfilar=perfilar, recursos=RecursosUsuario(creds)),
+        criar_google_doc_safe,
+        creds, titulo, num_fmt, ref_date,
+        ini_sm1, fim_sm1, ini_s, fim_s, ini_s1, fim_s1,
+        dados["si"], dados["fase"], dados["operacoes_linhas"], dados["bullets_cursos"], dados["bullets_datas"],
+        dados["rows_sm1"], dados["rows_s"], dados["rows_s1"],
+        ativ_futuras_linhas=dados["ativ_futuras_linhas"], fg=fg, su=su, ativ_nao_exec=ativ_nao_exec,
+    )
+
+def exportar_lote_dsi(creds, sessao: str, num_inicial: int, ref_inicial: datetime.date, lote: list,
+                      fg=None, su: str = "", ativ_nao_exec: str = "") -> list:
+    """Uma tarefa por DSI do lote; os workers da fila as exportam em paralelo, sob a cota do Docs."""
+    refs = semanas_do_lote(ref_inicial, len(lote))
+    return [submeter_exportacao_dsi(creds, sessao, num_inicial + k, ref, dados, fg, su, ativ_nao_exec)
+            for k, (ref, dados) in enumerate(zip(refs, lote))]
+
+def planejar_lote_dsi(creds, num_inicial: int, ref_inicial: datetime.date, lote: list,
+                      fg=None, su: str = "", ativ_nao_exec: str = "") -> dict:
+    """Plano somado das DSIs do lote: todas disputam a cota do usuário, então a duração é a do conjunto."""
+    if fg is None:
+        fg = {"finalidade": "", "dia": "", "dobrado": "", "cancao": "", "gs": "", "armado": ""}
+    planos = []
+    for k, (ref, dados) in enumerate(zip(semanas_do_lote(ref_inicial, len(lote)), lote)):
+        por_fase = [] if MODO_EXPORTACAO == "docx" else requests_por_fase_dsi(
+            f"{num_inicial + k:03d}", data_hoje(), *semanas_dsi(ref),
+            dados["si"], dados["fase"], dados["operacoes_linhas"], dados["bullets_cursos"], dados["bullets_datas"],
+            dados["rows_sm1"], dados["rows_s"], dados["rows_s1"], dados["ativ_futuras_linhas"], fg, su, ativ_nao_exec,
+        )
+        planos.append(planejar_exportacao(creds, por_fase))
+    chamadas = {api: sum(p["chamadas"][api] for p in planos) for api in ("drive", "docs")}
+    return {
+        "modo":      MODO_EXPORTACAO,
+        "dsis":      len(planos),
+        "requests":  sum(p["requests"] for p in planos),
+        "por_fase":  [],
+        "lotes":     [n for p in planos for n in p["lotes"]],
+        "chamadas":  chamadas,
+        "leituras":  sum(p["leituras"] for p in planos),
+        "cota_docs": controle_taxa(creds, "docs").cota_minuto,
+        "segundos":  controle_taxa(creds, "drive").prever([1] * chamadas["drive"]) + controle_taxa(creds, "docs").prever([1] * chamadas["docs"]),
+    }
+
+def planilhas_lote_dsi(num_inicial: int, ref_inicial: datetime.date, lote: list) -> bytes:
+    """ZIP com a planilha de cada DSI do lote."""
+    saida = io.BytesIO()
+    with zipfile.ZipFile(saida, "w", zipfile.ZIP_DEFLATED) as zf:
+        for k, (ref, dados) in enumerate(zip(semanas_do_lote(ref_inicial, len(lote)), lote)):
+            num_fmt = f"{num_inicial + k:03d}"
+            planilha = exportar_excel(dados["rows_sm1"], dados["rows_s"], dados["rows_s1"], num_fmt, dados["si"],
+                                      dados["fase"], dados["operacoes_linhas"], dados["ativ_futuras_linhas"])
+            ext = "xlsx" if planilha[:2] == b"PK" else "csv"
+            zf.writestr(zipfile.ZipInfo(f"DSI_{num_fmt}_{ref}.{ext}", date_time=(1980, 1, 1, 0, 0, 0)), planilha)
+    return saida.getvalue()
+
+ICONES_TAREFA = {"na_fila": "⏳", "executando": "⚙️", "concluida": "✅", "erro": "❌", "cancelada": "🚫"}
+
+def painel_tarefas_exportacao():
+    """Lista as exportações da sessão; lança no histórico as que terminaram."""
+    tarefas = fila_exportacao().tarefas(st.session_state.sessao_id)
+    novas   = [t for t in tarefas if t.status == "concluida" and not t.registrada]
+    for tarefa in novas:
+        tarefa.registrada = True
+        salvar_historico(tarefa.numero, tarefa.periodo, tarefa.doc_id)
+        st.session_state.doc_criado = tarefa.doc_id
+    if novas:
+        st.rerun()
+
+    if not tarefas:
+        st.info("Nenhuma exportação nesta sessão")
+        return
+    for tarefa in tarefas[:10]:
+        st.markdown(f"{ICONES_TAREFA[tarefa.status]} **DSI {tarefa.numero:03d}** `{tarefa.id}` — {tarefa.descricao()}")
+        if tarefa.total:
+            st.progress(min(1.0, tarefa.feito / tarefa.total))
+        if tarefa.ativa and st.button("✖ Cancelar", key=f"cancelar_{tarefa.id}"):
+            tarefa.cancelar()
+        if tarefa.status == "concluida" and tarefa.doc_id:
+            st.markdown(f"[📄 Abrir](https://docs.google.com/document/d/{tarefa.doc_id}/edit)")
+        if tarefa.erro:
+            st.caption(tarefa.erro[:200])
+        if tarefa.plano and tarefa.ativa:
+            st.caption(f"📐 previsto: {descrever_plano(tarefa.plano)}")
+        if tarefa.perfil:
+            st.caption(f"🔬 perfil `{tarefa.perfil}`")
+
+# st.fragment (>= 1.37) ou st.experimental_fragment: o painel se atualiza sozinho sem rerun da página
+_fragmento = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+if _fragmento:
+    painel_tarefas_exportacao = _fragmento(run_every=2)(painel_tarefas_exportacao)
+
+
+def formulario_formatura_geral():
+    """Campos da Formatura Geral; os valores ficam em st.session_state (fg_*) para a exportação."""
+    st.text_input("1) Finalidade:", key="fg_finalidade")
+    st.text_input("2) Dia:", placeholder="ex: 25/02/2026", key="fg_dia")
+    st.text_input("3) Dobrado:", key="fg_dobrado")
+    st.text_input("4) Canção:", key="fg_cancao")
+    st.text_input("5) GS:", key="fg_gs")
+    st.text_input("6) Armado e Equipado:", key="fg_armado")
+
+# Digitar na Formatura Geral reexecuta só o fragmento, não a página inteira
+if _fragmento:
+    formulario_formatura_geral = _fragmento(formulario_formatura_geral)
+
+# =========================================================
+# EXECUÇÃO SEM INTERFACE
+# `python dsi_app.py --numero 6 --data 2026-03-02` carrega os
+# dados e exporta a DSI sem o Streamlit. Com DSI_MODO_GOOGLE=
+# "offline" e DSI_HOJE fixo, a execução é determinística: mesmas
+# gravações, mesmo documento local, mesmo doc_id.
+# =========================================================
+
+def credenciais_sem_interface():
+    if MODO_GOOGLE == "offline":
+        return dsi_offline.CredenciaisLocais(google_local())
+    caminho = config_dsi("DSI_TOKEN_ARQUIVO", "")
+    if not caminho:
+        raise SystemExit("❌ Sem interface: use DSI_MODO_GOOGLE=offline ou informe em DSI_TOKEN_ARQUIVO um token OAuth autorizado.")
+    creds = Credentials.from_authorized_user_file(caminho, SCOPES)
+    return recursos_google(chave_credencial(creds), creds).creds
+
+def gerar_dsi(creds, num_doc: int, ref_date: datetime.date, incluir_cmt: bool = True, incluir_pgi: bool = True,
+              fg=None, su: str = "", ativ_nao_exec: str = ""):
+    """Carga e exportação da DSI, como o botão EXPORTAR DOCS: (doc_id, dados)."""
+    num_fmt = f"{int(num_doc):03d}"
+    ini_sm1, fim_sm1, ini_s, fim_s, ini_s1, fim_s1 = semanas_dsi(ref_date)
+    titulo_dsi = f"DIRETRIZ SEMANAL DE INSTRUÇÃO {num_fmt} ({fmt_periodo_titulo(ini_s1, fim_s1)})"
+    with etapa("dados"):
+        dados = carregar_dados_dsi(chave_credencial(creds), creds, ref_date, incluir_cmt, incluir_pgi)
+    with etapa("exportacao"):
+        doc_id = criar_google_doc_safe(
+            creds, titulo_dsi, num_fmt, ref_date,
+            ini_sm1, fim_sm1, ini_s, fim_s, ini_s1, fim_s1,
+            dados["si"], dados["fase"], dados["operacoes_linhas"], dados["bullets_cursos"], dados["bullets_datas"],
+            dados["rows_sm1"], dados["rows_s"], dados["rows_s1"],
+            ativ_futuras_linhas=dados["ativ_futuras_linhas"], fg=fg, su=su, ativ_nao_exec=ativ_nao_exec,
+        )
+    return doc_id, dados
+
+def gerar_lote_dsi(creds, num_inicial: int, ref_inicial: datetime.date, quantidade: int,
+                   incluir_cmt: bool = True, incluir_pgi: bool = True, fg=None, su: str = "", ativ_nao_exec: str = ""):
+    """Carga única e exportação paralela de `quantidade` DSIs: (tarefas, lote), após todas terminarem."""
+    with etapa("dados"):
+        lote = carregar_lote_dsi(chave_credencial(creds), creds, ref_inicial, quantidade, incluir_cmt, incluir_pgi)
+    with etapa("plano"):
+        registrar_log("PLANO_LOTE", descrever_plano(planejar_lote_dsi(creds, num_inicial, ref_inicial, lote, fg, su, ativ_nao_exec)))
+    with etapa("exportacao"):
+        tarefas = exportar_lote_dsi(creds, "sem_interface", num_inicial, ref_inicial, lote, fg, su, ativ_nao_exec)
+        while any(t.ativa for t in tarefas):
+            time.sleep(0.2)
+    return tarefas, lote
+
+def main_sem_interface(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Gera a DSI sem a interface Streamlit.")
+    parser.add_argument("--numero", type=int, default=6, help="nº da DSI / QTS")
+    parser.add_argument("--data", type=datetime.date.fromisoformat, help="data de referência AAAA-MM-DD (padrão: hoje)")
+    parser.add_argument("--sem-cmt", action="store_true", help="não incluir a agenda do Cmt")
+    parser.add_argument("--sem-pgi", action="store_true", help="não incluir a agenda PGI")
+    parser.add_argument("--saida", help="JSON com o doc_id, os dados carregados e, offline, o corpo do documento")
+    parser.add_argument("--perfil", action="store_true", help="salva perfil (.pstats e .folded) da execução em DSI_DIR_PERFIS")
+    parser.add_argument("--semanas", type=int, default=1, choices=range(1, MAX_SEMANAS_LOTE + 1), metavar="N",
+                        help=f"gera N DSIs seguidas (nº e semana crescentes) com uma só carga, até {MAX_SEMANAS_LOTE}")
+    parser.add_argument("--planilhas", help="ZIP com as planilhas das DSIs geradas")
+    args = parser.parse_args(argv)
+
+    creds = credenciais_sem_interface()
+    ref   = args.data or data_hoje()
+    with medir("sem_interface", numero=args.numero, semanas=args.semanas, modo=MODO_GOOGLE,
+               exportacao=MODO_EXPORTACAO) as medicao, \
+         perfilar(args.perfil or perfil_pedido("exportacao"), f"sem_interface-{args.numero:03d}"):
+        if args.semanas > 1:
+            tarefas, lote = gerar_lote_dsi(creds, args.numero, ref, args.semanas, not args.sem_cmt, not args.sem_pgi)
+        else:
+            doc_id, dados = gerar_dsi(creds, args.numero, ref, not args.sem_cmt, not args.sem_pgi)
+    registrar_log("MEDICAO", f"{medicao.segundos:.2f}s, {len(medicao.etapas)} etapas → {ARQUIVO_METRICAS}")
+
+    if args.semanas > 1:
+        for tarefa in tarefas:
+            print(tarefa.doc_id if tarefa.status == "concluida" else f"DSI {tarefa.numero:03d}: {tarefa.status} {tarefa.erro or ''}")
+        if args.planilhas:
+            with open(args.planilhas, "wb") as f:
+                f.write(planilhas_lote_dsi(args.numero, ref, lote))
+        if args.saida:
+            resultado = {"modo": MODO_GOOGLE, "exportacao": MODO_EXPORTACAO, "lote": [
+                {"numero": t.numero, "doc_id": t.doc_id, "status": t.status, "dados": d} for t, d in zip(tarefas, lote)
+            ]}
+            with open(args.saida, "w", encoding="utf-8") as f:
+                json.dump(resultado, f, ensure_ascii=False, indent=1, sort_keys=True, default=str)
+        return 0 if all(t.status == "concluida" for t in tarefas) else 1
+
+    print(doc_id)
+    if args.planilhas:
+        with open(args.planilhas, "wb") as f:
+            f.write(planilhas_lote_dsi(args.numero, ref, [dados]))
+    if args.saida:
+        resultado = {"modo": MODO_GOOGLE, "exportacao": MODO_EXPORTACAO, "doc_id": doc_id, "dados": dados}
+        if MODO_GOOGLE == "offline":
+            doc = creds.google.documento(doc_id)
+            resultado["documento"] = {
+                "titulo": doc.titulo, "conteudo": doc.conteudo(), "requests": doc.aplicados,
+                "docx_sha256": hashlib.sha256(doc.docx).hexdigest() if doc.docx is not None else None,
+            }
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=1, sort_keys=True, default=str)
+    return 0
+
+if __name__ == "__main__" and not st.runtime.exists():
+    raise SystemExit(main_sem_interface())
+
 # =========================================================
 # INTERFACE STREAMLIT
+# Só sob `streamlit run` (__name__ == "__main__"): importado pelos
+# testes ou por bench_dsi.py, o módulo apenas define as funções.
 # =========================================================
 
-st.set_page_config(page_title="DSI 24º BIS", layout="wide")
+if __name__ == "__main__":
+    st.set_page_config(page_title="DSI 24º BIS", layout="wide")
 
-st.markdown("""
+    st.markdown("""
 <style>
     .stApp { background-color: #f0f2f6; }
     .stMarkdown h1 { color: #1f4788; font-weight: bold; }
@@ -1681,116 +4246,194 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-st.title("📋 Diretriz Semanal de Instrução - 24º BIS")
+    st.title("📋 Diretriz Semanal de Instrução - 24º BIS")
 
-for key in ['exportar', 'doc_criado', 'historico']:
-    if key not in st.session_state:
-        st.session_state[key] = False if key == 'exportar' else (None if key == 'doc_criado' else [])
+    for key in ['exportar', 'doc_criado', 'historico']:
+        if key not in st.session_state:
+            st.session_state[key] = False if key == 'exportar' else (None if key == 'doc_criado' else [])
+    if "sessao_id" not in st.session_state:
+        st.session_state.sessao_id = uuid.uuid4().hex
 
-try:
-    creds = get_credentials()
-    srv   = build("calendar", "v3", credentials=creds)
+    # Medição desta carga da página; as exportações medem a si mesmas no worker (tarefa.medicao)
+    medicao_pagina  = Medicao("pagina", sessao=st.session_state.sessao_id[:8])
+    _token_medicao  = _MEDICAO.set(medicao_pagina)
 
-    with st.sidebar:
-        st.header("⚙️ Parâmetros da DSI")
+    # ?perfil=pagina perfila só este rerun; ?perfil=exportacao, a próxima exportação da sessão;
+    # ?perfil=tudo fica na URL e perfila todos
+    pedido_perfil = str(_first_param_value(st.query_params.get("perfil", ""))).strip().lower()
+    perfil_pagina = PerfilExecucao("pagina").iniciar() if perfil_pedido("pagina", pedido_perfil) else None
+    if pedido_perfil == "pagina":
+        del st.query_params["perfil"]
 
-        num_doc  = st.number_input("Nº da DSI / QTS", min_value=1, max_value=999, value=6, step=1)
-        num_fmt  = f"{int(num_doc):03d}"
-        ref_date = st.date_input("Data de referência (para calcular S)", value=datetime.date.today())
+    try:
+        with etapa("credenciais"):
+            creds = get_credentials()
 
-        incluir_cmt = st.checkbox("Incluir agenda do Cmt",   value=True)
-        incluir_pgi = st.checkbox("Incluir agenda PGI 2026", value=True)
+        with st.sidebar:
+            st.header("⚙️ Parâmetros da DSI")
 
-        col1, col2 = st.columns(2)
-        with col1:
-            if st.button("🔄 ATUALIZAR", type="primary", use_container_width=True):
-                st.cache_data.clear()
-                st.session_state.exportar   = False
-                st.session_state.doc_criado = None
-                st.rerun()
-        with col2:
-            if st.button("📄 EXPORTAR DOCS", type="secondary", use_container_width=True):
-                st.session_state.exportar = True
+            num_doc  = st.number_input("Nº da DSI / QTS", min_value=1, max_value=999, value=6, step=1)
+            num_fmt  = f"{int(num_doc):03d}"
+            ref_date = st.date_input("Data de referência (para calcular S)", value=data_hoje())
 
-        st.markdown("---")
-        with st.expander("📚 Histórico de DSIs"):
-            historico = st.session_state.get("historico", [])
-            if historico:
-                for item in reversed(historico[-10:]):
-                    st.markdown(f"**DSI {item['numero']:03d}** - {item['periodo']}")
-                    st.markdown(f"[📄 Abrir](https://docs.google.com/document/d/{item['doc_id']}/edit)")
-                    st.markdown("---")
-            else:
-                st.info("Nenhuma DSI gerada ainda")
+            incluir_cmt = st.checkbox("Incluir agenda do Cmt",   value=True)
+            incluir_pgi = st.checkbox("Incluir agenda PGI 2026", value=True)
 
-        st.markdown("---")
-        st.info("💡 **Dica:** Use Ctrl+F para buscar no documento")
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("🔄 ATUALIZAR", type="primary", use_container_width=True):
+                    if SYNC_INCREMENTAL:
+                        SincronizadorAgendas().vencer_todas()
+                    else:
+                        alteradas = invalidar_agendas_alteradas(creds, CacheEventos())
+                        registrar_log("ATUALIZAR", f"{len(alteradas)} agenda(s) alterada(s)")
+                    st.cache_data.clear()
+                    st.session_state.exportar   = False
+                    st.session_state.doc_criado = None
+                    st.rerun()
+            with col2:
+                if st.button("📄 EXPORTAR DOCS", type="secondary", use_container_width=True):
+                    st.session_state.exportar = True
+
+            st.markdown("---")
+            with st.expander("📚 Histórico de DSIs"):
+                historico = st.session_state.get("historico", [])
+                if historico:
+                    for item in reversed(historico[-10:]):
+                        st.markdown(f"**DSI {item['numero']:03d}** - {item['periodo']}")
+                        st.markdown(f"[📄 Abrir](https://docs.google.com/document/d/{item['doc_id']}/edit)")
+                        st.markdown("---")
+                else:
+                    st.info("Nenhuma DSI gerada ainda")
 
-    ini_s, fim_s = week_range(ref_date)
-    ini_sm1      = ini_s - datetime.timedelta(days=7)
-    fim_sm1      = fim_s - datetime.timedelta(days=7)
-    ini_s1       = ini_s + datetime.timedelta(days=7)
-    fim_s1       = fim_s + datetime.timedelta(days=7)
+            with st.expander("⏳ Exportações", expanded=True):
+                painel_tarefas_exportacao()
+                if not _fragmento and st.button("🔄 Atualizar progresso"):
+                    st.rerun()
 
-    if not validar_datas(ini_s, fim_s1):
-        st.stop()
+            with st.expander("🗂️ Lote de DSIs"):
+                lote_ref = st.date_input("Semana S da primeira DSI", value=ref_date, key="lote_ref")
+                lote_qtd = st.number_input("Quantidade de DSIs", min_value=2, max_value=MAX_SEMANAS_LOTE, value=4, step=1, key="lote_qtd")
+                lote_num = st.number_input("Nº da primeira DSI", min_value=1, max_value=999, value=int(num_doc), step=1, key="lote_num")
+                if st.button("📦 GERAR LOTE", use_container_width=True):
+                    st.session_state.lote = {"ref": lote_ref, "quantidade": int(lote_qtd), "numero": int(lote_num), "exportar": True}
 
-    periodo_titulo = fmt_periodo_titulo(ini_s1, fim_s1)
-    titulo_dsi     = f"DIRETRIZ SEMANAL DE INSTRUÇÃO {num_fmt} ({periodo_titulo})"
-
-    with st.spinner("🔍 Buscando informações dos calendários..."):
-        si                  = buscar_si_duplo(srv, ini_s, fim_s, ini_s1, fim_s1)
-        fase                = buscar_fase(srv, ini_s, fim_s1) or "Mdd Adm"
-        operacoes_linhas    = buscar_operacoes(srv, ini_s, fim_s1)
-        ativ_futuras_linhas = buscar_atividades_futuras(srv, fim_s1)
-
-    linha_qts = f"(QTS nº {num_fmt} - SI: {si} - FASE: {fase})"
-
-    with st.expander("🔍 Debug - SI, FASE, OPERAÇÕES e ATIVIDADES FUTURAS"):
-        st.write(f"**Período S-1:** {ini_sm1.strftime('%d/%m/%Y')} a {fim_sm1.strftime('%d/%m/%Y')}")
-        st.write(f"**Período S:** {ini_s.strftime('%d/%m/%Y')} a {fim_s.strftime('%d/%m/%Y')}")
-        st.write(f"**Período S+1:** {ini_s1.strftime('%d/%m/%Y')} a {fim_s1.strftime('%d/%m/%Y')}")
-        st.write(f"**Ativ. Futuras:** {fim_s1 + datetime.timedelta(days=1)} a {fim_s1 + datetime.timedelta(days=45)}")
-        st.write(f"**SI:** {si} | **FASE:** {fase}")
-        st.write(f"**OPERAÇÕES:** {len(operacoes_linhas)}")
-        st.write(f"**ATIVIDADES FUTURAS:** {len(ativ_futuras_linhas)}")
-        for linha in ativ_futuras_linhas:
-            st.write(f"  {linha}")
+            with st.expander("🔬 Perfis de execução"):
+                painel_perfis()
+
+            st.markdown("---")
+            st.info("💡 **Dica:** Use Ctrl+F para buscar no documento")
+
+        ini_sm1, fim_sm1, ini_s, fim_s, ini_s1, fim_s1 = semanas_dsi(ref_date)
 
-    bullets_cursos = bullets_periodo(srv, IDS["cursos"], ini_s, fim_s1, incluir_responsavel=True)
-    bullets_datas  = bullets_periodo(srv, IDS["datas"],  ini_s, fim_s1)
-    feriados       = buscar_feriados(srv, ini_sm1, fim_s1)
+        if not validar_datas(ini_s, fim_s1):
+            st.stop()
+
+        periodo_titulo = fmt_periodo_titulo(ini_s1, fim_s1)
+        titulo_dsi     = f"DIRETRIZ SEMANAL DE INSTRUÇÃO {num_fmt} ({periodo_titulo})"
+
+        with etapa("dados"):
+            dados = carregar_dados_dsi(chave_credencial(creds), creds, ref_date, incluir_cmt, incluir_pgi)
+        if not medicao_pagina.totais.get("memo.falhas"):
+            contar("memo.acertos")
+        si                  = dados["si"]
+        fase                = dados["fase"]
+        operacoes_linhas    = dados["operacoes_linhas"]
+        ativ_futuras_linhas = dados["ativ_futuras_linhas"]
+        bullets_cursos      = dados["bullets_cursos"]
+        bullets_datas       = dados["bullets_datas"]
+        rows_sm1, rows_s, rows_s1 = dados["rows_sm1"], dados["rows_s"], dados["rows_s1"]
+
+        linha_qts = f"(QTS nº {num_fmt} - SI: {si} - FASE: {fase})"
+
+        with st.expander("🔍 Debug - SI, FASE, OPERAÇÕES e ATIVIDADES FUTURAS"):
+            st.write(f"**Período S-1:** {ini_sm1.strftime('%d/%m/%Y')} a {fim_sm1.strftime('%d/%m/%Y')}")
+            st.write(f"**Período S:** {ini_s.strftime('%d/%m/%Y')} a {fim_s.strftime('%d/%m/%Y')}")
+            st.write(f"**Período S+1:** {ini_s1.strftime('%d/%m/%Y')} a {fim_s1.strftime('%d/%m/%Y')}")
+            st.write(f"**Ativ. Futuras:** {fim_s1 + datetime.timedelta(days=1)} a {fim_s1 + datetime.timedelta(days=45)}")
+            st.write(f"**SI:** {si} | **FASE:** {fase}")
+            st.write(f"**OPERAÇÕES:** {len(operacoes_linhas)}")
+            st.write(f"**ATIVIDADES FUTURAS:** {len(ativ_futuras_linhas)}")
+            if dados["erros"]:
+                st.write("**Agendas com erro:** " + ", ".join(f"{_nome_agenda(c)} ({t})" for c, t in dados["erros"].items()))
+            for linha in ativ_futuras_linhas:
+                st.write(f"  {linha}")
 
-    rows_sm1 = construir_tabela_semana(srv, ini_sm1, fim_sm1, incluir_cmt, incluir_pgi, feriados)
-    rows_s   = construir_tabela_semana(srv, ini_s,   fim_s,   incluir_cmt, incluir_pgi, feriados)
-    rows_s1  = construir_tabela_semana(srv, ini_s1,  fim_s1,  incluir_cmt, incluir_pgi, feriados)
+        painel_tempos = st.container()   # preenchido no fim da página, quando todas as etapas já fecharam
 
-    if st.session_state.exportar and st.session_state.doc_criado is None:
         fg = {k: st.session_state.get(f"fg_{k}", "")
               for k in ["finalidade", "dia", "dobrado", "cancao", "gs", "armado"]}
 
-        with st.spinner("📝 Criando documento no Google Docs... (pode levar 1-2 minutos)"):
-            try:
-                doc_id = criar_google_doc_safe(
-                    creds, titulo_dsi, num_fmt, ref_date,
-                    ini_sm1, fim_sm1, ini_s, fim_s, ini_s1, fim_s1,
+        with st.expander("📐 Plano de cota da exportação"):
+            with etapa("plano"):
+                por_fase = [] if MODO_EXPORTACAO == "docx" else requests_por_fase_dsi(
+                    num_fmt, data_hoje(), ini_sm1, fim_sm1, ini_s, fim_s, ini_s1, fim_s1,
                     si, fase, operacoes_linhas, bullets_cursos, bullets_datas,
-                    rows_sm1, rows_s, rows_s1,
-                    ativ_futuras_linhas=ativ_futuras_linhas,
-                    fg=fg,
-                    su=st.session_state.get("su_texto", ""),
-                    ativ_nao_exec=st.session_state.get("ativ_nao_exec", "")
+                    rows_sm1, rows_s, rows_s1, ativ_futuras_linhas, fg,
+                    st.session_state.get("su_texto", ""), st.session_state.get("ativ_nao_exec", ""),
                 )
-                salvar_historico(int(num_doc), periodo_titulo, doc_id)
-                st.session_state.doc_criado = doc_id
-                st.session_state.exportar   = False
-            except Exception as e:
-                st.error(f"❌ Erro ao criar documento: {e}")
-                st.session_state.exportar   = False
-                st.session_state.doc_criado = None
-
-    if st.session_state.doc_criado:
-        st.markdown(f"""
+                salvo = CheckpointsExportacao().obter(chave_exportacao(creds, num_fmt, ini_s))
+                plano = planejar_exportacao(creds, por_fase, doc_id=salvo["doc_id"] if salvo else None,
+                                            checkpoint=bool(salvo and salvo["doc_id"]))
+            st.write(f"**Previsto:** {descrever_plano(plano)}")
+            if por_fase:
+                st.dataframe(pd.DataFrame([{"fase": ROTULOS_FASES[nome], "requests": n} for nome, n in por_fase]),
+                             hide_index=True, use_container_width=True)
+            st.caption(f"Cada batchUpdate leva até {TAMANHO_LOTE_DOCS} requests e conta uma escrita na cota do Docs; "
+                       "o controlador não passa da cota por minuto (DSI_COTA_DOCS_MINUTO) e a duração usa "
+                       "o ritmo e a latência observados até agora.")
+
+        if st.session_state.exportar and st.session_state.doc_criado is None:
+
+            tarefa = submeter_exportacao_dsi(
+                creds, st.session_state.sessao_id, num_doc, ref_date, dados,
+                fg=fg,
+                su=st.session_state.get("su_texto", ""),
+                ativ_nao_exec=st.session_state.get("ativ_nao_exec", ""),
+                perfilar=perfil_pedido("exportacao", pedido_perfil),
+            )
+            st.session_state.exportar = False
+            if pedido_perfil == "exportacao":
+                del st.query_params["perfil"]
+            st.info(f"📝 Exportação da DSI {num_fmt} na fila (tarefa `{tarefa.id}`). "
+                    "Acompanhe o progresso em ⏳ Exportações, na barra lateral.")
+
+        pedido_lote = st.session_state.get("lote")
+        if pedido_lote:
+            with etapa("lote"):
+                lote = carregar_lote_dsi(chave_credencial(creds), creds, pedido_lote["ref"], pedido_lote["quantidade"], incluir_cmt, incluir_pgi)
+            refs_lote = semanas_do_lote(pedido_lote["ref"], len(lote))
+            if pedido_lote.pop("exportar", False):
+                tarefas_lote = exportar_lote_dsi(
+                    creds, st.session_state.sessao_id, pedido_lote["numero"], pedido_lote["ref"], lote,
+                    fg=fg, su=st.session_state.get("su_texto", ""), ativ_nao_exec=st.session_state.get("ativ_nao_exec", ""),
+                )
+                st.info(f"📝 {len(tarefas_lote)} DSIs na fila. Acompanhe em ⏳ Exportações, na barra lateral.")
+            with st.expander(f"🗂️ Lote: DSI {pedido_lote['numero']:03d} a {pedido_lote['numero'] + len(lote) - 1:03d}", expanded=True):
+                st.dataframe(pd.DataFrame([{
+                    "DSI":       f"{pedido_lote['numero'] + k:03d}",
+                    "S+1":       fmt_periodo_titulo(*semanas_dsi(ref)[4:]),
+                    "SI":        d["si"],
+                    "FASE":      d["fase"],
+                    "operações": len(d["operacoes_linhas"]),
+                    "linhas S":  len(d["rows_s"]),
+                    "linhas S+1": len(d["rows_s1"]),
+                } for k, (ref, d) in enumerate(zip(refs_lote, lote))]), hide_index=True, use_container_width=True)
+                with etapa("plano_lote"):
+                    plano_lote = planejar_lote_dsi(creds, pedido_lote["numero"], pedido_lote["ref"], lote, fg,
+                                                   st.session_state.get("su_texto", ""), st.session_state.get("ativ_nao_exec", ""))
+                st.write(f"**Previsto para o lote:** {descrever_plano(plano_lote)}")
+                with etapa("planilhas_lote"):
+                    planilhas = planilhas_lote_dsi(pedido_lote["numero"], pedido_lote["ref"], lote)
+                st.download_button("📊 Baixar planilhas do lote (ZIP)", planilhas,
+                                   file_name=f"DSI_{pedido_lote['numero']:03d}-{pedido_lote['numero'] + len(lote) - 1:03d}.zip",
+                                   mime="application/zip")
+                if st.button("✖ Fechar lote"):
+                    st.session_state.lote = None
+                    st.rerun()
+
+        if st.session_state.doc_criado:
+            st.markdown(f"""
         <div class="success-box">
             <h3>✅ Documento criado com sucesso!</h3>
             <p><a href="https://docs.google.com/document/d/{st.session_state.doc_criado}/edit" target="_blank">
@@ -1798,28 +4441,29 @@ try:
             </a></p>
         </div>
         """, unsafe_allow_html=True)
-        if st.button("🔄 Criar Novo Documento"):
-            st.session_state.doc_criado = None
-            st.rerun()
+            if st.button("🔄 Criar Novo Documento"):
+                st.session_state.doc_criado = None
+                st.rerun()
 
-    try:
-        excel_data = exportar_excel(rows_sm1, rows_s, rows_s1, num_fmt, si, fase, operacoes_linhas, ativ_futuras_linhas)
-        file_ext   = "xlsx" if isinstance(excel_data, bytes) and excel_data[:2] == b'PK' else "csv"
-        mime_type  = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet" if file_ext == "xlsx" else "text/csv"
-        st.download_button(
-            label=f"📊 Baixar {'Excel' if file_ext == 'xlsx' else 'CSV'} (Backup)",
-            data=excel_data,
-            file_name=f"DSI_{num_fmt}_{datetime.date.today()}.{file_ext}",
-            mime=mime_type
-        )
-    except Exception as e:
-        st.warning(f"⚠️ Não foi possível gerar arquivo de backup: {e}")
+        try:
+            with etapa("excel"):
+                excel_data = exportar_excel(rows_sm1, rows_s, rows_s1, num_fmt, si, fase, operacoes_linhas, ativ_futuras_linhas)
+            file_ext   = "xlsx" if isinstance(excel_data, bytes) and excel_data[:2] == b'PK' else "csv"
+            mime_type  = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet" if file_ext == "xlsx" else "text/csv"
+            st.download_button(
+                label=f"📊 Baixar {'Excel' if file_ext == 'xlsx' else 'CSV'} (Backup)",
+                data=excel_data,
+                file_name=f"DSI_{num_fmt}_{data_hoje()}.{file_ext}",
+                mime=mime_type
+            )
+        except Exception as e:
+            st.warning(f"⚠️ Não foi possível gerar arquivo de backup: {e}")
 
-    st.markdown("---")
-    st.markdown("### 📄 Preview do Documento")
+        st.markdown("---")
+        st.markdown("### 📄 Preview do Documento")
 
-    hoje = datetime.date.today()
-    st.markdown(f"""
+        hoje = data_hoje()
+        st.markdown(f"""
     <div style='font-size:10px; text-align:left;'>
     DSI Nº {num_fmt} - S3/24º BIS<br>
     {hoje.day} {formatar_mes_abreviado(hoje)} {str(hoje.year)[-2:]}<br>
@@ -1827,7 +4471,7 @@ try:
     </div>
     """, unsafe_allow_html=True)
 
-    st.markdown(f"""
+        st.markdown(f"""
     <div style='text-align:center; font-weight:bold; font-family:Calibri;'>
     MINISTÉRIO DA DEFESA<br>EXÉRCITO BRASILEIRO<br>
     24º BATALHÃO DE INFANTARIA DE SELVA<br>
@@ -1835,112 +4479,72 @@ try:
     </div>
     """, unsafe_allow_html=True)
 
-    st.markdown(f"<h3 style='text-align:center; font-family:Calibri;'>{titulo_dsi}</h3>", unsafe_allow_html=True)
-    st.markdown(f"<p style='text-align:center; font-family:Calibri;'><strong>{linha_qts}</strong></p>", unsafe_allow_html=True)
-
-    st.markdown("**1. OPERAÇÕES:**")
-    for linha in (operacoes_linhas or ["-"]):
-        st.markdown(linha)
-
-    col1, col2 = st.columns(2)
-    with col1:
-        st.markdown("**2. CURSOS E ESTÁGIOS**")
-        for item in (bullets_cursos or ["-"]):
-            st.markdown(f" {item}")
-    with col2:
-        st.markdown("**3. DATAS COMEMORATIVAS E FERIADOS**")
-        for item in (bullets_datas or ["-"]):
-            st.markdown(f" {item}")
-
-    def render_tabela_html(rows, especial_list, table_id="dsi", semana_tipo="s"):
-        if semana_tipo == "sm1":
-            cols   = ["DATA", "HORA", "ATIV_DESC", "LOCAL", "UNIF", "AGENDA", "STATUS"]
-            hdrs   = ["DATA", "HORA", "ATIVIDADE", "LOCAL", "UNIF", "AG",     "STATUS"]
-            widths = {"DATA":"10%","HORA":"5%","ATIV_DESC":"30%","LOCAL":"20%","UNIF":"5%","AGENDA":"5%","STATUS":"10%"}
-        else:
-            cols   = ["DATA", "HORA", "ATIV_DESC", "LOCAL", "UNIF", "AGENDA", "OBS"]
-            hdrs   = ["DATA", "HORA", "ATIVIDADE", "LOCAL", "UNIF", "AG",     "OBS"]
-            widths = {"DATA":"11%","HORA":"5%","ATIV_DESC":"33%","LOCAL":"22%","UNIF":"5%","AGENDA":"6%","OBS":"8%"}
-        html   = f"""
-        <style>
-        #{table_id} {{width:100%;border-collapse:collapse;font-size:12px;font-family:Calibri,Arial,sans-serif;}}
-        #{table_id} th {{background:#555;color:white;text-align:center;vertical-align:middle;padding:4px 3px;border:1px solid #999;font-weight:bold;}}
-        #{table_id} td {{text-align:center;vertical-align:middle;padding:3px 3px;border:1px solid #ccc;line-height:1.2;}}
-        #{table_id} tr.alt {{background:#ddd;}} #{table_id} tr.normal {{background:#fff;}}
-        #{table_id} tr.especial td {{color:red;background:#fdd;}}
-        .desc-azul {{color:#1258ae;}}
-        </style><table id="{table_id}"><thead><tr>"""
-        for c, h in zip(cols, hdrs):
-            html += f'<th style="width:{widths[c]}">{h}</th>'
-        html += "</tr></thead><tbody>"
-        alt = True
-        for idx, row in enumerate(rows):
-            eh_esp = especial_list[idx] if idx < len(especial_list) else False
-            if row.get("DATA"):
-                alt = not alt
-            cls  = "especial" if eh_esp else ("alt" if alt else "normal")
-            html += f'<tr class="{cls}">'
-            for c in cols:
-                val = row.get(c, "") or ""
-                if c == "ATIV_DESC" and row.get("_tem_desc"):
-                    # description está na segunda linha (separada por \n)
-                    partes = val.split("\n", 1)
-                    if len(partes) == 2:
-                        val = partes[0] + f'<br><span class="desc-azul">' + partes[1] + "</span>"
-                    else:
-                        abre = val.find("(")
-                        if abre >= 0:
-                            val = val[:abre] + f'<span class="desc-azul">' + val[abre:] + "</span>"
-                elif c == "STATUS":
-                    if val:
-                        linhas_s = val.split("\n")
-                        cores_s  = ["#1258ae", "#008021", "#c71414"]
-                        val = "<br>".join(
-                            f'<span style="color:{c};font-size:10px">{l}</span>'
-                            for l, c in zip(linhas_s, cores_s)
-                        )
-                html += f"<td>{val}</td>"
-            html += "</tr>"
-        html += "</tbody></table>"
-        return html
-
-    st.markdown("**4. INSTRUÇÃO**")
-
-    st.markdown(f"**a. Semana (S-1) - {fmt_periodo_titulo(ini_sm1, fim_sm1)}** — :orange[CONFIRMAR OU REAGENDAR]")
-    st.markdown(render_tabela_html(rows_sm1, [r.get('_especial', False) for r in rows_sm1], table_id="tabela_sm1", semana_tipo="sm1"), unsafe_allow_html=True)
-    st.markdown("<br>", unsafe_allow_html=True)
-
-    st.markdown(f"**b. Semana (S) - {fmt_periodo_titulo(ini_s, fim_s)}** — :orange[EXECUTAR OU REAGENDAR]")
-    st.markdown(render_tabela_html(rows_s,  [r.get('_especial', False) for r in rows_s],  table_id="tabela_s",  semana_tipo="s"),  unsafe_allow_html=True)
-    st.markdown("<br>", unsafe_allow_html=True)
-
-    st.markdown(f"**c. Semana (S+1) - {fmt_periodo_titulo(ini_s1, fim_s1)}** — :orange[PLANEJAR]")
-    st.markdown(render_tabela_html(rows_s1, [r.get('_especial', False) for r in rows_s1], table_id="tabela_s1", semana_tipo="s1"), unsafe_allow_html=True)
-    st.markdown("<br>", unsafe_allow_html=True)
-
-    with st.expander("5. FORMATURA GERAL", expanded=False):
-        st.text_input("1) Finalidade:", key="fg_finalidade")
-        st.text_input("2) Dia:", placeholder="ex: 25/02/2026", key="fg_dia")
-        st.text_input("3) Dobrado:", key="fg_dobrado")
-        st.text_input("4) Canção:", key="fg_cancao")
-        st.text_input("5) GS:", key="fg_gs")
-        st.text_input("6) Armado e Equipado:", key="fg_armado")
-
-    with st.expander("6. ATIVIDADES FUTURAS", expanded=True):
-        d_ini_fut = fim_s1 + datetime.timedelta(days=1)
-        d_fim_fut = fim_s1 + datetime.timedelta(days=45)
-        st.caption(f"📅 Período: {d_ini_fut.strftime('%d/%m/%Y')} a {d_fim_fut.strftime('%d/%m/%Y')} — preenchido automaticamente")
-        if ativ_futuras_linhas:
-            for linha in ativ_futuras_linhas:
-                st.markdown(linha)
-        else:
-            st.info("Nenhuma atividade encontrada no período.")
+        st.markdown(f"<h3 style='text-align:center; font-family:Calibri;'>{titulo_dsi}</h3>", unsafe_allow_html=True)
+        st.markdown(f"<p style='text-align:center; font-family:Calibri;'><strong>{linha_qts}</strong></p>", unsafe_allow_html=True)
 
+        st.markdown("**1. OPERAÇÕES:**")
+        for linha in (operacoes_linhas or ["-"]):
+            st.markdown(linha)
 
+        col1, col2 = st.columns(2)
+        with col1:
+            st.markdown("**2. CURSOS E ESTÁGIOS**")
+            for item in (bullets_cursos or ["-"]):
+                st.markdown(f" {item}")
+        with col2:
+            st.markdown("**3. DATAS COMEMORATIVAS E FERIADOS**")
+            for item in (bullets_datas or ["-"]):
+                st.markdown(f" {item}")
+
+        st.markdown("**4. INSTRUÇÃO**")
+
+        with etapa("preview"):
+            html_sm1 = render_tabela_html(rows_sm1, [r.get('_especial', False) for r in rows_sm1], table_id="tabela_sm1", semana_tipo="sm1")
+            html_s   = render_tabela_html(rows_s,   [r.get('_especial', False) for r in rows_s],   table_id="tabela_s",   semana_tipo="s")
+            html_s1  = render_tabela_html(rows_s1,  [r.get('_especial', False) for r in rows_s1],  table_id="tabela_s1",  semana_tipo="s1")
+
+        st.markdown(f"**a. Semana (S-1) - {fmt_periodo_titulo(ini_sm1, fim_sm1)}** — :orange[CONFIRMAR OU REAGENDAR]")
+        st.markdown(html_sm1, unsafe_allow_html=True)
+        st.markdown("<br>", unsafe_allow_html=True)
+
+        st.markdown(f"**b. Semana (S) - {fmt_periodo_titulo(ini_s, fim_s)}** — :orange[EXECUTAR OU REAGENDAR]")
+        st.markdown(html_s, unsafe_allow_html=True)
+        st.markdown("<br>", unsafe_allow_html=True)
+
+        st.markdown(f"**c. Semana (S+1) - {fmt_periodo_titulo(ini_s1, fim_s1)}** — :orange[PLANEJAR]")
+        st.markdown(html_s1, unsafe_allow_html=True)
+        st.markdown("<br>", unsafe_allow_html=True)
+
+        with st.expander("5. FORMATURA GERAL", expanded=False):
+            formulario_formatura_geral()
+
+        with st.expander("6. ATIVIDADES FUTURAS", expanded=True):
+            d_ini_fut = fim_s1 + datetime.timedelta(days=1)
+            d_fim_fut = fim_s1 + datetime.timedelta(days=45)
+            st.caption(f"📅 Período: {d_ini_fut.strftime('%d/%m/%Y')} a {d_fim_fut.strftime('%d/%m/%Y')} — preenchido automaticamente")
+            if ativ_futuras_linhas:
+                for linha in ativ_futuras_linhas:
+                    st.markdown(linha)
+            else:
+                st.info("Nenhuma atividade encontrada no período.")
+
+        gravar_metricas(medicao_pagina.finalizar())
+        with painel_tempos:
+            with st.expander("⏱️ Tempos e chamadas por etapa"):
+                exibir_medicao(medicao_pagina, "Carga da página")
+                exportada = next((t for t in fila_exportacao().tarefas(st.session_state.sessao_id) if t.medicao), None)
+                if exportada:
+                    exibir_medicao(exportada.medicao, f"Exportação `{exportada.id}` ({exportada.status})")
+                st.caption("Espera soma o tempo parado de todas as threads. "
+                           f"Métricas em JSON (uma linha por carga/exportação): `{ARQUIVO_METRICAS}`")
 
-except Exception as e:
-    st.error(f"❌ Erro no sistema: {e}")
-    registrar_log("ERRO_SISTEMA", str(e))
-    import traceback
-    with st.expander("Ver detalhes do erro"):
-        st.code(traceback.format_exc())
+    except Exception as e:
+        st.error(f"❌ Erro no sistema: {e}")
+        registrar_log("ERRO_SISTEMA", str(e))
+        import traceback
+        with st.expander("Ver detalhes do erro"):
+            st.code(traceback.format_exc())
+    finally:
+        _MEDICAO.reset(_token_medicao)
+        if perfil_pagina:
+            perfil_pagina.parar()
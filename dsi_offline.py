@@ -0,0 +1,678 @@
+# =========================================================
+# GOOGLE OFFLINE — gravação e serviços locais
+# DSI_MODO_GOOGLE="gravar" usa as APIs reais e grava em
+# DIR_GRAVACOES os eventos devolvidos por events().list (um
+# arquivo por agenda) e as chamadas documents() (docs.jsonl).
+# "offline" troca Calendar, Docs e Drive por serviços locais:
+# o Calendar responde das gravações com a semântica de list
+# (janela, singleEvents, orderBy, paginação) e o Docs mantém o
+# corpo de cada documento nos índices UTF-16 do batchUpdate,
+# recusando o que a API recusaria. Nada sai da máquina.
+#
+# dsi_app.py só importa este módulo fora do modo "real";
+# bench_dsi.py e os testes o usam em qualquer modo. Ele não
+# depende do app: as contas de índice e janela seguem a API,
+# não o código que está sendo conferido.
+# =========================================================
+
+import datetime
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+def erro_http_local(status: int, motivo: str, mensagem: str) -> HttpError:
+    """HttpError com o corpo JSON da API, para o serviço local falhar como o real."""
+    corpo = {"error": {"code": status, "message": mensagem, "errors": [{"reason": motivo, "message": mensagem}]}}
+    return HttpError(httplib2.Response({"status": status}), json.dumps(corpo).encode("utf-8"))
+
+def _instante_rfc3339(valor: str) -> datetime.datetime:
+    dt = datetime.datetime.fromisoformat(valor.replace("Z", "+00:00"))
+    return dt if dt.tzinfo else dt.replace(tzinfo=datetime.timezone.utc)
+
+def _limites_evento(ev):
+    """(início, fim) em UTC como o filtro de janela do events().list; dia inteiro em 00:00 UTC."""
+    start = ev.get("start", {})
+    end   = ev.get("end",   {})
+    if "date" in start:
+        ini = datetime.date.fromisoformat(start["date"])
+        fim = datetime.date.fromisoformat(end.get("date", start["date"]))
+        return (datetime.datetime.combine(ini, datetime.time(), datetime.timezone.utc),
+                datetime.datetime.combine(fim, datetime.time(), datetime.timezone.utc))
+    sdt = start.get("dateTime")
+    edt = end.get("dateTime")
+    if not (sdt and edt):
+        return None, None
+    return _instante_rfc3339(sdt), _instante_rfc3339(edt)
+
+def _arquivo_agenda(diretorio: str, calendar_id: str) -> str:
+    return os.path.join(diretorio, "calendar", re.sub(r"[^\w.@-]", "_", calendar_id) + ".json")
+
+class GravacoesGoogle:
+    """Fixtures: eventos por agenda (mesclados por id a cada resposta) e o log das chamadas Docs."""
+
+    def __init__(self, diretorio: str):
+        self.diretorio = diretorio
+        self._lock     = threading.Lock()
+        os.makedirs(os.path.join(diretorio, "calendar"), exist_ok=True)
+
+    def eventos(self, calendar_id: str):
+        caminho = _arquivo_agenda(self.diretorio, calendar_id)
+        if not os.path.exists(caminho):
+            return None
+        with open(caminho, encoding="utf-8") as f:
+            return json.load(f)["items"]
+
+    def agendas(self) -> dict:
+        """{calendar_id: items} de todas as agendas gravadas."""
+        pasta    = os.path.join(self.diretorio, "calendar")
+        gravadas = {}
+        for nome in sorted(os.listdir(pasta)):
+            if nome.endswith(".json"):
+                with open(os.path.join(pasta, nome), encoding="utf-8") as f:
+                    dados = json.load(f)
+                gravadas[dados["calendarId"]] = dados["items"]
+        return gravadas
+
+    def gravar_eventos(self, calendar_id: str, items: list):
+        with self._lock:
+            atuais = {ev["id"]: ev for ev in (self.eventos(calendar_id) or [])}
+            atuais.update((ev["id"], ev) for ev in items if ev.get("id"))
+            caminho = _arquivo_agenda(self.diretorio, calendar_id)
+            with open(caminho + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"calendarId": calendar_id, "items": list(atuais.values())},
+                          f, ensure_ascii=False, indent=1)
+            os.replace(caminho + ".tmp", caminho)
+
+    def gravar_docs(self, registro: dict):
+        with self._lock, open(os.path.join(self.diretorio, "docs.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+
+class RequisicaoGravada:
+    """Envolve um HttpRequest real e entrega a resposta (ou o erro) ao gravador."""
+
+    def __init__(self, requisicao, ao_responder):
+        self.requisicao   = requisicao
+        self.ao_responder = ao_responder
+
+    def execute(self, *args, **kwargs):
+        try:
+            resposta = self.requisicao.execute(*args, **kwargs)
+        except HttpError as e:
+            self.ao_responder(None, e)
+            raise
+        self.ao_responder(resposta, None)
+        return resposta
+
+class LoteGravado:
+    def __init__(self, lote):
+        self._lote = lote
+
+    def add(self, request, callback=None, request_id=None):
+        def gravar(request_id, resposta, erro):
+            request.ao_responder(resposta, erro)
+            if callback:
+                callback(request_id, resposta, erro)
+        self._lote.add(request.requisicao, callback=gravar, request_id=request_id)
+
+    def execute(self, *args, **kwargs):
+        return self._lote.execute(*args, **kwargs)
+
+class CalendarGravado:
+    def __init__(self, servico, gravacoes: GravacoesGoogle):
+        self._servico   = servico
+        self._gravacoes = gravacoes
+
+    def events(self):
+        return self
+
+    def new_batch_http_request(self, callback=None):
+        return LoteGravado(self._servico.new_batch_http_request(callback=callback))
+
+    def list(self, **params):
+        def ao_responder(resposta, erro):
+            if resposta is not None:
+                self._gravacoes.gravar_eventos(params["calendarId"], resposta.get("items", []))
+        return RequisicaoGravada(self._servico.events().list(**params), ao_responder)
+
+class DocsGravado:
+    def __init__(self, servico, gravacoes: GravacoesGoogle):
+        self._servico   = servico
+        self._gravacoes = gravacoes
+
+    def documents(self):
+        return self
+
+    def get(self, **params):
+        return RequisicaoGravada(self._servico.documents().get(**params), self._gravador("get", params))
+
+    def batchUpdate(self, **params):
+        return RequisicaoGravada(self._servico.documents().batchUpdate(**params), self._gravador("batchUpdate", params))
+
+    def _gravador(self, metodo: str, params: dict):
+        def ao_responder(resposta, erro):
+            self._gravacoes.gravar_docs({"metodo": metodo, "params": params, "resposta": resposta,
+                                         "status": erro.resp.status if erro else 200})
+        return ao_responder
+
+SERVICOS_GRAVADOS = {"calendar": CalendarGravado, "docs": DocsGravado}
+
+def _tam_json(resposta) -> int:
+    return len(json.dumps(resposta, ensure_ascii=False, default=str).encode("utf-8"))
+
+class RequisicaoLocal:
+    """Imita HttpRequest: execute() roda a operação no serviço local.
+    contar(nome, quantidade), se dado, recebe os bytes de cada resposta como "{api}.bytes"."""
+
+    def __init__(self, operacao, latencia: float = 0.0, api: str = None, contar=None):
+        self.operacao = operacao
+        self.latencia = latencia
+        self.api      = api
+        self.contar   = contar
+
+    def execute(self, *args, **kwargs):
+        if self.latencia:
+            time.sleep(self.latencia)
+        resposta = self.operacao()
+        if self.api and self.contar:
+            self.contar(f"{self.api}.bytes", _tam_json(resposta))
+        return resposta
+
+class LoteLocal:
+    """Imita BatchHttpRequest: uma espera para o lote todo e os callbacks na ordem da biblioteca."""
+
+    def __init__(self, callback=None, latencia: float = 0.0, api: str = None, contar=None):
+        self._callback = callback
+        self._latencia = latencia
+        self._api      = api
+        self._contar   = contar
+        self._itens    = []
+
+    def add(self, request, callback=None, request_id=None):
+        self._itens.append((str(len(self._itens) if request_id is None else request_id), request, callback))
+
+    def execute(self, *args, **kwargs):
+        if self._latencia:
+            time.sleep(self._latencia)
+        for request_id, request, callback in self._itens:
+            try:
+                resposta, erro = request.operacao(), None
+            except HttpError as e:
+                resposta, erro = None, e
+            if self._api and self._contar:
+                self._contar(f"{self._api}.bytes", _tam_json(resposta))
+            for cb in (callback, self._callback):
+                if cb:
+                    cb(request_id, resposta, erro)
+
+class CalendarLocal:
+    """O subconjunto de Calendar v3 que o app usa, sobre {calendar_id: items}.
+
+    events().list filtra a janela como a API (fim > timeMin e início < timeMax),
+    descarta eventos-mestre de recorrência com singleEvents, ordena com
+    orderBy="startTime", pagina por maxResults/pageToken e aceita updatedMin,
+    showDeleted e syncToken (nada mudou desde a gravação). Agenda sem gravação
+    responde 404, como uma agenda sem acesso.
+    """
+
+    def __init__(self, agendas: dict, latencia: float = 0.0, contar=None):
+        self.agendas  = agendas
+        self.latencia = latencia
+        self.contar   = contar
+        self.chamadas = 0
+        self._lock    = threading.Lock()
+
+    def events(self):
+        return self
+
+    def new_batch_http_request(self, callback=None):
+        return LoteLocal(callback, self.latencia, "calendar", self.contar)
+
+    def list(self, calendarId, timeMin=None, timeMax=None, singleEvents=False, orderBy=None, maxResults=250,
+             pageToken=None, syncToken=None, updatedMin=None, showDeleted=False, fields=None, **_):
+        def listar():
+            with self._lock:
+                self.chamadas += 1
+            if calendarId not in self.agendas:
+                raise erro_http_local(404, "notFound", "Not Found")
+            if syncToken and (timeMin or timeMax or orderBy or updatedMin):
+                raise erro_http_local(400, "invalid", "syncToken não aceita timeMin, timeMax, orderBy nem updatedMin")
+            if orderBy == "startTime" and not singleEvents:
+                raise erro_http_local(400, "badRequest", "orderBy=startTime exige singleEvents")
+
+            items = [] if syncToken else self.agendas[calendarId]
+            if singleEvents:
+                items = [ev for ev in items if "recurrence" not in ev]
+            if not (showDeleted or syncToken):
+                items = [ev for ev in items if ev.get("status") != "cancelled"]
+            if updatedMin:
+                desde = _instante_rfc3339(updatedMin)
+                items = [ev for ev in items if ev.get("updated") and _instante_rfc3339(ev["updated"]) >= desde]
+            if timeMin or timeMax:
+                ini_janela = _instante_rfc3339(timeMin) if timeMin else None
+                fim_janela = _instante_rfc3339(timeMax) if timeMax else None
+                items = [ev for ev in items if self._na_janela(ev, ini_janela, fim_janela)]
+            if orderBy == "startTime":
+                items = sorted(items, key=lambda ev: _limites_evento(ev)[0])
+
+            inicio   = int(pageToken or 0)
+            tamanho  = max(1, min(int(maxResults), 2500))
+            resposta = {"items": [dict(ev) for ev in items[inicio:inicio + tamanho]]}
+            if inicio + tamanho < len(items):
+                resposta["nextPageToken"] = str(inicio + tamanho)
+            elif not (timeMin or timeMax or orderBy or updatedMin):
+                resposta["nextSyncToken"] = "local"
+            return resposta
+        return RequisicaoLocal(listar, self.latencia, "calendar", self.contar)
+
+    @staticmethod
+    def _na_janela(ev, ini_janela, fim_janela) -> bool:
+        ini, fim = _limites_evento(ev)
+        if ini is None:
+            return False
+        return (ini_janela is None or fim > ini_janela) and (fim_janela is None or ini < fim_janela)
+
+# Marcadores estruturais do corpo local: cada um ocupa um índice, como na API
+MARCA_SECAO, MARCA_TABELA, MARCA_LINHA, MARCA_CELULA, MARCA_FIM_TABELA = "<S>", "<T>", "<R>", "<C>", "<E>"
+MARCAS_CELULA = (MARCA_LINHA, MARCA_CELULA, MARCA_FIM_TABELA)
+
+def _normalizar_texto(texto: str) -> str:
+    return texto.replace("\r\n", "\n").replace("\r", "\n")
+
+def _paragrafo(texto: str, inicio: int) -> dict:
+    fim = inicio + len(texto.encode("utf-16-le")) // 2
+    return {"startIndex": inicio, "endIndex": fim, "paragraph": {"elements": [
+        {"startIndex": inicio, "endIndex": fim, "textRun": {"content": texto}}
+    ]}}
+
+def _unidades_utf16(texto: str) -> list:
+    """Uma posição por unidade UTF-16; a segunda metade de um par substituto fica vazia."""
+    unidades = []
+    for ch in texto:
+        unidades.append(ch)
+        if ord(ch) > 0xFFFF:
+            unidades.append("")
+    return unidades
+
+class DocumentoLocal:
+    """Corpo de um Google Doc com uma posição por índice.
+
+    Texto, quebras de seção e marcadores de tabela, linha, célula e fim de tabela
+    ocupam os mesmos índices que na API, de modo que insertText, insertTable e
+    deleteContentRange deslocam o corpo como no Docs real. mergeTableCells junta
+    o texto das células na primeira, também deslocando o que vem depois; os
+    estilos só são validados (tabela, linhas e colunas existentes) e contados.
+    batchUpdate é atômico: qualquer request inválido descarta o lote inteiro.
+    """
+
+    def __init__(self, doc_id: str, titulo: str, propriedades: dict = None, unidades: list = None, aplicados: dict = None):
+        self.id           = doc_id
+        self.titulo       = titulo
+        self.propriedades = dict(propriedades or {})
+        self.unidades     = unidades or [MARCA_SECAO, "\n"]
+        self.aplicados    = dict(aplicados or {})   # tipo de request -> quantidade
+        self.docx         = None                    # bytes enviados pelo Drive (modo docx)
+
+    @property
+    def fim(self) -> int:
+        return len(self.unidades)
+
+    def aplicar(self, requests: list):
+        u, contagem = list(self.unidades), dict(self.aplicados)
+        for n, request in enumerate(requests):
+            tipo = next(iter(request))
+            operacao = getattr(self, "_" + tipo, None)
+            if operacao is None:
+                raise erro_http_local(400, "badRequest", f"requests[{n}]: {tipo} não suportado pelo serviço local")
+            try:
+                operacao(u, request[tipo])
+            except HttpError:
+                raise
+            except (KeyError, TypeError, ValueError, IndexError) as e:
+                raise erro_http_local(400, "badRequest", f"requests[{n}].{tipo}: {e!r}")
+            contagem[tipo] = contagem.get(tipo, 0) + 1
+        self.unidades, self.aplicados = u, contagem
+
+    @staticmethod
+    def _falhar(mensagem: str):
+        raise erro_http_local(400, "badRequest", mensagem)
+
+    def _posicao_de_texto(self, u: list, indice: int):
+        if not 1 <= indice < len(u):
+            self._falhar(f"Index {indice} must be less than the end index of the referenced segment, {len(u)}.")
+        if len(u[indice]) != 1:
+            self._falhar(f"The insertion index {indice} must be inside the bounds of an existing paragraph.")
+
+    def _indice_de(self, u: list, req: dict) -> int:
+        if "endOfSegmentLocation" in req:
+            return len(u) - 1
+        return req["location"]["index"]
+
+    def _insertText(self, u: list, req: dict):
+        indice = self._indice_de(u, req)
+        self._posicao_de_texto(u, indice)
+        u[indice:indice] = _unidades_utf16(_normalizar_texto(req["text"]))
+
+    def _insertTable(self, u: list, req: dict):
+        indice = self._indice_de(u, req)
+        self._posicao_de_texto(u, indice)
+        linhas, colunas = req["rows"], req["columns"]
+        if linhas < 1 or colunas < 1:
+            self._falhar("Invalid table size.")
+        tabela = ["\n", MARCA_TABELA]
+        for _ in range(linhas):
+            tabela.append(MARCA_LINHA)
+            for _ in range(colunas):
+                tabela += [MARCA_CELULA, "\n"]
+        u[indice:indice] = tabela + [MARCA_FIM_TABELA]
+
+    def _deleteContentRange(self, u: list, req: dict):
+        ini, fim = req["range"]["startIndex"], req["range"]["endIndex"]
+        if not 1 <= ini < fim <= len(u) - 1:
+            self._falhar(f"Invalid deletion range [{ini}, {fim}): the final newline of the segment cannot be deleted.")
+        if u[ini] == "" or u[fim] == "":
+            self._falhar("The range cannot split a surrogate pair.")
+        if u[fim] == MARCA_TABELA:
+            self._falhar("Invalid deletion range: cannot delete the newline before a table.")
+        k = ini
+        while k < fim:
+            if u[k] == MARCA_TABELA:
+                _, fim_tabela = self._tabela_em(u, k)
+                if fim_tabela > fim:
+                    self._falhar("Invalid deletion range: a table must be deleted entirely.")
+                k = fim_tabela
+                continue
+            if u[k] in MARCAS_CELULA or (u[k] == "\n" and u[k + 1] in MARCAS_CELULA):
+                self._falhar("Invalid deletion range: cannot delete table structure or the last newline of a cell.")
+            k += 1
+        del u[ini:fim]
+
+    def _intervalo(self, u: list, req: dict):
+        ini, fim = req["range"]["startIndex"], req["range"]["endIndex"]
+        if not 0 <= ini < fim <= len(u):
+            self._falhar(f"Invalid range [{ini}, {fim}).")
+        self._exigir(req, "fields")
+
+    _updateTextStyle = _updateParagraphStyle = _intervalo
+
+    def _exigir(self, req: dict, *campos):
+        faltando = [c for c in campos if c not in req]
+        if faltando:
+            self._falhar(f"Missing required field(s): {', '.join(faltando)}.")
+
+    def _updateDocumentStyle(self, u: list, req: dict):
+        self._exigir(req, "documentStyle", "fields")
+
+    def _tabela_em(self, u: list, inicio: int):
+        """(células por linha, fim) da tabela que começa em `inicio`."""
+        if not 0 < inicio < len(u) or u[inicio] != MARCA_TABELA:
+            self._falhar(f"Invalid table start location {inicio}: no table starts there.")
+        linhas, k = [], inicio + 1
+        while u[k] != MARCA_FIM_TABELA:
+            if u[k] == MARCA_LINHA:
+                linhas.append(0)
+            elif u[k] == MARCA_CELULA:
+                linhas[-1] += 1
+            k += 1
+        return linhas, k + 1
+
+    def _faixa_tabela(self, u: list, faixa: dict):
+        local    = faixa["tableCellLocation"]
+        linhas, _ = self._tabela_em(u, local["tableStartLocation"]["index"])
+        r, c     = local.get("rowIndex", 0), local.get("columnIndex", 0)
+        rs, cs   = faixa["rowSpan"], faixa["columnSpan"]
+        if rs < 1 or cs < 1 or r < 0 or c < 0 or r + rs > len(linhas) or c + cs > linhas[0]:
+            self._falhar(f"Invalid table range: rows {r}+{rs} of {len(linhas)}, columns {c}+{cs} of {linhas[0]}.")
+        return r, c, rs, cs
+
+    @staticmethod
+    def _celulas_em(u: list, inicio: int) -> list:
+        """[[(início, fim) do conteúdo de cada célula] por linha] da tabela em `inicio`."""
+        linhas, k = [], inicio + 1
+        while u[k] != MARCA_FIM_TABELA:
+            if u[k] == MARCA_LINHA:
+                linhas.append([])
+            elif u[k] == MARCA_CELULA:
+                fim = k + 1
+                while u[fim] not in MARCAS_CELULA:
+                    fim += 1
+                linhas[-1].append((k + 1, fim))
+            k += 1
+        return linhas
+
+    def _updateTableCellStyle(self, u: list, req: dict):
+        if "tableRange" in req:
+            self._faixa_tabela(u, req["tableRange"])
+        else:
+            self._tabela_em(u, req["tableStartLocation"]["index"])
+        self._exigir(req, "tableCellStyle", "fields")
+
+    def _updateTableColumnProperties(self, u: list, req: dict):
+        linhas, _ = self._tabela_em(u, req["tableStartLocation"]["index"])
+        if any(not 0 <= c < linhas[0] for c in req["columnIndices"]):
+            self._falhar(f"Invalid column index: the table has {linhas[0]} columns.")
+
+    def _mergeTableCells(self, u: list, req: dict):
+        """Como na API: o texto das células mescladas é concatenado na primeira,
+        e as demais ficam só com o "\n" final, deslocando o que vem depois."""
+        faixa        = req["tableRange"]
+        r, c, rs, cs = self._faixa_tabela(u, faixa)
+        celulas      = self._celulas_em(u, faixa["tableCellLocation"]["tableStartLocation"]["index"])
+        faixas       = [celulas[i][j] for i in range(r, r + rs) for j in range(c, c + cs)]
+        junto        = [x for ini, fim in faixas if fim - ini > 1 for x in u[ini:fim]] or ["\n"]
+        for ini, fim in reversed(faixas[1:]):
+            u[ini:fim] = ["\n"]
+        ini, fim = faixas[0]
+        u[ini:fim] = junto
+
+    def conteudo(self) -> list:
+        """body.content no formato de documents().get."""
+        u       = self.unidades
+        content = [{"endIndex": 1, "sectionBreak": {}}]
+        tabela  = None
+        inicio, texto = 1, []
+        for i in range(1, len(u)):
+            x = u[i]
+            if x == MARCA_TABELA:
+                tabela = {"startIndex": i, "table": {"tableRows": []}}
+            elif x == MARCA_LINHA:
+                linhas = tabela["table"]["tableRows"]
+                if linhas:
+                    linhas[-1]["endIndex"] = linhas[-1]["tableCells"][-1]["endIndex"] = i
+                linhas.append({"startIndex": i, "tableCells": []})
+            elif x == MARCA_CELULA:
+                celulas = tabela["table"]["tableRows"][-1]["tableCells"]
+                if celulas:
+                    celulas[-1]["endIndex"] = i
+                celulas.append({"startIndex": i, "content": []})
+                inicio, texto = i + 1, []
+            elif x == MARCA_FIM_TABELA:
+                linhas = tabela["table"]["tableRows"]
+                linhas[-1]["endIndex"] = linhas[-1]["tableCells"][-1]["endIndex"] = i
+                tabela["endIndex"] = i + 1
+                tabela["table"] = {"rows": len(linhas), "columns": len(linhas[0]["tableCells"]), "tableRows": linhas}
+                content.append(tabela)
+                tabela, inicio, texto = None, i + 1, []
+            else:
+                texto.append(x)
+                if x == "\n":
+                    destino = tabela["table"]["tableRows"][-1]["tableCells"][-1]["content"] if tabela else content
+                    destino.append(_paragrafo("".join(texto), inicio))
+                    inicio, texto = i + 1, []
+        return content
+
+    def recurso(self) -> dict:
+        return {"documentId": self.id, "title": self.titulo, "body": {"content": self.conteudo()}}
+
+    def para_json(self) -> dict:
+        return {"doc_id": self.id, "titulo": self.titulo, "propriedades": self.propriedades,
+                "unidades": self.unidades, "aplicados": self.aplicados}
+
+class DocsLocal:
+    def __init__(self, google: "GoogleLocal"):
+        self._google = google
+
+    def documents(self):
+        return self
+
+    def get(self, documentId, fields=None, **_):
+        return self._google.requisicao("docs", lambda: self._google.documento(documentId).recurso())
+
+    def batchUpdate(self, documentId, body, **_):
+        def aplicar():
+            with self._google.lock:
+                doc = self._google.documento(documentId)
+                doc.aplicar(body["requests"])
+                self._google.salvar(doc)
+            return {"documentId": documentId, "replies": [{} for _ in body["requests"]]}
+        return self._google.requisicao("docs", aplicar)
+
+class DriveLocal:
+    _RE_PROPRIEDADE = re.compile(r"appProperties has \{ key='([^']*)' and value='([^']*)' \}")
+
+    def __init__(self, google: "GoogleLocal"):
+        self._google = google
+
+    def files(self):
+        return self
+
+    def create(self, body=None, media_body=None, fields=None, **_):
+        def criar():
+            with self._google.lock:
+                doc = self._google.novo_documento(body.get("name", ""), body.get("appProperties"))
+                if media_body is not None:
+                    doc.docx = media_body.getbytes(0, media_body.size())
+                self._google.salvar(doc)
+            return {"id": doc.id}
+        return self._google.requisicao("drive", criar)
+
+    def update(self, fileId, body=None, media_body=None, fields=None, **_):
+        def atualizar():
+            with self._google.lock:
+                doc = self._google.documento(fileId)
+                if media_body is not None:
+                    doc.docx = media_body.getbytes(0, media_body.size())
+                self._google.salvar(doc)
+            return {"id": doc.id}
+        return self._google.requisicao("drive", atualizar)
+
+    def list(self, q="", pageSize=100, fields=None, **_):
+        def listar():
+            filtros = self._RE_PROPRIEDADE.findall(q)
+            with self._google.lock:
+                ids = [doc.id for doc in self._google.documentos.values()
+                       if all(doc.propriedades.get(k) == v for k, v in filtros)]
+            return {"files": [{"id": doc_id} for doc_id in ids[:pageSize]]}
+        return self._google.requisicao("drive", listar)
+
+class GoogleLocal:
+    """Estado compartilhado pelos serviços locais; os documentos persistem em `diretorio`
+    para que checkpoints de exportação sejam retomados entre execuções."""
+
+    def __init__(self, agendas: dict, diretorio: str = None, latencia: float = 0.0, contar=None):
+        self.calendar   = CalendarLocal(agendas, latencia, contar)
+        self.diretorio  = diretorio
+        self.latencia   = latencia
+        self.contar     = contar
+        self.lock       = threading.RLock()
+        self.documentos = {}
+        self._chamadas  = {"docs": 0, "drive": 0}
+        if diretorio:
+            os.makedirs(diretorio, exist_ok=True)
+            for nome in sorted(os.listdir(diretorio)):
+                if nome.endswith(".json"):
+                    with open(os.path.join(diretorio, nome), encoding="utf-8") as f:
+                        doc = DocumentoLocal(**json.load(f))
+                    docx = os.path.join(diretorio, doc.id + ".docx")
+                    if os.path.exists(docx):
+                        with open(docx, "rb") as f:
+                            doc.docx = f.read()
+                    self.documentos[doc.id] = doc
+
+    def servico(self, api: str):
+        if api == "calendar":
+            return self.calendar
+        return DocsLocal(self) if api == "docs" else DriveLocal(self)
+
+    def requisicao(self, api: str, operacao) -> RequisicaoLocal:
+        def contada():
+            with self.lock:
+                self._chamadas[api] += 1
+            return operacao()
+        return RequisicaoLocal(contada, self.latencia, api, self.contar)
+
+    def chamadas(self) -> dict:
+        """Requisições atendidas por API (cada sub-requisição de um lote conta uma)."""
+        return {"calendar": self.calendar.chamadas, **self._chamadas}
+
+    def documento(self, doc_id: str) -> DocumentoLocal:
+        with self.lock:
+            if doc_id not in self.documentos:
+                raise erro_http_local(404, "notFound", f"Requested entity was not found: {doc_id}")
+            return self.documentos[doc_id]
+
+    def novo_documento(self, titulo: str, propriedades: dict = None) -> DocumentoLocal:
+        # id determinístico: a mesma sequência de criações gera os mesmos ids
+        base   = json.dumps([len(self.documentos), titulo, propriedades or {}], sort_keys=True, ensure_ascii=False)
+        doc_id = "local-" + hashlib.sha256(base.encode("utf-8")).hexdigest()[:24]
+        doc    = self.documentos[doc_id] = DocumentoLocal(doc_id, titulo, propriedades)
+        return doc
+
+    def salvar(self, doc: DocumentoLocal):
+        if not self.diretorio:
+            return
+        caminho = os.path.join(self.diretorio, doc.id)
+        with open(caminho + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(doc.para_json(), f, ensure_ascii=False)
+        os.replace(caminho + ".tmp", caminho + ".json")
+        if doc.docx is not None:
+            with open(caminho + ".docx", "wb") as f:
+                f.write(doc.docx)
+
+class CredenciaisLocais:
+    """Credencial do modo offline: aponta para os serviços locais, sem token nem rede."""
+    client_id     = "offline"
+    token         = "offline"
+    refresh_token = None
+    expiry        = None
+    valid         = True
+
+    def __init__(self, google: GoogleLocal):
+        self.google = google
+
+def conferir_docs_gravados(caminho: str) -> list:
+    """Reaplica docs.jsonl (gravado no modo "gravar") em documentos locais e lista
+    onde o serviço local diverge da API: lote aceito de um lado e recusado do outro,
+    ou endIndex diferente num documents().get. Documentos cuja gravação não começa
+    vazia (endIndex 2) são ignorados."""
+    documentos   = {}
+    divergencias = []
+    with open(caminho, encoding="utf-8") as f:
+        registros = [json.loads(linha) for linha in f if linha.strip()]
+    for n, reg in enumerate(registros, 1):
+        doc_id = reg["params"]["documentId"]
+        if doc_id not in documentos:
+            vazio = reg["metodo"] == "get" and reg["status"] == 200 and reg["resposta"]["body"]["content"][-1]["endIndex"] == 2
+            documentos[doc_id] = DocumentoLocal(doc_id, "") if vazio or reg["metodo"] == "batchUpdate" else None
+        doc = documentos[doc_id]
+        if doc is None:
+            continue
+        if reg["metodo"] == "batchUpdate":
+            try:
+                doc.aplicar(reg["params"]["body"]["requests"])
+                aceito = True
+            except HttpError as e:
+                aceito, erro = False, e
+            if aceito != (reg["status"] == 200):
+                divergencias.append(f"linha {n}: batchUpdate {'aceito' if aceito else f'recusado ({erro})'} "
+                                    f"localmente, status {reg['status']} na API")
+        elif reg["status"] == 200:
+            fim_api = reg["resposta"]["body"]["content"][-1]["endIndex"]
+            if fim_api != doc.fim:
+                divergencias.append(f"linha {n}: endIndex {doc.fim} local, {fim_api} na API")
+    return divergencias
@@ -0,0 +1,16 @@
+# =========================================================
+# AMBIENTE DOS TESTES
+# dsi_app lê a configuração do ambiente ao ser importado: os
+# testes rodam no modo offline (serviços locais, sem rede nem
+# credencial), com cache e checkpoints num diretório temporário.
+# =========================================================
+
+import os
+import sys
+import tempfile
+
+os.environ["DSI_MODO_GOOGLE"] = "offline"
+os.environ["DSI_CACHE_DIR"]   = tempfile.mkdtemp(prefix="dsi-testes-")
+os.environ.setdefault("DSI_HOJE", "2026-03-01")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,44 @@
+# =========================================================
+# MOTORES DE EVENTOS: PYTHON x PANDAS
+# DSI_MOTOR_EVENTOS escolhe quem monta as tabelas semanais e
+# as atividades futuras; os dois devem produzir as mesmas
+# linhas, sobre as mesmas agendas sintéticas.
+# =========================================================
+
+import datetime
+
+import pytest
+
+import bench_dsi as bench
+import dsi_app as app
+
+REF_INICIAL = datetime.date(2026, 3, 4)
+
+def armazem_sintetico(semente: int, ref_date: datetime.date, frac_varios_dias: float, frac_recorrentes: float):
+    agendas = bench.agendas_sinteticas(list(dict.fromkeys(app.IDS.values())), 150, frac_varios_dias,
+                                       frac_recorrentes, ref_date, semente)
+    _, creds = bench.servicos_locais(agendas)
+    bench.sem_limite_de_taxa(creds)
+    ini_sm1, _, ini_s, fim_s, ini_s1, fim_s1 = app.semanas_dsi(ref_date)
+    armazem = app.ArmazemEventos(creds)
+    app.planejar_janelas_dsi(armazem, ini_sm1, ini_s, fim_s, ini_s1, fim_s1, True, True)
+    armazem.carregar()
+    return armazem
+
+@pytest.mark.parametrize("frac_varios_dias, frac_recorrentes", [(0.15, 0.1), (0.5, 0.3)])
+@pytest.mark.parametrize("semente", range(1, 4))
+def test_pandas_igual_a_python(semente, frac_varios_dias, frac_recorrentes):
+    ref_date = REF_INICIAL + datetime.timedelta(weeks=semente - 1)
+    armazem  = armazem_sintetico(semente, ref_date, frac_varios_dias, frac_recorrentes)
+    ini_sm1, fim_sm1, ini_s, fim_s, ini_s1, fim_s1 = app.semanas_dsi(ref_date)
+    feriados = app.buscar_feriados(armazem, ini_sm1, fim_s1)
+    for d_ini, d_fim, tipo in ((ini_sm1, fim_sm1, "sm1"), (ini_s, fim_s, "s"), (ini_s1, fim_s1, "s1")):
+        for incluir_cmt, incluir_pgi in ((True, True), (False, False)):
+            python = app.construir_tabela_semana(armazem, d_ini, d_fim, incluir_cmt, incluir_pgi, feriados, semana_tipo=tipo)
+            pandas = app.construir_tabela_semana_pandas(armazem, d_ini, d_fim, incluir_cmt, incluir_pgi, feriados,
+                                                        semana_tipo=tipo)
+            assert python, tipo
+            assert pandas == python, (tipo, incluir_cmt, incluir_pgi)
+    futuras = app.buscar_atividades_futuras(armazem, fim_s1)
+    assert futuras
+    assert app.buscar_atividades_futuras_pandas(armazem, fim_s1) == futuras
@@ -0,0 +1,120 @@
+# =========================================================
+# CONSULTA POR SOBREPOSIÇÃO x VARREDURA ANTERIOR
+# Sobre agendas sintéticas com eventos longos e de fusos
+# variados, os consumidores devem selecionar com a consulta
+# por sobreposição exatamente o que selecionavam com a
+# varredura anterior (-365/+30 dias, filtrada no consumidor).
+# =========================================================
+
+import datetime
+import random
+
+import pytest
+
+import bench_dsi as bench
+import dsi_app as app
+
+RETRO_DIAS_ANTIGO  = 365
+AVANCO_DIAS_ANTIGO = 30
+FUSOS_SINTETICOS   = tuple(datetime.timezone(datetime.timedelta(hours=h)) for h in (-10, -3, 0, 5, 9, 12))
+REF_INICIAL        = datetime.date(2026, 3, 4)
+EVENTOS_POR_AGENDA = 200
+CHAVES             = ("operacoes", "cursos", "datas")
+
+def eventos_longos_sinteticos(rnd: random.Random, ref_date: datetime.date, quantidade: int, prefixo: str) -> list:
+    """Eventos que testam a borda da consulta: dias inteiros de até 400 dias começando até
+    380 dias antes de ref_date, e eventos com horário perto da meia-noite em vários fusos."""
+    items = []
+    for k in range(quantidade):
+        base = {"id": f"{prefixo}x{k}", "status": "confirmed", "summary": rnd.choice(bench.TITULOS_SINTETICOS),
+                "location": rnd.choice(bench.LOCAIS_SINTETICOS), "description": rnd.choice(bench.DESCRICOES_SINTETICAS)}
+        dia = ref_date + datetime.timedelta(days=rnd.randint(-380, 60))
+        if rnd.random() < 0.5:
+            fim = dia + datetime.timedelta(days=rnd.randint(1, 400))
+            items.append(dict(base, start={"date": dia.isoformat()}, end={"date": fim.isoformat()}))
+        else:
+            inicio = datetime.datetime.combine(dia, datetime.time(rnd.choice((0, 1, 22, 23)), rnd.choice((0, 30))),
+                                               rnd.choice(FUSOS_SINTETICOS))
+            duracao = datetime.timedelta(hours=rnd.choice((1, 2, 24, 48, 72)), minutes=rnd.choice((0, 30)))
+            items.append(dict(base, **bench._horario(inicio, duracao)))
+    return items
+
+class VarreduraAntiga:
+    """Armazém que devolve aos consumidores o que a busca anterior devolvia: sobrepostos()
+    é a janela de -365/+30 dias sem filtro (o teste de sobreposição fica com o consumidor),
+    e a janela de operações das atividades futuras volta a começar 365 dias antes."""
+
+    def __init__(self, armazem: app.ArmazemEventos, ini_s: datetime.date, fim_s1: datetime.date):
+        self.armazem = armazem
+        ini_fut = fim_s1 + datetime.timedelta(days=1)
+        for chave in CHAVES:
+            armazem.registrar(app.IDS[chave], *self._janela(ini_s, fim_s1))
+        pedidos = app.pedidos_futuras(ini_fut, fim_s1 + datetime.timedelta(days=app.HORIZONTE_FUTURAS_DIAS))
+        for cal_id, janela in pedidos.items():
+            armazem.registrar(cal_id, *self._janela_futuras(cal_id, janela))
+        armazem.carregar()
+
+    @staticmethod
+    def _janela(d_ini: datetime.date, d_fim: datetime.date):
+        return (d_ini - datetime.timedelta(days=RETRO_DIAS_ANTIGO), d_fim + datetime.timedelta(days=AVANCO_DIAS_ANTIGO))
+
+    @staticmethod
+    def _janela_futuras(calendar_id: str, janela: tuple):
+        if calendar_id != app.IDS["operacoes"]:
+            return janela
+        d_ini, d_fim = janela
+        return d_ini + datetime.timedelta(days=app.MARGEM_FUSO_DIAS - RETRO_DIAS_ANTIGO), d_fim
+
+    def sobrepostos(self, calendar_id: str, d_ini: datetime.date, d_fim: datetime.date):
+        return self.armazem.eventos(calendar_id, *self._janela(d_ini, d_fim))
+
+    def eventos_por_agenda(self, pedidos: dict) -> dict:
+        return self.armazem.eventos_por_agenda({cal_id: self._janela_futuras(cal_id, janela)
+                                                for cal_id, janela in pedidos.items()})
+
+    def __getattr__(self, nome):
+        return getattr(self.armazem, nome)
+
+def armazens(semente: int, ref_date: datetime.date, modo_busca: str):
+    """(armazém da consulta por sobreposição, VarreduraAntiga) sobre as mesmas agendas sintéticas."""
+    rnd     = random.Random(semente)
+    agendas = bench.agendas_sinteticas([app.IDS[c] for c in CHAVES], EVENTOS_POR_AGENDA, ref_date=ref_date, semente=semente)
+    for n, chave in enumerate(CHAVES):
+        agendas[app.IDS[chave]] += eventos_longos_sinteticos(rnd, ref_date, EVENTOS_POR_AGENDA // 4, f"longo{n}")
+    agendas.update({cal_id: [] for cal_id in app.IDS.values() if cal_id not in agendas})
+    _, creds = bench.servicos_locais(agendas)
+    bench.sem_limite_de_taxa(creds)
+
+    ini_sm1, _, ini_s, fim_s, ini_s1, fim_s1 = app.semanas_dsi(ref_date)
+    novo = app.ArmazemEventos(creds, modo_busca=modo_busca)
+    app.planejar_janelas_dsi(novo, ini_sm1, ini_s, fim_s, ini_s1, fim_s1, True, True)
+    novo.carregar()
+    return novo, VarreduraAntiga(app.ArmazemEventos(creds, modo_busca=modo_busca), ini_s, fim_s1)
+
+def consultas(ini_s: datetime.date, fim_s1: datetime.date) -> dict:
+    """O que cada consumidor tira do armazém para a DSI da semana S."""
+    selecionados = {
+        f"selecionados {chave}": lambda a, cal_id=app.IDS[chave]: sorted(
+            e.id for e in a.sobrepostos(cal_id, ini_s, fim_s1) if app.sobrepoe_periodo(e, ini_s, fim_s1))
+        for chave in CHAVES
+    }
+    return dict(selecionados, **{
+        "buscar_operacoes":          lambda a: app.buscar_operacoes(a, ini_s, fim_s1),
+        "bullets cursos":            lambda a: app.bullets_periodo(a, app.IDS["cursos"], ini_s, fim_s1, incluir_responsavel=True),
+        "bullets datas":             lambda a: app.bullets_periodo(a, app.IDS["datas"], ini_s, fim_s1),
+        "buscar_atividades_futuras": lambda a: app.buscar_atividades_futuras(a, fim_s1),
+    })
+
+@pytest.mark.parametrize("modo_busca", ["paralelo", "lote"])
+@pytest.mark.parametrize("semente", range(1, 6))
+def test_consumidores_iguais_a_varredura_antiga(semente, modo_busca):
+    ref_date = REF_INICIAL + datetime.timedelta(weeks=semente - 1)
+    _, _, ini_s, _, _, fim_s1 = app.semanas_dsi(ref_date)
+    novo, antigo = armazens(semente, ref_date, modo_busca)
+    for nome, consulta in consultas(ini_s, fim_s1).items():
+        assert consulta(novo) == consulta(antigo), nome
+
+def test_consulta_busca_menos_que_a_varredura():
+    novo, antigo = armazens(1, REF_INICIAL, "paralelo")
+    for chave in CHAVES:
+        assert len(novo._eventos[app.IDS[chave]][2]) <= len(antigo._eventos[app.IDS[chave]][2]), chave